@@ -23,13 +23,87 @@ DEBUG = os.environ.get("DEBUG", "False") == "True"
 ALLOWED_HOSTS = ["*"]  # Later restrict to your Render domain
 
 # Database
-DATABASES = {
-    "default": dj_database_url.config(
-        default=os.getenv("DATABASE_URL"),  # Render sets this automatically
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{BASE_DIR / 'db.sqlite3'}")  # Render sets this automatically
+
+
+def database_config(url):
+    config = dj_database_url.parse(
+        url,
         conn_max_age=600,
-        ssl_require=True
+        # SQLite has no SSL options; DATABASE_SSL_REQUIRE=False for a local PostgreSQL (e.g. benchmarks)
+        ssl_require=os.getenv("DATABASE_SSL_REQUIRE", str(url.startswith("postgres"))) == "True",
     )
-}
+    if config["ENGINE"] == "django.db.backends.sqlite3":
+        # Local dev: WAL lets readers run alongside the writer, and IMMEDIATE
+        # transactions queue writers instead of failing with "database is locked"
+        config["OPTIONS"] = {
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            "transaction_mode": "IMMEDIATE",
+        }
+    return config
+
+
+DATABASES = {"default": database_config(DATABASE_URL)}
+
+# Read replicas: comma-separated URLs, added as "replica1", "replica2", ...
+# Catalog GETs read from them (store/routers.py); run `manage.py monitor_replicas`
+# so lagging replicas leave the rotation.
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.getenv("DATABASE_REPLICA_URLS", "").split(",")), start=1):
+    DATABASES[f"replica{number}"] = database_config(url.strip())
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["store.routers.ReplicaRouter"]
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))  # seconds behind before leaving the rotation
+REPLICA_STATUS_TTL = 15  # seconds without a monitor report before a replica leaves the rotation
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 10))  # reads from the primary after a write
+
+# Cache (shared Redis in production, per-process memory locally)
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", 300))  # seconds
+CATALOG_CACHE_LOCK_TIMEOUT = 5  # max seconds a miss waits for another worker
+# Price facet bucket edges (KES): <500, 500-1000, ..., 50000+
+CATALOG_PRICE_FACETS = [int(edge) for edge in os.environ.get("CATALOG_PRICE_FACETS", "500,1000,5000,10000,50000").split(",")]
+
+# Per-request SQL accounting (Server-Timing header + slow request log)
+SQL_INSTRUMENTATION = os.environ.get("SQL_INSTRUMENTATION", "False") == "True"
+SQL_SLOW_REQUEST_MS = int(os.environ.get("SQL_SLOW_REQUEST_MS", 500))
+SQL_SLOW_REQUEST_QUERIES = int(os.environ.get("SQL_SLOW_REQUEST_QUERIES", 50))
+
+# Seconds checkout holds stock while the customer pays
+STOCK_RESERVATION_TTL = int(os.environ.get("STOCK_RESERVATION_TTL", 900))
+
+# M-Pesa (Daraja). Defaults are the public sandbox shortcode and passkey.
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000")
+MPESA_BASE_URL = os.environ.get("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+MPESA_CONSUMER_KEY = os.environ.get("MPESA_CONSUMER_KEY", "")
+MPESA_CONSUMER_SECRET = os.environ.get("MPESA_CONSUMER_SECRET", "")
+MPESA_SHORTCODE = os.environ.get("MPESA_SHORTCODE", "174379")
+MPESA_PASSKEY = os.environ.get("MPESA_PASSKEY", "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919")
+MPESA_CALLBACK_URL = os.environ.get("MPESA_CALLBACK_URL", f"{BASE_URL}/mpesa/callback/")
+MPESA_CONNECT_TIMEOUT = float(os.environ.get("MPESA_CONNECT_TIMEOUT", 3.05))  # seconds
+MPESA_READ_TIMEOUT = float(os.environ.get("MPESA_READ_TIMEOUT", 10))
+MPESA_MAX_RETRIES = int(os.environ.get("MPESA_MAX_RETRIES", 3))
+MPESA_POOL_SIZE = int(os.environ.get("MPESA_POOL_SIZE", 10))
+MPESA_TOKEN_REFRESH_MARGIN = 60  # refresh the OAuth token this many seconds before it expires
+
+# STK push outbox (manage.py process_payment_outbox)
+PAYMENT_OUTBOX_CONCURRENCY = int(os.environ.get("PAYMENT_OUTBOX_CONCURRENCY", 8))
+PAYMENT_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("PAYMENT_OUTBOX_MAX_ATTEMPTS", 5))
+PAYMENT_OUTBOX_RETRY_BACKOFF = 5  # seconds before the first retry, doubled each attempt
+PAYMENT_OUTBOX_LEASE = 60  # seconds before a row claimed by a dead worker is retried
 
 # Static files
 STATIC_URL = "/static/"
@@ -54,13 +128,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.QueryInstrumentationMiddleware',  # no-op unless SQL_INSTRUMENTATION=True
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'store.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise, async-capable for ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.middleware.ReplicaRoutingMiddleware',  # no-op without DATABASE_REPLICA_URLS
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -132,18 +208,41 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES":[
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # Builds request.user from the token's claims; no User query per request
+        "store.authentication.StatelessJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticatedOrReadOnly",
     ],
+    # orjson-backed JSON; falls back to the stdlib classes when orjson is missing
+    "DEFAULT_RENDERER_CLASSES": [
+        "store.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "store.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 20,
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.OrderingFilter",
         "rest_framework.filters.SearchFilter",
-    ]
+    ],
+    # Token buckets for store.throttling.TokenBucketThrottle: "N/period" allows
+    # bursts of N, refilled at N per period. Views pick scopes in throttle_buckets.
+    "DEFAULT_THROTTLE_RATES": {
+        "login": os.environ.get("THROTTLE_LOGIN", "20/min"),  # per IP
+        "login_account": os.environ.get("THROTTLE_LOGIN_ACCOUNT", "5/min"),  # per username
+        "register": os.environ.get("THROTTLE_REGISTER", "10/hour"),  # per IP
+        "checkout": os.environ.get("THROTTLE_CHECKOUT", "10/min"),  # per user
+        "checkout_ip": os.environ.get("THROTTLE_CHECKOUT_IP", "30/min"),
+        "stk_push": os.environ.get("THROTTLE_STK_PUSH", "5/min"),  # per user
+        "stk_push_ip": os.environ.get("THROTTLE_STK_PUSH_IP", "20/min"),
+        "mpesa_phone": os.environ.get("THROTTLE_MPESA_PHONE", "3/min"),  # STK prompts per phone
+    },
 }
 
 SIMPLE_JWT = {
@@ -152,6 +251,12 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": True,
     "ALGORITHM": "HS256",
+    # Tokens carry role/username/groups claims for StatelessJWTAuthentication
+    "TOKEN_OBTAIN_SERIALIZER": "store.authentication.PrincipalTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "store.authentication.PrincipalTokenRefreshSerializer",
+    # Blacklist checks consult store.blacklist's membership filter first
+    "TOKEN_VERIFY_SERIALIZER": "store.authentication.PrincipalTokenVerifySerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "store.authentication.PrincipalTokenBlacklistSerializer",
 }
 
 SWAGGER_SETTINGS = {
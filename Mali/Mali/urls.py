@@ -37,6 +37,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('store.auth_urls')),
+    path('async/', include('store.async_urls')),  # ASGI-native views
     path('', include('store.api_urls')), 
     #Swagger Docs
     re_path(r"^swagger(?P<format>\.json|\.yaml)$", schema_view.without_ui(cache_timeout=0), name="schema-json"),
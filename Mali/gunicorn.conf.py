@@ -0,0 +1,27 @@
+# Gunicorn settings, read from the working directory (Render's rootDir).
+# SERVER_MODE=wsgi (default) runs Mali.wsgi on classic sync workers.
+# SERVER_MODE=asgi runs Mali.asgi on Uvicorn workers: async views under
+# /async/ serve many requests at once per worker, sync DRF views run one at
+# a time per worker, as on a sync worker. Switch once `manage.py
+# benchmark_asgi` shows it pays off for the deployed workload.
+import os
+
+mode = os.environ.get("SERVER_MODE", "wsgi")
+
+if mode == "asgi":
+    wsgi_app = "Mali.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "Mali.wsgi:application"
+    worker_class = "sync"
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# cpu_count() reports the host's CPUs, not the instance's share, so no default from it
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))  # must exceed MPESA_CONNECT_TIMEOUT + MPESA_READ_TIMEOUT
+graceful_timeout = 30
+keepalive = 5  # behind Render's proxy, which reuses connections
+# Recycle workers now and then so a slow leak never takes a worker down
+max_requests = 2000
+max_requests_jitter = 200
+accesslog = "-"
@@ -1,7 +1,6 @@
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, CheckoutView, MpesaCallbackView, MpesaSTKPushView, ReviewViewSet, OrderViewSet
+from .views import CategoryViewSet, ProductViewSet, CheckoutView, MpesaCallbackView, MpesaSTKPushView, MpesaSTKPushStatusView, ReviewViewSet, OrderViewSet
 from django.urls import path, include
-from .views import mpesa_callback
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -15,5 +14,5 @@ urlpatterns = [
     path("checkout/", CheckoutView.as_view(), name="checkout"),
     path("mpesa/callback/", MpesaCallbackView.as_view(), name="mpesa-callback"),
     path("payments/mpesa/stkpush/", MpesaSTKPushView.as_view(), name="mpesa-stkpush"),
-    path('mpesa/callback/', mpesa_callback, name='mpesa-callback'),
+    path("payments/mpesa/stkpush/<int:pk>/", MpesaSTKPushStatusView.as_view(), name="mpesa-stkpush-status"),
 ]
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path("products/", async_views.product_list, name="async-product-list"),
+    path("products/<int:pk>/", async_views.product_detail, name="async-product-detail"),
+    path("categories/", async_views.category_list, name="async-category-list"),
+    path("categories/<int:pk>/", async_views.category_detail, name="async-category-detail"),
+    path("payments/mpesa/stkpush/", async_views.stk_push, name="async-mpesa-stkpush"),
+    path("payments/mpesa/stkpush/<int:pk>/", async_views.stk_push_status, name="async-mpesa-stkpush-status"),
+]
@@ -0,0 +1,213 @@
+"""
+Async (ASGI) versions of the catalog reads and the STK push endpoints,
+mounted under /async/. Responses match their DRF counterparts for the
+parameters they support: paging for lists (no filters, search or sparse
+fields). Under an ASGI server a request waiting on Daraja holds no thread,
+so one worker serves many slow gateway calls at once. Django's async ORM
+still runs queries on one thread per process: database-bound reads gain
+little beyond skipping DRF.
+
+Cache reads and writes use the async cache API and throttling runs in a
+thread, so a slow Redis round trip never blocks the event loop.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.throttling import BaseThrottle
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .authentication import StatelessJWTAuthentication
+from .cache import catalog_key, fresh_catalog_reads
+from .models import Category, PaymentRequest, Product, User
+from .mpesa import MpesaError, get_async_client, get_client
+from .outbox import enqueue_stk_push
+from .pagination import StandardResultsSetPagination
+from .renderers import FastJSONRenderer
+from .routers import replica_reads
+from .serializers import CategorySerializer, ProductSerializer, StkPushSerializer
+from .throttling import normalize_phone, throttle_delay
+from .views import gateway_status, payment_request_status, payment_requests_for
+
+renderer = FastJSONRenderer()
+authentication = StatelessJWTAuthentication()
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(renderer.render(data), status=status, content_type="application/json", headers=headers)
+
+
+def error(status, detail):
+    return json_response({"detail": detail}, status=status)
+
+
+async def authenticated_user(request):
+    """(user, None), or (None, error response) without valid credentials."""
+    try:
+        result = await authentication.aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return None, json_response({"detail": exc.detail}, status=401)
+    if result is None:
+        return None, error(401, "Authentication credentials were not provided.")
+    return result[0], None
+
+
+def positive_int(value):
+    """value as an int of at least 1, else None."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def page_params(params):
+    """
+    (page, size) as PageNumberPagination reads them: a bad page_size falls
+    back to the default and page may be "last". page is None when invalid.
+    """
+    pagination = StandardResultsSetPagination
+    size = positive_int(params.get(pagination.page_size_query_param)) or pagination.page_size
+    page = params.get("page", 1)
+    if page not in pagination.last_page_strings:
+        page = positive_int(page)
+    return page, min(size, pagination.max_page_size)
+
+
+async def paginated(request, queryset, serializer_class):
+    """A StandardResultsSetPagination page: one COUNT and one SELECT."""
+    page, size = page_params(request.GET)
+    if page is None:
+        return None
+    count = await queryset.acount()
+    pages = max(math.ceil(count / size), 1)
+    if page in StandardResultsSetPagination.last_page_strings:
+        page = pages
+    if page > pages:
+        return None
+    objects = [obj async for obj in queryset[(page - 1) * size:page * size]]
+    url = request.build_absolute_uri()
+    if page == 1:
+        previous = None
+    elif page == 2:
+        previous = remove_query_param(url, "page")
+    else:
+        previous = replace_query_param(url, "page", page - 1)
+    return {
+        "links": {"next": replace_query_param(url, "page", page + 1) if page < pages else None, "previous": previous},
+        "count": count,
+        "results": serializer_class(objects, many=True).data,
+    }
+
+
+async def cached_list(request, name, queryset, serializer_class):
+    key = catalog_key("async", name, "list", params=request.GET)
+    data = await cache.aget(key)
+    if data is None:
+        with fresh_catalog_reads():
+            data = await paginated(request, queryset, serializer_class)
+        if data is None:
+            return error(404, "Invalid page.")
+        await cache.aset(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    return json_response(data)
+
+
+async def cached_detail(name, queryset, serializer_class, pk):
+    key = catalog_key("async", name, "retrieve", pk)
+    data = await cache.aget(key)
+    if data is None:
+        try:
+            with fresh_catalog_reads():
+                obj = await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            return error(404, f"No {queryset.model._meta.object_name} matches the given query.")
+        data = serializer_class(obj).data
+        await cache.aset(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    return json_response(data)
+
+
+# ------------------- CATALOG -------------------
+@replica_reads
+@require_GET
+async def product_list(request):
+    queryset = Product.objects.defer("search_vector").order_by("-created_at")
+    return await cached_list(request, "product", queryset, ProductSerializer)
+
+
+@replica_reads
+@require_GET
+async def product_detail(request, pk):
+    return await cached_detail("product", Product.objects.defer("search_vector"), ProductSerializer, pk)
+
+
+@replica_reads
+@require_GET
+async def category_list(request):
+    return await cached_list(request, "category", Category.objects.order_by("name"), CategorySerializer)
+
+
+@replica_reads
+@require_GET
+async def category_detail(request, pk):
+    return await cached_detail("category", Category.objects.all(), CategorySerializer, pk)
+
+
+# ------------------- M-PESA -------------------
+@csrf_exempt
+@require_POST
+async def stk_push(request):
+    user, failed = await authenticated_user(request)
+    if failed:
+        return failed
+    if user.role not in (User.UserRole.CUSTOMER, User.UserRole.ADMIN):
+        return error(403, "You do not have permission to perform this action.")
+
+    serializer = StkPushSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=400)
+    phone = serializer.validated_data["phone_number"]
+
+    wait = await sync_to_async(throttle_delay)([
+        ("stk_push", "user", user.pk),
+        ("stk_push_ip", "ip", BaseThrottle().get_ident(request)),
+        ("mpesa_phone", "phone", normalize_phone(phone)),
+    ])
+    if wait:
+        seconds = math.ceil(wait)
+        return json_response(
+            {"detail": f"Request was throttled. Expected available in {seconds} seconds."},
+            status=429, headers={"Retry-After": str(seconds)},
+        )
+
+    # The outbox worker sends it, as for the sync view
+    push = await sync_to_async(enqueue_stk_push)(**serializer.validated_data, customer_id=user.pk)
+    return json_response({"request_id": push.id, "status": push.status}, status=202)
+
+
+@require_GET
+async def stk_push_status(request, pk):
+    user, failed = await authenticated_user(request)
+    if failed:
+        return failed
+    try:
+        push = await payment_requests_for(user).aget(pk=pk)
+    except PaymentRequest.DoesNotExist:
+        return error(404, "No PaymentRequest matches the given query.")
+
+    data = payment_request_status(push)
+    if request.GET.get("live") and push.checkout_request_id:
+        client = get_async_client()
+        try:
+            if client is not None:
+                result = await client.stk_query(push.checkout_request_id)
+            else:  # no httpx: block a pool thread rather than the event loop
+                result = await sync_to_async(get_client().stk_query, thread_sensitive=False)(push.checkout_request_id)
+            data["gateway"] = gateway_status(result)
+        except MpesaError as exc:
+            return json_response({"error": str(exc)}, status=502)
+    return json_response(data)
@@ -1,17 +1,18 @@
 from django.urls import path
-from .views import RegisterView, MeView
+from .views import RegisterView, MeView, TokenObtainView
 
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
+    TokenBlacklistView,
 )
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register' ),
-    path('token/', TokenObtainPairView.as_view(), name = 'token_obtain_pair'),
+    path('token/', TokenObtainView.as_view(), name = 'token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name = 'token_refresh'),
     path('token/verify/', TokenVerifyView.as_view(), name ='token_verify'),
+    path('token/blacklist/', TokenBlacklistView.as_view(), name ='token_blacklist'),
     path('me/', MeView.as_view(), name = 'me'),
     
 ]
@@ -0,0 +1,138 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import (
+    TokenBlacklistSerializer, TokenObtainPairSerializer, TokenRefreshSerializer, TokenVerifySerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+
+from .blacklist import is_blacklisted
+
+User = get_user_model()
+
+ROLE_CLAIM = "role"
+
+
+def add_principal_claims(token, user):
+    """Copy what permission checks need into the token (one query, for the groups)."""
+    token[ROLE_CLAIM] = user.role
+    token["username"] = user.username
+    token["groups"] = sorted(user.groups.values_list("name", flat=True))
+    return token
+
+
+class TokenPrincipal(TokenUser):
+    """
+    The user as described by a validated access token: id, username, role
+    and group names. Enough for RolePermission and ownership checks without
+    a database query. Code that needs the User row uses `full_user()`, which
+    loads it on first access.
+    """
+    UserRole = User.UserRole
+
+    @cached_property
+    def id(self):
+        # simplejwt writes the id claim as a string
+        return User._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def role(self):
+        return self.token[ROLE_CLAIM]
+
+    @cached_property
+    def group_names(self):
+        return frozenset(self.token.get("groups", ()))
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.id)
+
+    def __eq__(self, other):
+        # Ownership checks compare against the User on a model instance
+        if isinstance(other, models.Model):
+            return isinstance(other, User) and other.pk == self.id
+        return super().__eq__(other)
+
+    __hash__ = TokenUser.__hash__
+
+
+def full_user(user):
+    """The User row behind `request.user`, loaded lazily for token principals."""
+    return user.user if isinstance(user, TokenPrincipal) else user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication without the per-request User lookup: tokens carrying
+    a role claim authenticate as a TokenPrincipal. Tokens issued before the
+    claims existed still authenticate through the database.
+
+    The claims are as fresh as the access token (ACCESS_TOKEN_LIFETIME): a
+    deactivated user or a role change takes effect once their current
+    access token expires, and refreshing re-reads both.
+    """
+
+    def get_user(self, validated_token):
+        if ROLE_CLAIM not in validated_token or api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        return TokenPrincipal(validated_token)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; only tokens without the claims touch the database."""
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if ROLE_CLAIM in validated_token and api_settings.USER_ID_CLAIM in validated_token:
+            return TokenPrincipal(validated_token), validated_token
+        return await sync_to_async(self.get_user)(validated_token), validated_token
+
+
+class PrincipalTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_principal_claims(super().get_token(user), user)
+
+
+class PrincipalRefreshToken(RefreshToken):
+    """
+    Refresh token whose new access tokens carry the user's current role and
+    groups. Its blacklist check goes through the membership filter, so a
+    token that was never blacklisted is not looked up in the database.
+    """
+
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = User.objects.filter(pk=self.payload.get(api_settings.USER_ID_CLAIM)).first()
+        if user is not None:
+            add_principal_claims(access, user)
+        return access
+
+
+class PrincipalTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = PrincipalRefreshToken
+
+
+class PrincipalTokenVerifySerializer(TokenVerifySerializer):
+    def validate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if is_blacklisted(token.get(api_settings.JTI_CLAIM)):
+            raise ValidationError(_("Token is blacklisted"))
+        return {}
+
+
+class PrincipalTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = PrincipalRefreshToken
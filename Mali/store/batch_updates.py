@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_generation
+from .models import Product
+
+MAX_CHANGES = 5000
+CHUNK_SIZE = 250  # rows per UPDATE, keeps the CASE under SQLite's parameter limit
+CHANGE_FIELDS = ["price", "stock_quantity", "is_active"]
+
+
+def resolve_ids(changes):
+    """Map each change to a product id with one query; unknown or repeated products are an error."""
+    wanted_ids = [change["id"] for change in changes if "id" in change]
+    wanted_skus = [change["sku"] for change in changes if "sku" in change]
+    pk_by_sku, known_ids = {}, set()
+    for pk, sku in Product.objects.filter(Q(pk__in=wanted_ids) | Q(sku__in=wanted_skus)).values_list("pk", "sku"):
+        pk_by_sku[sku] = pk
+        known_ids.add(pk)
+
+    errors, ids, seen = {}, [], set()
+    for index, change in enumerate(changes):
+        pk = change["id"] if "id" in change else pk_by_sku.get(change["sku"])
+        if pk is None or pk not in known_ids:
+            errors[index] = "Unknown product."
+        elif pk in seen:
+            errors[index] = "Product changed twice in one batch."
+        seen.add(pk)
+        ids.append(pk)
+    if errors:
+        raise ValidationError({"changes": errors})
+    return ids
+
+
+def apply_product_changes(changes):
+    """
+    Apply validated `{id|sku, price?, stock_quantity?, is_active?}` changes
+    in one transaction: one `UPDATE ... SET price = CASE id WHEN ... END`
+    per chunk of rows instead of one fetch and save per product. Fields a
+    change leaves out keep their value. The catalog cache is invalidated
+    once the transaction commits. Returns the number of products updated.
+    """
+    if len(changes) > MAX_CHANGES:
+        raise ValidationError({"changes": f"At most {MAX_CHANGES} changes per batch."})
+    ids = resolve_ids(changes)
+    now = timezone.now()
+    updated = 0
+    with transaction.atomic():
+        for start in range(0, len(changes), CHUNK_SIZE):
+            chunk = list(zip(ids[start:start + CHUNK_SIZE], changes[start:start + CHUNK_SIZE]))
+            values = {"updated_at": now}
+            for field in CHANGE_FIELDS:
+                whens = [When(pk=pk, then=Value(change[field])) for pk, change in chunk if field in change]
+                if whens:
+                    output_field = Product._meta.get_field(field)
+                    values[field] = Case(*whens, default=F(field), output_field=output_field)
+            updated += Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(**values)
+        transaction.on_commit(bump_generation)
+    return updated
@@ -0,0 +1,767 @@
+import importlib.util
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+import requests
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import add_principal_claims
+from .cache import bump_generation
+from .models import (
+    CartItem, Category, MpesaCallback, Order, OrderItem, Payment, PaymentRequest, Product, Review, StockReservation,
+    User,
+)
+from .pagination import CatalogPagination
+
+# Synthetic rows are tagged so they can be found and removed:
+# usernames "bench-u1", category slugs "bench-c1", SKUs "BENCH-0000001"
+PREFIX = "bench"
+SKU_PREFIX = PREFIX.upper() + "-"
+CHECKOUT_PREFIX = f"ws_CO_{PREFIX}_"
+PHONE = "254708374149"  # Daraja sandbox test number
+
+BRANDS = ["Tecno", "Infinix", "Samsung", "Nokia", "Itel", "Oraimo", "Ramtons", "Hotpoint", "Mika", "Bruhm", "Sayona", "Armco"]
+NOUNS = [
+    "phone", "charger", "earphones", "speaker", "television", "fridge", "blender", "kettle", "cooker", "iron",
+    "laptop", "tablet", "router", "powerbank", "watch", "camera", "microwave", "fan", "heater", "radio",
+]
+WORDS = [
+    "durable", "fast", "wireless", "compact", "original", "warranty", "energy", "saving", "smart", "portable",
+    "stainless", "steel", "battery", "display", "bluetooth", "dual", "sim", "memory", "silver", "black",
+    "quality", "family", "kitchen", "office", "solar", "rechargeable", "digital", "home", "sound", "light",
+]
+ORDER_STATUSES = (["delivered"] * 45) + (["paid"] * 20) + (["shipped"] * 10) + (["pending"] * 15) + (["cancelled"] * 10)
+PAYMENT_STATUSES = {"pending": "pending", "cancelled": "failed"}  # anything else was paid
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _raw_delete(queryset):
+    # No per-row signals or cascade collection; callers delete children first
+    return queryset._raw_delete(queryset.db)
+
+
+class DatasetGenerator:
+    """
+    Fill the database with a synthetic shop, `batch_size` rows per INSERT:
+    - A three-level category tree (roots, then ~5 children per parent).
+    - Products spread over all categories, named from a small vocabulary so
+      searches have realistic hit rates, with stock no checkout run exhausts.
+    - Customers; reviews (at most one per customer and product), whose
+      ratings are drawn first so products are inserted with their rating
+      aggregates already filled in; orders of 1-4 lines in a mix of
+      statuses, each with a payment.
+    The same seed writes the same data. Needs a backend that returns primary
+    keys from bulk inserts (PostgreSQL, SQLite 3.35+).
+    """
+
+    def __init__(self, products, categories, users, reviews, orders, seed=42, batch_size=5000, log=None):
+        self.products = products
+        self.categories = categories
+        self.users = users
+        self.reviews = min(reviews, products * users)
+        self.orders = orders
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.category_ids = []
+        self.user_ids = []
+        self.product_ids = []
+        self.product_prices = []
+        self.ratings = array("b")
+
+    def generate(self):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise RuntimeError(f"{connection.vendor} does not return ids from bulk inserts.")
+        for step in [self.create_categories, self.create_users, self.create_products, self.create_reviews, self.create_orders]:
+            started = time.perf_counter()
+            count = step()
+            self.log(f"{step.__name__.replace('create_', '')}: {count} rows in {time.perf_counter() - started:.1f}s")
+        bump_generation()  # bulk_create sends no post_save
+        return dataset_counts()
+
+    def create_categories(self):
+        roots = max(1, self.categories // 25)
+        second = (self.categories - roots) // 5
+        levels = [roots, second, self.categories - roots - second]
+        paths, parents, number = {}, [None], 0
+        for size in levels:
+            rows = []
+            for _ in range(size):
+                rows.append(Category(
+                    name=f"{PREFIX} {self.rng.choice(NOUNS)} {number}", slug=f"{PREFIX}-c{number}",
+                    parent_id=self.rng.choice(parents),
+                ))
+                number += 1
+            for batch in batched(rows, self.batch_size):
+                Category.objects.bulk_create(batch)
+            for category in rows:
+                category.path = f"{paths.get(category.parent_id, '')}{category.pk}/"
+                category.depth = category.path.count("/") - 1
+                paths[category.pk] = category.path
+            Category.objects.bulk_update(rows, ["path", "depth"], batch_size=min(self.batch_size, 1000))
+            parents = [category.pk for category in rows] or parents
+        self.category_ids = list(paths)
+        return len(paths)
+
+    def create_users(self):
+        password = make_password(None)  # unusable; the harness mints JWTs directly
+        rows = (
+            User(username=f"{PREFIX}-u{i}", email=f"{PREFIX}-u{i}@example.com", password=password)
+            for i in range(self.users)
+        )
+        for batch in batched(rows, self.batch_size):
+            self.user_ids += [user.pk for user in User.objects.bulk_create(batch)]
+        return len(self.user_ids)
+
+    def create_products(self):
+        rng = self.rng
+        # Review k is for product k % P; its rating is ratings[k]
+        ratings = array("b", rng.choices(range(1, 6), weights=[5, 5, 15, 35, 40], k=self.reviews))
+        stars = [array("i", bytes(4 * self.products)) for _ in range(5)]
+        for k, rating in enumerate(ratings):
+            stars[rating - 1][k % self.products] += 1
+        self.ratings = ratings
+
+        def rows():
+            for i in range(self.products):
+                brand, noun = rng.choice(BRANDS), rng.choice(NOUNS)
+                histogram = [column[i] for column in stars]
+                count, total = sum(histogram), sum(n * value for value, n in enumerate(histogram, 1))
+                yield Product(
+                    sku=f"{SKU_PREFIX}{i:07d}", slug=f"{PREFIX}-p{i}", name=f"{brand} {noun} {rng.choice(WORDS)} {i}",
+                    description=" ".join([brand, noun] + rng.sample(WORDS, 12)),
+                    price=Decimal(rng.randrange(50, 250000)) / 100 * rng.choice([1, 1, 1, 10, 100]),
+                    stock_quantity=1_000_000, category_id=rng.choice(self.category_ids),
+                    rating_count=count, rating_sum=total,
+                    average_rating=round(Decimal(total) / count, 2) if count else Decimal("0"),
+                    **{f"stars_{value}": n for value, n in enumerate(histogram, 1)},
+                )
+
+        for batch in batched(rows(), self.batch_size):
+            for product in Product.objects.bulk_create(batch):
+                self.product_ids.append(product.pk)
+                self.product_prices.append(product.price)
+        return len(self.product_ids)
+
+    def create_reviews(self):
+        products, users = len(self.product_ids), len(self.user_ids)
+
+        def rows():
+            for k, rating in enumerate(self.ratings):
+                # Product k % P gets its (k // P)-th reviewer: never the same user twice
+                p = k % products
+                u = (p * 7919 + k // products) % users
+                yield Review(
+                    product_id=self.product_ids[p], user_id=self.user_ids[u], rating=rating,
+                    comment=" ".join(self.rng.sample(WORDS, 6)),
+                )
+
+        for batch in batched(rows(), self.batch_size):
+            Review.objects.bulk_create(batch)
+        return self.reviews
+
+    def create_orders(self):
+        created = 0
+        for start in range(0, self.orders, self.batch_size):
+            lines = []
+            orders = []
+            for _ in range(min(self.batch_size, self.orders - start)):
+                picks = {self.rng.randrange(len(self.product_ids)) for _ in range(self.rng.randint(1, 4))}
+                items = [(self.product_ids[p], self.rng.randint(1, 3), self.product_prices[p]) for p in picks]
+                orders.append(Order(
+                    customer_id=self.rng.choice(self.user_ids), status=self.rng.choice(ORDER_STATUSES),
+                    total_amount=sum(price * quantity for _, quantity, price in items),
+                ))
+                lines.append(items)
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order.pk, product_id=product_id, quantity=quantity, price=price)
+                for order, items in zip(orders, lines) for product_id, quantity, price in items
+            ])
+            now = timezone.now()
+            payments = []
+            for order in orders:
+                status = PAYMENT_STATUSES.get(order.status, "successful")
+                method = "mpesa" if self.rng.random() < 0.8 else "card"
+                payments.append(Payment(
+                    order_id=order.pk, payment_method=method, amount=order.total_amount, status=status,
+                    transaction_id=f"{PREFIX}-t{order.pk}",
+                    checkout_request_id=f"{CHECKOUT_PREFIX}{order.pk}" if method == "mpesa" else None,
+                    paid_at=now if status == "successful" else None,
+                ))
+            Payment.objects.bulk_create(payments)
+            created += len(orders)
+        return created
+
+
+def clear_dataset():
+    """Delete every synthetic row (and anything hanging off it) with set-based DELETEs."""
+    users = User.objects.filter(username__startswith=f"{PREFIX}-")
+    products = Product.objects.filter(sku__startswith=SKU_PREFIX)
+    orders = Order.objects.filter(customer__in=users)
+    _raw_delete(MpesaCallback.objects.filter(checkout_request_id__startswith=CHECKOUT_PREFIX))
+    for queryset in [
+        Payment.objects.filter(order__in=orders),
+        StockReservation.objects.filter(order__in=orders),
+        OrderItem.objects.filter(order__in=orders),
+        orders,
+        Review.objects.filter(user__in=users),
+    ]:
+        _raw_delete(queryset)
+    # Other users' rows that point at synthetic products
+    OrderItem.objects.filter(product__in=products).update(product=None)
+    for queryset in [
+        Review.objects.filter(product__in=products),
+        StockReservation.objects.filter(product__in=products),
+        CartItem.objects.filter(product__in=products),
+        products,
+    ]:
+        _raw_delete(queryset)
+    Category.objects.filter(slug__startswith=f"{PREFIX}-c").update(parent=None)
+    _raw_delete(Category.objects.filter(slug__startswith=f"{PREFIX}-c"))
+    users.delete()  # few enough rows for the ORM, which handles groups and tokens
+    bump_generation()
+
+
+def dataset_counts():
+    users = User.objects.filter(username__startswith=f"{PREFIX}-")
+    return {
+        "categories": Category.objects.filter(slug__startswith=f"{PREFIX}-c").count(),
+        "products": Product.objects.filter(sku__startswith=SKU_PREFIX).count(),
+        "users": users.count(),
+        "reviews": Review.objects.filter(user__in=users).count(),
+        "orders": Order.objects.filter(customer__in=users).count(),
+        "payments": Payment.objects.filter(order__customer__in=users).count(),
+    }
+
+
+# ------------------- SCENARIOS -------------------
+class Scenario:
+    """
+    One benchmarked endpoint. `request(index)` returns (method, path, body)
+    for the index-th request; write scenarios prepare the rows they consume
+    in `setup(count)` and remove them in `teardown()`.
+    """
+    name = None
+    authenticated = False
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.rng = random.Random(f"{runner.seed}-{self.name}")
+        self.user = None
+
+    def setup(self, count):
+        pass
+
+    def request(self, index):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+    def create_user(self):
+        self.user = User.objects.create_user(username=f"{PREFIX}-{self.runner.run}-{self.name}", password=None)
+        return self.user
+
+    def token(self):
+        if not self.authenticated:
+            return None
+        user = self.user or self.runner.customer
+        token = add_principal_claims(AccessToken.for_user(user), user)
+        token.set_exp(lifetime=timedelta(hours=12))  # outlives long runs
+        return str(token)
+
+
+class ProductList(Scenario):
+    name = "product_list"
+
+    def setup(self, count):
+        self.pages = max(1, min(100, math.ceil(Product.objects.count() / CatalogPagination.page_size)))
+
+    def request(self, index):
+        return "get", f"/products/?page={self.rng.randint(1, self.pages)}", None
+
+
+class ProductSearch(Scenario):
+    name = "product_search"
+
+    def request(self, index):
+        terms = self.rng.choice([NOUNS, BRANDS, WORDS])
+        return "get", f"/products/?search={self.rng.choice(terms).lower()}", None
+
+
+class ProductFilter(Scenario):
+    name = "product_filter"
+
+    def setup(self, count):
+        self.roots = list(Category.objects.filter(slug__startswith=f"{PREFIX}-c", depth=0).values_list("pk", flat=True))
+
+    def request(self, index):
+        ordering = self.rng.choice(["price", "-price", "-created_at"])
+        return "get", f"/products/?category_tree={self.rng.choice(self.roots)}&ordering={ordering}", None
+
+
+class CategoryList(Scenario):
+    name = "category_list"
+
+    def setup(self, count):
+        self.pages = max(1, min(20, math.ceil(Category.objects.count() / CatalogPagination.page_size)))
+
+    def request(self, index):
+        return "get", f"/categories/?page={self.rng.randint(1, self.pages)}", None
+
+
+class OrderHistory(Scenario):
+    name = "order_history"
+    authenticated = True
+
+    def request(self, index):
+        status = self.rng.choice([None, None, "delivered", "pending"])
+        return "get", f"/orders/?status={status}" if status else "/orders/", None
+
+
+class Checkout(Scenario):
+    name = "checkout"
+    authenticated = True
+
+    def setup(self, count):
+        self.create_user()
+        self.products = self.runner.sample_products(self.rng, min(1000, dataset_counts()["products"]))
+
+    def request(self, index):
+        items = [{"product": pk, "quantity": self.rng.randint(1, 3)} for pk in self.rng.sample(self.products, self.rng.randint(1, 3))]
+        return "post", "/checkout/", {"items": items, "payment_method": "mpesa", "phone": PHONE}
+
+    def teardown(self):
+        held = (
+            StockReservation.objects.filter(order__customer=self.user, status="active")
+            .values("product_id").annotate(quantity=Sum("quantity"))
+        )
+        for row in held:
+            Product.objects.filter(pk=row["product_id"]).update(stock_quantity=F("stock_quantity") + row["quantity"])
+        self.user.delete()
+
+
+class ReviewCreate(Scenario):
+    name = "review_create"
+    authenticated = True
+
+    def setup(self, count):
+        self.create_user()
+        self.products = self.runner.sample_products(self.rng, count)
+        order = Order.objects.create(customer=self.user, status="delivered")
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_id=pk, price=Decimal("1.00")) for pk in self.products])
+
+    def request(self, index):
+        return "post", "/reviews/", {"product": self.products[index], "rating": self.rng.randint(1, 5), "comment": "Bench review"}
+
+    def teardown(self):
+        Review.objects.filter(user=self.user).delete()  # signals take the ratings back off the products
+        self.user.delete()
+
+
+class MpesaCallbackScenario(Scenario):
+    name = "mpesa_callback"
+
+    def setup(self, count):
+        self.create_user()
+        orders = Order.objects.bulk_create([Order(customer=self.user, total_amount=Decimal("1.00")) for _ in range(count)])
+        self.ids = [f"{CHECKOUT_PREFIX}{self.runner.run}_{i}" for i in range(count)]
+        Payment.objects.bulk_create([
+            Payment(order=order, payment_method="mpesa", amount=Decimal("1.00"), checkout_request_id=checkout_id)
+            for order, checkout_id in zip(orders, self.ids)
+        ])
+
+    def request(self, index):
+        return "post", "/mpesa/callback/", {"Body": {"stkCallback": {
+            "MerchantRequestID": f"mr-{index}",
+            "CheckoutRequestID": self.ids[index],
+            "ResultCode": 0,
+            "ResultDesc": "The service request is processed successfully.",
+            "CallbackMetadata": {"Item": [
+                {"Name": "Amount", "Value": 1.00},
+                {"Name": "MpesaReceiptNumber", "Value": f"R{index:09d}"},
+                {"Name": "PhoneNumber", "Value": int(PHONE)},
+            ]},
+        }}}
+
+    def teardown(self):
+        MpesaCallback.objects.filter(checkout_request_id__in=self.ids).delete()
+        self.user.delete()
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        ProductList, ProductSearch, ProductFilter, CategoryList, OrderHistory, Checkout, ReviewCreate, MpesaCallbackScenario,
+    ]
+}
+
+
+# ------------------- RUNNER -------------------
+def local_sender():
+    """Send requests through Django's handler in this process, one test Client per thread."""
+    local = threading.local()
+
+    def send(method, path, body, token):
+        if not hasattr(local, "client"):
+            local.client = Client(raise_request_exception=False)
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        if method == "get":
+            response = local.client.get(path, headers=headers)
+        else:
+            response = getattr(local.client, method)(path, body, content_type="application/json", headers=headers)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+    return send
+
+
+def remote_sender(base_url):
+    """Send requests to a running server that shares this database."""
+    local = threading.local()
+
+    def send(method, path, body, token):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = local.session.request(method, base_url.rstrip("/") + path, json=body, headers=headers, timeout=30)
+        return response.status_code
+    return send
+
+
+def percentile(ordered, fraction):
+    """Linear interpolation between the closest ranks of a sorted list."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    latency = {
+        "min": ordered[0] if ordered else None,
+        "mean": sum(ordered) / len(ordered) if ordered else None,
+        **{f"p{int(q * 100)}": percentile(ordered, q) for q in (0.5, 0.9, 0.95, 0.99)},
+        "max": ordered[-1] if ordered else None,
+    }
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 400),
+        "status_codes": {str(code): count for code, count in sorted(Counter(statuses).items())},
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {key: round(value * 1000, 3) if value is not None else None for key, value in latency.items()},
+    }
+
+
+def measure(send, requests, token, warmup, concurrency, before=None):
+    """
+    Send the first `warmup` requests unmeasured, then the rest over
+    `concurrency` threads, and summarize the measured ones. `before` runs
+    ahead of every request, outside the timing.
+    """
+    def timed(request):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        status = send(*request, token)
+        return time.perf_counter() - started, status
+
+    for request in requests[:warmup]:
+        timed(request)
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, requests[warmup:]))
+    else:  # on this thread and its database connection
+        results = [timed(request) for request in requests[warmup:]]
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _ in results], [status for _, status in results], elapsed)
+
+
+class BenchmarkRunner:
+    """
+    Run scenarios against the generated dataset. Each scenario sends
+    `warmup` unmeasured requests, then `requests` measured ones over
+    `concurrency` threads; latencies are wall-clock per request, throughput
+    is measured requests over the measured phase's wall time. With `cold`,
+    the catalog cache generation is bumped before every request.
+    """
+
+    def __init__(self, requests=200, warmup=20, concurrency=1, seed=42, url=None, cold=False, log=None):
+        self.requests = requests
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.seed = seed
+        self.url = url
+        self.cold = cold
+        self.log = log or (lambda message: None)
+        self.run = timezone.now().strftime("%Y%m%d%H%M%S")
+        self.send = remote_sender(url) if url else local_sender()
+        self.customer = User.objects.filter(username__startswith=f"{PREFIX}-u").order_by("pk").first()
+        if self.customer is None or not Product.objects.filter(sku__startswith=SKU_PREFIX).exists():
+            raise RuntimeError("No benchmark dataset; run generate_benchmark_data first.")
+
+    def sample_products(self, rng, count):
+        """`count` distinct synthetic product ids."""
+        ids = list(Product.objects.filter(sku__startswith=SKU_PREFIX).order_by("pk").values_list("pk", flat=True))
+        if count > len(ids):
+            raise RuntimeError(f"The dataset has {len(ids)} products; {count} are needed.")
+        return rng.sample(ids, count)
+
+    def run_scenario(self, scenario):
+        total = self.warmup + self.requests
+        scenario.setup(total)
+        token = scenario.token()
+        try:
+            requests = [scenario.request(index) for index in range(total)]
+            return measure(
+                self.send, requests, token, self.warmup, self.concurrency, before=bump_generation if self.cold else None,
+            )
+        finally:
+            scenario.teardown()
+
+    def unthrottled(self):
+        """
+        Lift the rate limits of in-process runs: the buckets are still
+        charged, but a load test never runs out. Remote servers need their
+        THROTTLE_* settings raised instead.
+        """
+        if self.url:
+            return nullcontext()
+        rates = {scope: "1000000/s" for scope in settings.REST_FRAMEWORK.get("DEFAULT_THROTTLE_RATES", {})}
+        return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": rates})
+
+    def run_all(self, names):
+        results = {"meta": environment(self), "scenarios": {}}
+        for name in names:
+            with self.unthrottled():
+                stats = self.run_scenario(SCENARIOS[name](self))
+            self.log(
+                f"{name}: {stats['throughput_rps']} req/s, p50 {stats['latency_ms']['p50']} ms, "
+                f"p95 {stats['latency_ms']['p95']} ms, p99 {stats['latency_ms']['p99']} ms, {stats['errors']} errors"
+            )
+            results["scenarios"][name] = stats
+        return results
+
+
+def git_revision():
+    try:
+        head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=settings.BASE_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return {"commit": head.stdout.strip() or None, "dirty": bool(dirty.stdout.strip())}
+
+
+def environment(runner):
+    database = connection.settings_dict
+    if connection.vendor == "postgresql":
+        version = connection.pg_version
+    elif connection.vendor == "sqlite":
+        version = connection.Database.sqlite_version
+    else:
+        version = None
+    return {
+        "timestamp": timezone.now().isoformat(),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "database": {"vendor": connection.vendor, "version": version, "name": str(database["NAME"]), "host": database.get("HOST") or None},
+        "cache": settings.CACHES["default"]["BACKEND"],
+        "target": runner.url or "in-process",
+        "options": {
+            "requests": runner.requests, "warmup": runner.warmup, "concurrency": runner.concurrency,
+            "seed": runner.seed, "cold": runner.cold,
+        },
+        "dataset": dataset_counts(),
+    }
+
+
+def compare(previous, current):
+    """Per-scenario p50/p95/p99 and throughput of two result files, with the change in percent."""
+    rows = []
+    for name, now in current["scenarios"].items():
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+        row = {"scenario": name}
+        for key, old, new in [
+            ("p50_ms", before["latency_ms"]["p50"], now["latency_ms"]["p50"]),
+            ("p95_ms", before["latency_ms"]["p95"], now["latency_ms"]["p95"]),
+            ("p99_ms", before["latency_ms"]["p99"], now["latency_ms"]["p99"]),
+            ("throughput_rps", before["throughput_rps"], now["throughput_rps"]),
+        ]:
+            change = round((new - old) / old * 100, 1) if old else None
+            row[key] = {"before": old, "after": new, "change_pct": change}
+        rows.append(row)
+    return rows
+
+
+# ------------------- WSGI vs ASGI -------------------
+class SlowDaraja(BaseHTTPRequestHandler):
+    """Daraja stand-in: answers token requests and STK queries after `server.latency` seconds."""
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def reply(self, body):
+        time.sleep(self.server.latency)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.reply({"access_token": "bench-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.reply({
+            "ResponseCode": "0", "MerchantRequestID": "bench-merchant", "CheckoutRequestID": body.get("CheckoutRequestID"),
+            "ResultCode": self.server.result_code, "ResultDesc": "Bench result",
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gateway(latency, result_code="1032"):
+    """Start a SlowDaraja whose STK queries report `result_code` (default: cancelled by the user)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowDaraja)
+    server.daemon_threads = True
+    server.latency = latency
+    server.result_code = result_code
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """gunicorn with gunicorn.conf.py in SERVER_MODE `mode`, on a free local port, for a `with` block."""
+
+    def __init__(self, mode, workers, env=None, ready_path="/async/categories/", timeout=30):
+        self.mode = mode
+        self.workers = workers
+        self.env = env or {}
+        self.ready_path = ready_path
+        self.timeout = timeout
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        if shutil.which("gunicorn") is None or (self.mode == "asgi" and importlib.util.find_spec("uvicorn") is None):
+            raise RuntimeError("gunicorn (and uvicorn for ASGI) must be installed to start servers.")
+        env = {
+            **os.environ, **self.env,
+            "SERVER_MODE": self.mode, "PORT": str(self.port), "WEB_CONCURRENCY": str(self.workers),
+        }
+        self.process = subprocess.Popen(
+            ["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", os.devnull, "--log-level", "warning"],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.mode} server exited: {self.process.stderr.read()[-2000:]}")
+            try:
+                if requests.get(self.url + self.ready_path, timeout=1).status_code == 200:
+                    return self
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"{self.mode} server did not start within {self.timeout}s")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+# (name, SERVER_MODE, status path): the sync view on both servers, the async one on ASGI
+GATEWAY_RUNS = [
+    ("wsgi", "wsgi", "/payments/mpesa/stkpush/{pk}/?live=1"),
+    ("asgi_sync_view", "asgi", "/payments/mpesa/stkpush/{pk}/?live=1"),
+    ("asgi", "asgi", "/async/payments/mpesa/stkpush/{pk}/?live=1"),
+]
+
+
+def compare_servers(latency=0.2, count=500, warmup=20, concurrency=50, workers=2, log=None):
+    """
+    Throughput and latency of the live STK status endpoint, which waits on
+    Daraja, on a WSGI and an ASGI gunicorn with the same worker count. The
+    gateway is a local stub that answers after `latency` seconds; servers
+    use this process's database settings. Returns a results dict.
+    """
+    log = log or (lambda message: None)
+    gateway = start_gateway(latency)
+    user = User.objects.create_user(username=f"{PREFIX}-asgi", password=None)
+    push = PaymentRequest.objects.create(
+        phone_number="254700000000", amount=1, status="sent", checkout_request_id=f"{CHECKOUT_PREFIX}asgi",
+    )
+    token = str(add_principal_claims(AccessToken.for_user(user), user))
+    env = {"MPESA_BASE_URL": f"http://127.0.0.1:{gateway.server_port}", "MPESA_CONSUMER_KEY": "bench"}
+    results = {
+        "meta": {
+            "gateway_latency_ms": latency * 1000, "requests": count, "warmup": warmup,
+            "concurrency": concurrency, "workers": workers, "git": git_revision(),
+            "python": platform.python_version(), "django": django.get_version(),
+            "database": connection.vendor,
+        },
+        "servers": {},
+    }
+    try:
+        for name, mode, path in GATEWAY_RUNS:
+            with ServerProcess(mode, workers, env=env) as server:
+                calls = [("get", path.format(pk=push.pk), None)] * (warmup + count)
+                stats = measure(remote_sender(server.url), calls, token, warmup, concurrency)
+            log(f"{name}: {stats['throughput_rps']} req/s, p50 {stats['latency_ms']['p50']} ms, "
+                f"p99 {stats['latency_ms']['p99']} ms, {stats['errors']} errors")
+            results["servers"][name] = stats
+    finally:
+        gateway.shutdown()
+        gateway.server_close()
+        push.delete()
+        user.delete()
+    return results
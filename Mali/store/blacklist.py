@@ -0,0 +1,163 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+FILTER_KEY = "token-blacklist:filter"  # shared snapshot: (watermark, BloomFilter)
+MARKER_KEY = "token-blacklist:marker"  # bumped after every blacklisting commits
+ERROR_RATE = 0.01
+MIN_CAPACITY = 10_000
+MAX_STALENESS = 30  # seconds; catch up from the database at least this often
+REBUILD_INTERVAL = 3600  # seconds; full rebuilds drop expired tokens
+CLOCK_SKEW = timedelta(seconds=60)  # overlap between catch-up windows
+PRUNE_BATCH_SIZE = 1000
+
+
+class BloomFilter:
+    """
+    Set membership in `size` bits: no false negatives, false positives at
+    about `error_rate` while holding up to `capacity` items.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing (Kirsch-Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def full(self):
+        return self.count > self.capacity
+
+
+class BlacklistFilter:
+    """
+    Which refresh-token JTIs might be blacklisted, kept in each process and
+    shared through the cache:
+    - A process starts from the snapshot in the cache (or builds one from the
+      unexpired blacklisted tokens), then catches up on rows blacklisted
+      since its watermark.
+    - A check costs one cache read of MARKER_KEY. Blacklisting bumps the
+      marker after commit, so every process catches up before its next
+      check; without a shared cache, processes catch up every
+      MAX_STALENESS seconds.
+    "No" answers are final. "Maybe" answers are confirmed in the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bloom = None
+        self.watermark = None  # latest blacklisted_at included
+        self.marker = None
+        self.synced = self.built = 0.0
+
+    def __contains__(self, jti):
+        self.sync()
+        return jti in self.bloom
+
+    def sync(self):
+        marker = cache.get(MARKER_KEY)
+        now = time.monotonic()
+        if self.bloom is not None and marker == self.marker and now - self.synced < MAX_STALENESS:
+            return
+        with self.lock:
+            if self.bloom is None or self.bloom.full or now - self.built > REBUILD_INTERVAL:
+                self.load(rebuild=self.bloom is not None)
+            else:
+                self.catch_up()
+            self.marker, self.synced = marker, now
+
+    def load(self, rebuild=False):
+        snapshot = None if rebuild else cache.get(FILTER_KEY)
+        if snapshot is None:
+            live = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            self.bloom = BloomFilter(max(MIN_CAPACITY, 2 * live.count()))
+            self.watermark = None
+            self.catch_up(live)
+            cache.set(FILTER_KEY, (self.watermark, self.bloom), REBUILD_INTERVAL)
+        else:
+            self.watermark, self.bloom = snapshot
+            self.catch_up()
+        self.built = time.monotonic()
+
+    def catch_up(self, rows=None):
+        if rows is None:
+            rows = BlacklistedToken.objects.all()
+            if self.watermark is not None:
+                rows = rows.filter(blacklisted_at__gte=self.watermark - CLOCK_SKEW)
+        for jti, blacklisted_at in rows.values_list("token__jti", "blacklisted_at").iterator():
+            self.bloom.add(jti)
+            if self.watermark is None or blacklisted_at > self.watermark:
+                self.watermark = blacklisted_at
+
+    def added(self, jti):
+        """Called once a blacklisting has committed."""
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+        try:
+            cache.incr(MARKER_KEY)
+        except ValueError:
+            cache.set(MARKER_KEY, int(time.time() * 1000), None)
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def is_blacklisted(jti):
+    if jti not in blacklist_filter:
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def prune_expired_tokens(now=None, batch_size=PRUNE_BATCH_SIZE, pause=0.0):
+    """
+    Delete outstanding tokens that have expired, with their blacklist rows,
+    `batch_size` at a time. Each batch is its own short transaction, and the
+    scan walks the primary key so no batch rescans rows already checked.
+    Expired tokens fail validation anyway, so nothing needs to be blacklisted
+    after its row is gone. Returns (outstanding, blacklisted) rows deleted.
+    """
+    now = now or timezone.now()
+    outstanding = blacklisted = last = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(pk__gt=last, expires_at__lte=now)
+            .order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return outstanding, blacklisted
+        # Plain DELETEs: BlacklistedToken is the only row pointing at a token
+        # and neither model has delete signals, so the collector adds nothing
+        with transaction.atomic():
+            rows = BlacklistedToken.objects.filter(token_id__in=ids)
+            blacklisted += rows._raw_delete(rows.db)
+            rows = OutstandingToken.objects.filter(pk__in=ids)
+            outstanding += rows._raw_delete(rows.db)
+        last = ids[-1]
+        if pause:
+            time.sleep(pause)
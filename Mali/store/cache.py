@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .routers import primary_unless_synced, read_replica
+
+CATALOG_GENERATION_KEY = "catalog:generation"
+CATALOG_CHANGED_KEY = "catalog:changed-at"  # epoch seconds of the last bump
+
+# Striped locks: concurrent misses on the same key inside one worker wait for
+# a single computation instead of all hitting the database.
+_LOCK_STRIPES = [threading.Lock() for _ in range(64)]
+
+
+def get_generation():
+    generation = cache.get(CATALOG_GENERATION_KEY)
+    if generation is None:
+        # Start from the clock so keys from before a cache flush are never reused
+        cache.add(CATALOG_GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(CATALOG_GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Invalidate every cached catalog response."""
+    cache.set(CATALOG_CHANGED_KEY, time.time(), None)
+    try:
+        cache.incr(CATALOG_GENERATION_KEY)
+    except ValueError:
+        cache.set(CATALOG_GENERATION_KEY, int(time.time() * 1000), None)
+
+
+def fresh_catalog_reads():
+    """
+    Context for reads that fill the catalog cache: the request's replica if
+    it has caught up with the last catalog change, otherwise the primary.
+    """
+    if read_replica() is None:
+        return nullcontext()
+    return primary_unless_synced(cache.get(CATALOG_CHANGED_KEY))
+
+
+def catalog_key(*parts, params=None):
+    normalized = ""
+    if params is not None:
+        normalized = "&".join(
+            f"{name}={value}" for name in sorted(params) for value in sorted(params.getlist(name))
+        )
+    digest = hashlib.md5(normalized.encode()).hexdigest()
+    return ":".join(["catalog", str(get_generation()), *map(str, parts), digest])
+
+
+def get_or_compute(key, compute, timeout=None):
+    """
+    Read-through cache with stampede protection.
+    - Threads in this process coalesce on a striped lock.
+    - Processes coalesce on a short-lived `cache.add` lock; the losers poll
+      for the winner's value and only compute it themselves if it never shows up.
+    - On a replica, values are computed on the primary until the replica has
+      replayed the last catalog change.
+    """
+    if timeout is None:
+        timeout = settings.CATALOG_CACHE_TIMEOUT
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _LOCK_STRIPES[hash(key) % len(_LOCK_STRIPES)]:
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = f"{key}:lock"
+        if cache.add(lock_key, 1, settings.CATALOG_CACHE_LOCK_TIMEOUT):
+            try:
+                with fresh_catalog_reads():
+                    value = compute()
+                if value is not None:
+                    cache.set(key, value, timeout)
+            finally:
+                cache.delete(lock_key)
+            return value
+
+        deadline = time.monotonic() + settings.CATALOG_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(lock_key) is None:
+                break
+        with fresh_catalog_reads():
+            return compute()
+
+
+class CachedCatalogMixin:
+    """
+    Serve `list` and `retrieve` from the catalog cache.
+    Keys include the catalog generation, which `store/signals.py` bumps when
+    a Product or Category changes, so stale entries are never read again.
+    """
+
+    def cache_key_parts(self, request):
+        return [self.basename, self.action, self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, "")]
+
+    def cached_response(self, request, compute):
+        response = None
+
+        def compute_data():
+            nonlocal response
+            response = compute()
+            # Only successful responses are worth keeping
+            return response.data if response.status_code == 200 else None
+
+        key = catalog_key(*self.cache_key_parts(request), params=request.query_params)
+        data = get_or_compute(key, compute_data)
+        if data is not None:
+            return Response(data)
+        return response if response is not None else compute()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedCatalogMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedCatalogMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,166 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .inventory import release_reservations
+from .models import MpesaCallback, Order, Payment, StockReservation
+from .mpesa import MpesaError, get_client
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+def parse_callback(data):
+    """Pull the fields we store out of a Daraja `Body.stkCallback` payload."""
+    try:
+        callback = data["Body"]["stkCallback"]
+        fields = {
+            "checkout_request_id": str(callback["CheckoutRequestID"]),
+            "merchant_request_id": str(callback.get("MerchantRequestID", "")),
+            "result_code": int(callback["ResultCode"]),
+            "result_desc": str(callback.get("ResultDesc", ""))[:255],
+        }
+        items = callback.get("CallbackMetadata", {}).get("Item", [])
+        metadata = {item.get("Name"): item.get("Value") for item in items if isinstance(item, dict)}
+    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+        raise InvalidCallback("Not an STK push callback") from exc
+
+    fields["receipt_number"] = metadata.get("MpesaReceiptNumber")
+    try:
+        fields["amount"] = Decimal(str(metadata["Amount"])) if "Amount" in metadata else None
+    except InvalidOperation:
+        fields["amount"] = None
+    return fields
+
+
+def ingest_callback(data):
+    """
+    Store a callback. A failed payment is applied at once; a success waits
+    for `apply_unmatched_callbacks`, which confirms it with Daraja, so the
+    callback request never waits on the gateway. Returns False for a
+    duplicate delivery, which costs one SELECT and one failed INSERT.
+    """
+    fields = parse_callback(data)
+    with transaction.atomic():
+        payment = matching_payment(fields["checkout_request_id"])
+        try:
+            # The unique key decides which delivery does the work
+            callback = MpesaCallback.objects.create(payload=data, **fields)
+        except IntegrityError:
+            transaction.set_rollback(True)
+            return False
+    if payment is not None and callback.result_code != 0:
+        apply_callback(callback, payment)
+    return True
+
+
+def matching_payment(checkout_request_id):
+    return Payment.objects.filter(checkout_request_id=checkout_request_id).values_list("pk", "order_id", "amount").first()
+
+
+def confirm_payment(callback, amount, client=None):
+    """
+    Whether a success callback can be trusted: it must be for the amount we
+    asked for, and Daraja must report the push as paid. The callback URL is
+    public, so its body alone proves nothing. Returns None when Daraja
+    could not be asked, so the callback is tried again later.
+    """
+    if callback.amount != amount:
+        logger.warning("Callback %s is for %s, expected %s", callback.checkout_request_id, callback.amount, amount)
+        return False
+    try:
+        result = (client or get_client()).stk_query(callback.checkout_request_id)
+    except MpesaError as exc:
+        logger.warning("Could not confirm callback %s: %s", callback.checkout_request_id, exc)
+        return None
+    if str(result.get("ResultCode")) != "0":
+        logger.warning("Daraja does not confirm callback %s: %s", callback.checkout_request_id, result.get("ResultDesc"))
+        return False
+    return True
+
+
+def apply_callback(callback, payment, client=None):
+    """
+    Apply a stored callback to `payment` (pk, order_id, amount) unless
+    another worker already did. A success callback Daraja does not confirm
+    is marked processed without touching the payment.
+    """
+    payment_id, order_id, amount = payment
+    confirmed = True
+    if callback.result_code == 0:
+        # Asked outside the transaction: no locks are held while Daraja answers
+        confirmed = confirm_payment(callback, amount, client)
+        if confirmed is None:
+            return False
+    with transaction.atomic():
+        if not MpesaCallback.objects.filter(pk=callback.pk, processed=False).update(processed=True):
+            return False
+        if confirmed:
+            transition(callback, payment_id, order_id)
+    return confirmed
+
+
+def transition(callback, payment_id, order_id):
+    """
+    Move the payment, order and stock reservations to their final state with
+    conditional UPDATEs (`... WHERE status = 'pending'`), so a state is only
+    ever left once.
+    """
+    now = timezone.now()
+    if callback.result_code == 0:
+        if Payment.objects.filter(pk=payment_id, status="pending").update(status="successful", paid_at=now):
+            Order.objects.filter(pk=order_id, status="pending").update(
+                status="paid", mpesa_receipt=callback.receipt_number, updated_at=now,
+            )
+            StockReservation.objects.filter(order_id=order_id, status="active").update(status="confirmed")
+    elif Payment.objects.filter(pk=payment_id, status="pending").update(status="failed"):
+        release_reservations(order_id)
+
+
+def apply_pending_callback(checkout_request_id, client=None):
+    """
+    Apply a callback that arrived before its Payment knew the CheckoutRequestID.
+    Called by the outbox once it has stored the id on the Payment.
+    """
+    callback = MpesaCallback.objects.filter(checkout_request_id=checkout_request_id, processed=False).first()
+    payment = matching_payment(checkout_request_id)
+    if callback is not None and payment is not None:
+        apply_callback(callback, payment, client)
+
+
+def apply_unmatched_callbacks(client=None, concurrency=None):
+    """
+    Apply the stored callbacks of payments that are still pending: every
+    success, confirmed with Daraja here rather than in the callback request;
+    callbacks that raced the outbox storing their CheckoutRequestID; and
+    ones Daraja could not be asked about last time. Daraja is asked about
+    `concurrency` callbacks at a time. Returns how many were applied.
+    """
+    concurrency = concurrency or settings.PAYMENT_OUTBOX_CONCURRENCY
+    pending = Payment.objects.filter(status="pending", checkout_request_id__isnull=False)
+    callbacks = list(
+        MpesaCallback.objects.filter(processed=False, checkout_request_id__in=pending.values("checkout_request_id"))
+        .order_by("received_at")
+    )
+
+    def apply(callback):
+        payment = matching_payment(callback.checkout_request_id)
+        return payment is not None and apply_callback(callback, payment, client)
+
+    def apply_in_thread(callback):
+        try:
+            return apply(callback)
+        finally:
+            connections.close_all()  # pool threads own their connections
+
+    if concurrency == 1:
+        return sum(1 for callback in callbacks if apply(callback))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return sum(1 for applied in pool.map(apply_in_thread, callbacks) if applied)
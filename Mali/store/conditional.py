@@ -0,0 +1,63 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .cache import catalog_key, get_or_compute
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified validators for `list` and `retrieve`.
+    - Detail: the object's `updated_at`.
+    - List: `MAX(updated_at)` and row count of the filtered queryset (the
+      count catches deletions), plus the query string.
+    Validators are cached under the catalog generation, so a matching
+    If-None-Match / If-Modified-Since gets a 304 without touching the
+    serializer, and usually without touching the database.
+    Writes that bypass `save()` (F() updates, bulk_update) must set
+    `updated_at` themselves, or the validators never change.
+    """
+    validator_field = "updated_at"
+
+    def get_validators(self, request):
+        rows = self.filter_queryset(self.get_queryset())
+        try:
+            if self.action == "retrieve":
+                lookup = self.lookup_url_kwarg or self.lookup_field
+                rows = rows.filter(**{self.lookup_field: self.kwargs[lookup]})
+            stats = rows.order_by().aggregate(latest=Max(self.validator_field), count=Count("pk"))
+        except (TypeError, ValueError, ValidationError):
+            # A lookup value of the wrong type: get_object() answers 404
+            return {}
+        if not stats["count"]:
+            return {}
+        latest = stats["latest"]
+        source = f"{self.basename}:{self.action}:{latest.isoformat()}:{stats['count']}:{request.get_full_path()}"
+        return {
+            "etag": quote_etag(hashlib.md5(source.encode()).hexdigest()),
+            "last_modified": int(latest.timestamp()),
+        }
+
+    def conditional_response(self, request, compute):
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, "")
+        key = catalog_key("validators", self.basename, self.action, lookup, params=request.query_params)
+        validators = get_or_compute(key, lambda: self.get_validators(request))
+        if validators:
+            not_modified = get_conditional_response(request, **validators)
+            if not_modified is not None:
+                return not_modified
+
+        response = compute()
+        if validators and response.status_code == 200:
+            response["ETag"] = validators["etag"]
+            response["Last-Modified"] = http_date(validators["last_modified"])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
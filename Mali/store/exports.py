@@ -0,0 +1,140 @@
+import csv
+import datetime
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.utils import encoders
+
+from .models import OrderItem, Product
+from .renderers import default, orjson
+
+CHUNK_SIZE = 2000  # rows per server-side cursor fetch
+FLUSH_BYTES = 64 * 1024  # bytes per chunk sent to the client
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+# (output column, ORM lookup); related columns are joined in the same query
+PRODUCT_COLUMNS = [
+    ("id", "id"),
+    ("sku", "sku"),
+    ("name", "name"),
+    ("slug", "slug"),
+    ("category_id", "category_id"),
+    ("category", "category__name"),
+    ("price", "price"),
+    ("currency", "currency"),
+    ("stock_quantity", "stock_quantity"),
+    ("is_active", "is_active"),
+    ("average_rating", "average_rating"),
+    ("rating_count", "rating_count"),
+    ("created_at", "created_at"),
+    ("updated_at", "updated_at"),
+]
+
+# One row per order line, with the order's columns repeated
+ORDER_COLUMNS = [
+    ("order_id", "order_id"),
+    ("customer", "order__customer__username"),
+    ("status", "order__status"),
+    ("total_amount", "order__total_amount"),
+    ("mpesa_receipt", "order__mpesa_receipt"),
+    ("ordered_at", "order__created_at"),
+    ("product_id", "product_id"),
+    ("sku", "product__sku"),
+    ("product", "product__name"),
+    ("quantity", "quantity"),
+    ("price", "price"),
+]
+
+EXPORTS = {
+    "products": (Product, PRODUCT_COLUMNS),
+    "orders": (OrderItem, ORDER_COLUMNS),
+}
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """
+    Exports pick their format with `?as=`, so an `Accept: text/csv` header
+    must not fail negotiation; errors still render with the first renderer.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+if orjson is not None:
+    def _json_line(row):
+        return orjson.dumps(row, default=default, option=orjson.OPT_UTC_Z | orjson.OPT_APPEND_NEWLINE)
+else:
+    def _json_line(row):
+        return (json.dumps(row, cls=encoders.JSONEncoder, ensure_ascii=False) + "\n").encode()
+
+
+def export_rows(queryset, columns):
+    """Tuples of the export columns, read through a server-side cursor in `pk` order."""
+    lookups = [lookup for _, lookup in columns]
+    return queryset.order_by("pk").values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+
+def stream(rows, columns, file_format):
+    """
+    Encode rows as CSV or NDJSON, yielding bytes. The CSV header and the
+    first row go out at once; the rest is sent in ~64 KB chunks.
+    """
+    names = [name for name, _ in columns]
+    if file_format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(names).encode()
+
+        def encode(row):
+            return writer.writerow([_text(value) for value in row]).encode()
+    else:
+        def encode(row):
+            return _json_line(dict(zip(names, row)))
+
+    rows = iter(rows)
+    for row in rows:
+        yield encode(row)
+        break
+
+    buffer, size = [], 0
+    for row in rows:
+        line = encode(row)
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def export_response(name, queryset, file_format):
+    columns = EXPORTS[name][1]
+    response = StreamingHttpResponse(stream(export_rows(queryset, columns), columns, file_format), content_type=FORMATS[file_format])
+    filename = f"{name}-{timezone.now():%Y%m%d-%H%M%S}.{file_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db.models import Count, Q
+
+RATING_BANDS = [4, 3, 2, 1]  # "4 stars & up", ...
+
+# Query params that page or sort the list but do not change its facets
+IGNORED_PARAMS = {"page", "page_size", "ordering", "cursor", "pagination", "count", "fields", "omit"}
+
+
+def price_buckets():
+    edges = sorted(settings.CATALOG_PRICE_FACETS)
+    bounds = list(zip([None, *edges], [*edges, None]))
+    return [
+        (low, high, Q(**{key: value for key, value in (("price__gte", low), ("price__lt", high)) if value is not None}))
+        for low, high in bounds
+    ]
+
+
+def compute_facets(queryset):
+    """
+    Category, price, rating and availability counts for a filtered product
+    queryset, in one GROUP BY category query: the other facets are
+    conditional counts per category, summed here.
+    """
+    buckets = price_buckets()
+    aggregates = {
+        "total": Count("pk"),
+        "in_stock": Count("pk", filter=Q(stock_quantity__gt=0)),
+        **{f"price_{index}": Count("pk", filter=q) for index, (_, _, q) in enumerate(buckets)},
+        **{f"rating_{stars}": Count("pk", filter=Q(average_rating__gte=stars)) for stars in RATING_BANDS},
+    }
+    rows = queryset.order_by().values("category", "category__name").annotate(**aggregates)
+
+    totals = dict.fromkeys(aggregates, 0)
+    categories = []
+    for row in rows:
+        for name in aggregates:
+            totals[name] += row[name]
+        categories.append({"id": row["category"], "name": row["category__name"], "count": row["total"]})
+    categories.sort(key=lambda category: (-category["count"], category["name"]))
+
+    return {
+        "count": totals["total"],
+        "categories": categories,
+        "price": [
+            {"min": low, "max": high, "count": totals[f"price_{index}"]}
+            for index, (low, high, _) in enumerate(buckets)
+        ],
+        "rating": [{"min": stars, "count": totals[f"rating_{stars}"]} for stars in RATING_BANDS],
+        "availability": {"in_stock": totals["in_stock"], "out_of_stock": totals["total"] - totals["in_stock"]},
+    }
+
+
+def facet_params(query_params):
+    """The query params with paging and sorting removed, for the cache key."""
+    params = query_params.copy()
+    for name in IGNORED_PARAMS:
+        params.pop(name, None)
+    return params
@@ -0,0 +1,152 @@
+import copy
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+FIELDS_PARAM = "fields"
+OMIT_PARAM = "omit"
+
+# Serializer fields whose output is the model attribute unchanged
+IDENTITY_FIELDS = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.ReadOnlyField,
+)
+
+
+def _names(value):
+    return {name.strip() for name in value.split(",") if name.strip()} if value else set()
+
+
+def requested_fields(request, available):
+    """
+    The names from `available` that a read asks for with `?fields=a,b` and/or
+    `?omit=c`, in their original order. Writes always get every field.
+    """
+    available = list(available)
+    if request is None or request.method not in SAFE_METHODS:
+        return available
+    wanted = _names(request.query_params.get(FIELDS_PARAM))
+    omitted = _names(request.query_params.get(OMIT_PARAM))
+    unknown = (wanted | omitted) - set(available)
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: [f"Unknown field(s): {', '.join(sorted(unknown))}"]})
+    return [name for name in available if (not wanted or name in wanted) and name not in omitted]
+
+
+@lru_cache(maxsize=None)
+def serializer_field_names(serializer_class):
+    return tuple(serializer_class().fields)
+
+
+_prototype_fields = {}
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin: drop the fields a read did not ask for. The model is
+    introspected once per serializer class; each instance gets a copy of
+    those fields instead of rebuilding them.
+    """
+
+    def get_fields(self):
+        cls = type(self)
+        if cls not in _prototype_fields:
+            _prototype_fields[cls] = super().get_fields()
+        return copy.deepcopy(_prototype_fields[cls])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(requested_fields(self.context.get("request"), self.fields))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+
+class SparseFieldsetViewMixin:
+    """
+    View mixin: on reads, SELECT only the columns the serializer will output
+    (plus the ordering keys), so `?fields=id,name` never loads descriptions
+    or search vectors.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        names = requested_fields(self.request, serializer_field_names(self.get_serializer_class()))
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        wanted = [name for name in (*names, *getattr(self, "ordering_fields", [])) if name in columns]
+        return queryset.only(*wanted)
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """
+    List serializer for read-only model pages. The field plan (attribute and
+    converter per output key) is worked out once per page instead of going
+    through `get_attribute` / `to_representation` for every field of every
+    row; plain fields and foreign keys are copied as is. Falls back to the
+    normal path when a field is not a concrete model column (method fields,
+    nested serializers, dotted sources).
+    """
+
+    def to_representation(self, data):
+        plan = self.field_plan()
+        if plan is None:
+            return super().to_representation(data)
+        rows = data.all() if isinstance(data, models.manager.BaseManager) else data
+        results = []
+        for row in rows:
+            item = {}
+            for name, attname, convert in plan:
+                value = getattr(row, attname)
+                item[name] = value if convert is None or value is None else convert(value)
+            results.append(item)
+        return results
+
+    def field_plan(self):
+        model = self.child.Meta.model
+        plan = []
+        for field in self.child._readable_fields:
+            if len(field.source_attrs) != 1:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                return None
+            if not model_field.concrete or model_field.many_to_many:
+                return None
+            if isinstance(field, PrimaryKeyRelatedField) and model_field.many_to_one:
+                plan.append((field.field_name, model_field.attname, None))
+            elif model_field.is_relation or isinstance(field, (serializers.BaseSerializer, serializers.ChoiceField)):
+                return None
+            elif isinstance(field, IDENTITY_FIELDS):
+                plan.append((field.field_name, model_field.attname, None))
+            elif isinstance(field, serializers.DateTimeField):
+                plan.append((field.field_name, model_field.attname, datetime_converter(field)))
+            else:
+                plan.append((field.field_name, model_field.attname, field.to_representation))
+        return plan
+
+
+def datetime_converter(field):
+    """
+    `DateTimeField.to_representation` looks the current timezone up for
+    every value; for ISO 8601 output resolve it once per page instead.
+    """
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if not timezone.is_aware(value):
+            return field.to_representation(value)
+        text = value.astimezone(field_timezone).isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    return convert
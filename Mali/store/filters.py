@@ -0,0 +1,19 @@
+import django_filters
+from django.db.models import Subquery
+
+from .models import Category, Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    category_tree = django_filters.NumberFilter(
+        method="filter_category_tree", label="Category ID, including its sub-categories",
+    )
+
+    class Meta:
+        model = Product
+        fields = ["category", "price"]
+
+    def filter_category_tree(self, queryset, name, value):
+        # One query: category.path LIKE (SELECT path FROM category WHERE id = value) || '%'
+        path = Category.objects.filter(pk=value).values("path")
+        return queryset.filter(category__path__startswith=Subquery(path))
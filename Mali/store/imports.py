@@ -0,0 +1,167 @@
+import codecs
+import csv
+import json
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_generation
+from .models import Category, Product
+from .renderers import orjson
+from .serializers import ProductImportSerializer
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+# Columns an import always changes on an existing product (matched by SKU),
+# and the ones it changes only when the row has them
+UPSERT_FIELDS = ["name", "price", "category", "updated_at"]
+OPTIONAL_FIELDS = ["slug", "description", "currency", "stock_quantity", "is_active"]
+
+
+def read_csv(file):
+    """Rows of a CSV file opened in binary mode (UTF-8, BOM allowed)."""
+    yield from csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+
+
+def read_ndjson(file):
+    """Rows of an NDJSON file opened in binary mode. A bad line becomes a row error."""
+    loads = orjson.loads if orjson is not None else json.loads
+    for line in file:
+        if line.strip():
+            try:
+                yield loads(line)
+            except ValueError as exc:
+                yield InvalidRow(f"Invalid JSON: {exc}")
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+class InvalidRow:
+    def __init__(self, message):
+        self.message = message
+
+
+class ProductImport:
+    """
+    Upsert products on `sku`, `batch_size` rows at a time:
+    - Rows are validated in memory (no per-row queries).
+    - Category slugs are resolved with one lookup per batch, for slugs
+      not seen before.
+    - One query finds the batch's existing SKUs and clashing slugs.
+    - One `bulk_create(update_conflicts=True)` writes the batch (one per
+      set of columns, when its rows differ).
+    Bad rows are reported by row number (1-based) and skipped; the rest of
+    their batch is still written. Optional columns a row leaves out (for a
+    CSV, ones missing from the header) keep their values on existing
+    products; a blank slug keeps the current slug too. New products get the
+    defaults.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.serializer = ProductImportSerializer()
+        self.categories = {}  # slug -> id, or None if missing
+        self.report = {"rows": 0, "created": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def run(self, rows):
+        batch = []
+        for number, row in enumerate(rows, 1):
+            batch.append((number, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        if self.report["created"] or self.report["updated"]:
+            bump_generation()  # bulk_create sends no post_save
+        return self.report
+
+    def error(self, number, errors, sku=None):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"row": number, "sku": sku, "errors": errors})
+
+    def validate(self, batch):
+        valid = {}  # sku -> (row number, data, fields to update); a later row with the same SKU wins
+        for number, row in batch:
+            if isinstance(row, InvalidRow):
+                self.error(number, {"non_field_errors": [row.message]})
+                continue
+            try:
+                data = self.serializer.run_validation(row)
+            except ValidationError as exc:
+                sku = row.get("sku") if isinstance(row, dict) else None
+                self.error(number, exc.detail, sku)
+                continue
+            given = [field for field in OPTIONAL_FIELDS if field in row and (field != "slug" or data.get("slug"))]
+            fields = tuple(UPSERT_FIELDS + given)
+            data["slug"] = data.get("slug") or slugify(data["sku"])[:50]
+            if data["sku"] in valid:
+                earlier = valid[data["sku"]][0]
+                self.error(earlier, {"sku": [f"Duplicate SKU; replaced by row {number}."]}, data["sku"])
+            valid[data["sku"]] = (number, data, fields)
+        return valid
+
+    def resolve_categories(self, slugs):
+        missing = set(slugs) - set(self.categories)
+        if missing:
+            found = dict(Category.objects.filter(slug__in=missing).values_list("slug", "id"))
+            for slug in missing:
+                self.categories[slug] = found.get(slug)
+
+    def import_batch(self, batch):
+        self.report["rows"] += len(batch)
+        valid = self.validate(batch)
+        if not valid:
+            return
+        self.resolve_categories(data["category"] for _, data, _ in valid.values())
+
+        slugs = [data["slug"] for _, data, _ in valid.values()]
+        existing_skus = set()
+        slug_owners = {}
+        for sku, slug in Product.objects.filter(Q(sku__in=list(valid)) | Q(slug__in=slugs)).values_list("sku", "slug"):
+            if sku in valid:
+                existing_skus.add(sku)
+            slug_owners[slug] = sku
+
+        groups, seen_slugs = {}, {}  # fields to update -> products
+        for sku, (number, data, fields) in valid.items():
+            category_id = self.categories[data["category"]]
+            # An existing product's slug only matters if the row changes it
+            slug_checked = sku not in existing_skus or "slug" in fields
+            owner = slug_owners.get(data["slug"], sku) if slug_checked else sku
+            if category_id is None:
+                self.error(number, {"category": [f"Unknown category slug: {data['category']}"]}, sku)
+            elif owner != sku or (slug_checked and seen_slugs.setdefault(data["slug"], sku) != sku):
+                self.error(number, {"slug": [f"Slug {data['slug']} belongs to another product."]}, sku)
+            else:
+                groups.setdefault(fields, []).append(Product(
+                    sku=sku, name=data["name"], slug=data["slug"], description=data["description"],
+                    price=data["price"], currency=data["currency"], stock_quantity=data["stock_quantity"],
+                    is_active=data["is_active"], category_id=category_id,
+                ))
+        products = [product for group in groups.values() for product in group]
+        if not products:
+            return
+
+        try:
+            with transaction.atomic():
+                for fields, group in groups.items():
+                    Product.objects.bulk_create(
+                        group, update_conflicts=True, unique_fields=["sku"], update_fields=list(fields),
+                    )
+        except DatabaseError as exc:
+            for product in products:
+                self.error(valid[product.sku][0], {"non_field_errors": [f"Database error: {exc}"]}, product.sku)
+            return
+        updated = sum(1 for product in products if product.sku in existing_skus)
+        self.report["updated"] += updated
+        self.report["created"] += len(products) - updated
+
+
+def import_products(rows, batch_size=BATCH_SIZE):
+    return ProductImport(batch_size).run(rows)
@@ -0,0 +1,121 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Order, Product, StockReservation, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for products {product_ids}")
+
+
+def reserve_stock(order, quantities):
+    """
+    Hold stock for an order with a single conditional UPDATE:
+
+        UPDATE product SET stock = stock - CASE id ... END
+        WHERE id IN (...) AND stock >= CASE id ... END
+
+    The database applies the check and the decrement atomically per row, so
+    concurrent buyers can never take the same unit. If any product is short,
+    the rows that were decremented are rolled back and InsufficientStock
+    lists the short ones.
+
+    Stock changes here do not bump the catalog cache: the reservation, not
+    the cached `stock_quantity`, is what guards against overselling. They
+    do set `updated_at`, so cached responses and conditional GET validators
+    show the new stock within CATALOG_CACHE_TIMEOUT.
+    """
+    wanted = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(pk__in=list(quantities), stock_quantity__gte=wanted).update(
+                stock_quantity=F("stock_quantity") - wanted, updated_at=timezone.now(),
+            )
+            if updated != len(quantities):
+                raise InsufficientStock([])
+
+            expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+            return StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at)
+                for pk, quantity in quantities.items()
+            ])
+    except InsufficientStock:
+        # Looked up once the decremented rows are rolled back, so products
+        # that had enough stock are not reported
+        short = Product.objects.filter(pk__in=list(quantities), stock_quantity__lt=wanted)
+        raise InsufficientStock(sorted(short.values_list("pk", flat=True)))
+
+
+def release_reservations(order):
+    """Return an order's active reservations to stock. Safe to call twice."""
+    released = 0
+    for reservation in StockReservation.objects.filter(order=order, status="active"):
+        with transaction.atomic():
+            # Only the caller that flips the status gives the stock back
+            if StockReservation.objects.filter(pk=reservation.pk, status="active").update(status="released"):
+                Product.objects.filter(pk=reservation.product_id).update(
+                    stock_quantity=F("stock_quantity") + reservation.quantity, updated_at=timezone.now(),
+                )
+                released += 1
+    return released
+
+
+def renew_reservations(order):
+    """
+    Hold an unpaid order's stock for another STOCK_RESERVATION_TTL before a
+    new payment attempt: extend its active reservations, or reserve the
+    order's lines again if they were released (a failed payment). Raises
+    InsufficientStock when the stock is gone. Call with the order locked.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    if StockReservation.objects.filter(order=order, status="active").update(expires_at=expires_at):
+        return
+    quantities = {}
+    for product_id, quantity in order.items.values_list("product_id", "quantity"):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if quantities:
+        reserve_stock(order, quantities)
+
+
+def confirm_reservations(order):
+    """Mark an order's stock as sold once it is paid."""
+    confirmed = StockReservation.objects.filter(order=order, status="active").update(status="confirmed")
+    if not confirmed and not order.reservations.filter(status="confirmed").exists():
+        logger.warning("Order %s was paid without active stock reservations", order.pk)
+    return confirmed
+
+
+def release_expired_reservations(now=None):
+    """
+    Release reservations whose TTL has passed, fail the pending payments that
+    were holding them and cancel the unpaid orders. Returns the number of
+    orders released.
+    """
+    now = now or timezone.now()
+    order_ids = set(
+        StockReservation.objects.filter(status="active", expires_at__lte=now).values_list("order_id", flat=True)
+    )
+    released = 0
+    for order_id in order_ids:
+        with transaction.atomic():
+            # Renewed for a new payment attempt since the query above?
+            list(Order.objects.select_for_update().filter(pk=order_id))
+            if not StockReservation.objects.filter(order_id=order_id, status="active", expires_at__lte=now).exists():
+                continue
+            Payment.objects.filter(order_id=order_id, status="pending").update(status="failed")
+            Order.objects.filter(pk=order_id, status="pending").update(status="cancelled")
+            release_reservations(order_id)
+            released += 1
+    return released
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.benchmarks import compare_servers
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent throughput of the WSGI deployment (sync gunicorn workers) with the ASGI one "
+        "(Uvicorn workers) on the live STK status endpoint, with Daraja replaced by a local stub that "
+        "answers after --latency ms. Starts each server from gunicorn.conf.py on a free port, using this "
+        "database; needs gunicorn, uvicorn and, for the async Daraja client, httpx."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--latency", type=float, default=200, help="Simulated gateway latency in ms")
+        parser.add_argument("--requests", type=int, default=500, help="Measured requests per server")
+        parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per server")
+        parser.add_argument("--concurrency", type=int, default=50, help="Threads sending requests")
+        parser.add_argument("--workers", type=int, default=2, help="Server worker processes (both modes)")
+        parser.add_argument("--output", "-o", help="Results file (default: asgi-benchmark-<timestamp>.json, - for stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            results = compare_servers(
+                latency=options["latency"] / 1000, count=options["requests"], warmup=options["warmup"],
+                concurrency=options["concurrency"], workers=options["workers"], log=self.stderr.write,
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        output = options["output"] or f"asgi-benchmark-{timezone.now():%Y%m%d-%H%M%S}.json"
+        if output == "-":
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            with open(output, "w") as file:
+                json.dump(results, file, indent=2)
+            self.stderr.write(f"Wrote {output}")
+        if any(stats["errors"] for stats in results["servers"].values()):
+            self.stderr.write(self.style.WARNING("Some requests failed; see status_codes in the results."))
@@ -0,0 +1,59 @@
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from store.models import Category, Product
+from store.renderers import FastJSONRenderer, orjson
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark: render a page of ProductSerializer output with DRF's JSONRenderer and with "
+        "FastJSONRenderer. Uses unsaved products, so nothing is written to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Rows per page")
+        parser.add_argument("--repeat", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write(self.style.WARNING("orjson is not installed; FastJSONRenderer falls back to the stdlib."))
+        now = timezone.now()
+        category = Category(pk=1, name="Phones", slug="phones")
+        products = [
+            Product(
+                pk=i, sku=f"SKU-{uuid.uuid4().hex[:12]}", slug=f"product-{i}", name=f"Product {i} – 128GB",
+                description="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8,
+                price=Decimal("24999.99") + i, stock_quantity=i, category=category,
+                average_rating=Decimal("4.35"), rating_count=i, rating_sum=4 * i, created_at=now, updated_at=now,
+            )
+            for i in range(options["rows"])
+        ]
+        page = {
+            "links": {"next": "http://testserver/products/?page=2", "previous": None},
+            "count": 10000,
+            "results": ProductSerializer(products, many=True).data,
+        }
+
+        results = {}
+        for name, renderer in [("JSONRenderer", JSONRenderer()), ("FastJSONRenderer", FastJSONRenderer())]:
+            body = renderer.render(page)
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                renderer.render(page)
+            elapsed = time.perf_counter() - started
+            results[name] = {
+                "pages_per_second": round(options["repeat"] / elapsed),
+                "us_per_page": round(elapsed / options["repeat"] * 1e6, 1),
+                "bytes": len(body),
+            }
+            results[name]["same_json"] = json.loads(body) == json.loads(JSONRenderer().render(page))
+        results["speedup"] = round(results["JSONRenderer"]["us_per_page"] / results["FastJSONRenderer"]["us_per_page"], 1)
+        self.stdout.write(json.dumps(results, indent=2))
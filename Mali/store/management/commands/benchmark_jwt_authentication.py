@@ -0,0 +1,88 @@
+import json
+import statistics
+import time
+import uuid
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.test import Client, RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.authentication import StatelessJWTAuthentication, add_principal_claims
+from store.models import Order, User
+
+
+class QueryCounter:
+    """execute_wrapper that counts queries (request_started clears connection.queries)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare JWT authentication with a User lookup per request (tokens without role claims) against "
+        "StatelessJWTAuthentication (tokens with them): queries and time per authenticate() call and per "
+        "authenticated GET /orders/. Creates a temporary user and removes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=2000, help="authenticate() calls per variant")
+        parser.add_argument("--requests", type=int, default=500, help="GET /orders/ requests per variant")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f"authbench-{uuid.uuid4().hex[:8]}", password=None)
+        try:
+            Order.objects.bulk_create([Order(customer=user) for _ in range(3)])
+            legacy = str(AccessToken.for_user(user))
+            stateless = str(add_principal_claims(AccessToken.for_user(user), user))
+            results = {
+                "authenticate": {
+                    "db_lookup": self.time_authenticate(JWTAuthentication(), legacy, options["repeat"]),
+                    "stateless": self.time_authenticate(StatelessJWTAuthentication(), stateless, options["repeat"]),
+                },
+                "get_orders": {
+                    "db_lookup": self.time_requests(legacy, options["requests"]),
+                    "stateless": self.time_requests(stateless, options["requests"]),
+                },
+            }
+        finally:
+            user.delete()
+
+        for variants in results.values():
+            before, after = variants["db_lookup"], variants["stateless"]
+            variants["saved"] = {key: round(before[key] - after[key], 1) for key in before}
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def time_authenticate(self, backend, token, repeat):
+        request = Request(RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}"))
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            backend.authenticate(request)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            backend.authenticate(request)
+        elapsed = time.perf_counter() - started
+        return {"queries": queries.count, "us_per_call": round(elapsed / repeat * 1e6, 1)}
+
+    def time_requests(self, token, count):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            assert client.get("/orders/").status_code == 200
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            client.get("/orders/")
+            latencies.append(time.perf_counter() - started)
+        return {
+            "queries": queries.count,
+            "p50_us": round(statistics.median(latencies) * 1e6, 1),
+            "p95_us": round(statistics.quantiles(latencies, n=20)[-1] * 1e6, 1),
+        }
@@ -0,0 +1,75 @@
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework import serializers
+from rest_framework.request import Request
+
+from store.models import Category, Product
+from store.serializers import ProductSerializer
+from store.views import ProductViewSet
+
+
+class ModelProductSerializer(serializers.ModelSerializer):
+    """The product serializer as it was: plain ModelSerializer, every column."""
+
+    class Meta:
+        model = Product
+        exclude = ("search_vector",)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark product page serialization (query + serialize) in rows/sec: the plain ModelSerializer, "
+        "the fast list path, and the fast path with ?fields=id,name,price,slug. Creates a synthetic "
+        "category of products and removes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Rows per page")
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        run = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f"bench-{run}", slug=f"bench-{run}")
+        Product.objects.bulk_create([
+            Product(
+                sku=f"bench-{run}-{i}", slug=f"bench-{run}-{i}", name=f"Benchmark product {i}",
+                description="Lorem ipsum dolor sit amet. " * 20, price=Decimal("999.99"), stock_quantity=i,
+                category=category,
+            )
+            for i in range(rows)
+        ])
+        try:
+            results = {
+                "before": self.measure(ModelProductSerializer, "", category, rows, repeat),
+                "fast": self.measure(ProductSerializer, "", category, rows, repeat),
+                "fast_sparse": self.measure(ProductSerializer, "id,name,price,slug", category, rows, repeat),
+            }
+        finally:
+            category.delete()
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, serializer_class, fields, category, rows, repeat):
+        request = Request(RequestFactory().get("/products/", {"fields": fields} if fields else {}))
+        view = ProductViewSet(request=request, format_kwarg=None, action="list", kwargs={})
+        view.serializer_class = serializer_class
+
+        def page():
+            queryset = view.get_queryset().filter(category=category)[:rows]
+            return serializer_class(queryset, many=True, context={"request": request}).data
+
+        page()  # warm up
+        started = time.perf_counter()
+        for _ in range(repeat):
+            data = page()
+        elapsed = time.perf_counter() - started
+        return {
+            "rows_per_second": round(rows * repeat / elapsed),
+            "ms_per_page": round(elapsed / repeat * 1000, 3),
+            "fields": len(data[0]),
+        }
@@ -0,0 +1,40 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.exports import EXPORTS, FORMATS, export_rows, stream
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the product catalog or all order lines to a file (or stdout) as CSV or NDJSON. "
+        "Rows are read through a server-side cursor, so memory stays flat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("export", choices=sorted(EXPORTS))
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--output", "-o", default="-", help="File to write, or - for stdout")
+
+    def handle(self, *args, **options):
+        model, columns = EXPORTS[options["export"]]
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        started = time.perf_counter()
+        chunks = stream(counted(export_rows(model.objects.all(), columns)), columns, options["format"])
+        if options["output"] == "-":
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        self.stderr.write(f"Exported {count} {options['export']} rows in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmarks import DatasetGenerator, clear_dataset, dataset_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a synthetic dataset for run_benchmarks with bulk_create: a category tree, products, customers, "
+        "reviews, orders and payments. Sizes default to ratios of --products (1M products: 2,000 categories, "
+        "50,000 customers, 1M reviews, 500,000 orders). Uses the database in DATABASE_URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--categories", type=int, help="Default: products / 500 (at least 10)")
+        parser.add_argument("--users", type=int, help="Default: products / 20 (at least 10)")
+        parser.add_argument("--reviews", type=int, help="Default: one per product")
+        parser.add_argument("--orders", type=int, help="Default: products / 2")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per INSERT")
+        parser.add_argument("--clear", action="store_true", help="Replace an existing benchmark dataset")
+        parser.add_argument("--delete", action="store_true", help="Only delete the benchmark dataset")
+
+    def handle(self, *args, **options):
+        products = options["products"]
+        if options["clear"] or options["delete"]:
+            clear_dataset()
+            self.stdout.write("Removed the benchmark dataset.")
+            if options["delete"]:
+                return
+        if dataset_counts()["products"]:
+            raise CommandError("A benchmark dataset already exists; pass --clear to replace it.")
+
+        generator = DatasetGenerator(
+            products=products,
+            categories=options["categories"] or max(10, products // 500),
+            users=options["users"] or max(10, products // 20),
+            reviews=options["reviews"] if options["reviews"] is not None else products,
+            orders=options["orders"] if options["orders"] is not None else products // 2,
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            log=self.stdout.write,
+        )
+        try:
+            counts = generator.generate()
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(json.dumps(counts, indent=2))
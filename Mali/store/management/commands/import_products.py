@@ -0,0 +1,36 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.imports import BATCH_SIZE, READERS, import_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or NDJSON file, matched by SKU. Columns: sku, name, price, "
+        "category (slug), and optionally slug, description, currency, stock_quantity, is_active."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=sorted(READERS), help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--show-errors", type=int, default=20, help="How many row errors to print")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError("Pass --format csv or --format ndjson")
+
+        started = time.perf_counter()
+        with open(options["path"], "rb") as file:
+            report = import_products(READERS[file_format](file), batch_size=options["batch_size"])
+        elapsed = time.perf_counter() - started
+
+        errors = report.pop("errors")
+        report["seconds"] = round(elapsed, 2)
+        report["rows_per_second"] = round(report["rows"] / elapsed) if elapsed else None
+        self.stdout.write(json.dumps(report, indent=2))
+        for error in errors[:options["show_errors"]]:
+            self.stderr.write(f"row {error['row']} ({error['sku']}): {json.dumps(error['errors'])}")
@@ -0,0 +1,118 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from store.benchmarks import start_gateway
+from store.callbacks import apply_unmatched_callbacks
+from store.models import MpesaCallback, Order, Payment, User
+from store.mpesa import MpesaClient
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test M-Pesa callback ingestion: creates pending payments, fires callbacks for them "
+        "(with Safaricom-style duplicate deliveries) and reports callbacks/sec. Synthetic rows are "
+        "removed afterwards unless --keep is given. The successes are then confirmed against a local "
+        "Daraja stand-in, as the outbox worker would."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=2000)
+        parser.add_argument("--duplicates", type=float, default=0.3, help="Extra deliveries as a fraction of --payments")
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--url", help="POST to a running server instead of calling the view in-process")
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        user, payments = self.create_payments(run, options["payments"])
+        deliveries = [self.payload(payment, index) for index, payment in enumerate(payments)]
+        deliveries += random.choices(deliveries, k=int(len(deliveries) * options["duplicates"]))
+        random.shuffle(deliveries)
+
+        post = self.remote_poster(options["url"]) if options["url"] else self.local_poster()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            statuses = list(pool.map(post, deliveries))
+        elapsed = time.perf_counter() - started
+
+        # Successes are confirmed with Daraja by the outbox worker's sweep: run it against a stand-in
+        gateway = start_gateway(0, result_code="0")
+        client = MpesaClient(
+            base_url=f"http://127.0.0.1:{gateway.server_port}", consumer_key="loadtest", consumer_secret="loadtest",
+        )
+        started = time.perf_counter()
+        apply_unmatched_callbacks(client=client, concurrency=options["threads"])
+        confirm_elapsed = time.perf_counter() - started
+        gateway.shutdown()
+        gateway.server_close()
+
+        ids = [payment.checkout_request_id for payment in payments]
+        paid = Payment.objects.filter(checkout_request_id__in=ids, status="successful").count()
+        stored = MpesaCallback.objects.filter(checkout_request_id__in=ids).count()
+        errors = sum(1 for code in statuses if code != 200)
+
+        self.stdout.write(json.dumps({
+            "callbacks": len(deliveries),
+            "unique": len(payments),
+            "seconds": round(elapsed, 3),
+            "callbacks_per_second": round(len(deliveries) / elapsed, 1),
+            "confirm_seconds": round(confirm_elapsed, 3),
+            "http_errors": errors,
+            "payments_paid": paid,
+            "callbacks_stored": stored,
+        }, indent=2))
+        if paid != len(payments) or stored != len(payments):
+            self.stderr.write(self.style.ERROR("Some callbacks were lost or applied twice."))
+
+        if not options["keep"]:
+            MpesaCallback.objects.filter(checkout_request_id__in=ids).delete()
+            user.delete()
+
+    def create_payments(self, run, count):
+        user = User.objects.create_user(username=f"loadtest-{run}", password=uuid.uuid4().hex)
+        orders = Order.objects.bulk_create([Order(customer=user, total_amount=Decimal("1.00")) for _ in range(count)])
+        if orders[0].pk is None:  # backends without RETURNING
+            orders = list(Order.objects.filter(customer=user).order_by("pk"))
+        payments = Payment.objects.bulk_create([
+            Payment(order=order, payment_method="mpesa", amount=Decimal("1.00"), checkout_request_id=f"ws_CO_{run}_{index}")
+            for index, order in enumerate(orders)
+        ])
+        return user, payments
+
+    def payload(self, payment, index):
+        return {"Body": {"stkCallback": {
+            "MerchantRequestID": f"mr-{index}",
+            "CheckoutRequestID": payment.checkout_request_id,
+            "ResultCode": 0,
+            "ResultDesc": "The service request is processed successfully.",
+            "CallbackMetadata": {"Item": [
+                {"Name": "Amount", "Value": 1.00},
+                {"Name": "MpesaReceiptNumber", "Value": f"R{index:09d}"},
+                {"Name": "PhoneNumber", "Value": 254708374149},
+            ]},
+        }}}
+
+    def local_poster(self):
+        local = threading.local()
+
+        def post(body):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            return local.client.post("/mpesa/callback/", body, content_type="application/json").status_code
+        return post
+
+    def remote_poster(self, url):
+        session = requests.Session()
+
+        def post(body):
+            return session.post(url, json=body, timeout=10).status_code
+        return post
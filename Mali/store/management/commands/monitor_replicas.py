@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from store.routers import check_replicas
+
+
+def describe(alias, entry, healthy):
+    if entry["error"]:
+        state = f"unreachable ({entry['error']})"
+    elif entry["lag"] is None:
+        state = "no heartbeat replicated yet"
+    else:
+        state = f"{entry['lag']:.1f}s behind"
+    return f"{alias}: {state}" if healthy else f"{alias}: {state} (out of rotation)"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure read-replica lag from a heartbeat row and publish it to the cache; replicas more than "
+        "REPLICA_MAX_LAG seconds behind, or unreachable, leave the rotation. Run one instance alongside the web servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between checks")
+        parser.add_argument("--once", action="store_true", help="Check once and exit")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured: set DATABASE_REPLICA_URLS.")
+        healthy = None
+        while True:
+            report = check_replicas()
+            now_healthy = {
+                alias for alias, entry in report.items()
+                if entry["lag"] is not None and entry["lag"] <= settings.REPLICA_MAX_LAG
+            }
+            # Log every check with --once, otherwise only rotation changes
+            if options["once"] or now_healthy != healthy:
+                self.stdout.write(", ".join(
+                    describe(alias, entry, alias in now_healthy) for alias, entry in report.items()
+                ))
+                healthy = now_healthy
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.callbacks import apply_unmatched_callbacks
+from store.outbox import drain
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued M-Pesa STK pushes to Daraja with bounded concurrency and retries, and confirm "
+        "and apply the M-Pesa callbacks still waiting for it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, help="Pushes in flight at once (default PAYMENT_OUTBOX_CONCURRENCY)")
+        parser.add_argument("--batch-size", type=int, help="Rows claimed per round")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="Drain what is due and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            results = drain(concurrency=options["concurrency"], batch_size=options["batch_size"])
+            applied = apply_unmatched_callbacks()
+            if applied:
+                results["callbacks applied"] = applied
+            if results:
+                self.stdout.write(", ".join(f"{status}: {count}" for status, count in sorted(results.items())))
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.blacklist import PRUNE_BATCH_SIZE, prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding and blacklisted JWT refresh tokens in small batches. Run hourly from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=PRUNE_BATCH_SIZE, help="Tokens deleted per transaction")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = prune_expired_tokens(batch_size=options["batch_size"], pause=options["pause"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {outstanding} expired outstanding token(s) and {blacklisted} blacklist entry(ies)."
+        ))
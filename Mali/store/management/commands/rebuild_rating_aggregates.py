@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import bump_generation
+from store.models import Product, Review
+from store.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Backfill or repair product rating counts, sums, averages and star histograms from the reviews table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products per GROUP BY/bulk_update batch")
+        parser.add_argument("--product", type=int, action="append", dest="products", help="Only rebuild this product id (repeatable)")
+
+    def handle(self, *args, **options):
+        count = rebuild_rating_aggregates(
+            Product, Review, batch_size=options["batch_size"], product_ids=options["products"]
+        )
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {count} product(s)."))
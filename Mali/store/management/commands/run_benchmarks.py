@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.benchmarks import SCENARIOS, BenchmarkRunner, compare
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles and throughput of the main endpoints against the dataset from "
+        "generate_benchmark_data, and write the results as JSON. Runs in-process on the database in "
+        "DATABASE_URL (SQLite or PostgreSQL), or against a running server with --url. Write scenarios "
+        "remove the rows they create."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Default: all of {', '.join(SCENARIOS)}")
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+        parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=1, help="Threads sending requests")
+        parser.add_argument("--seed", type=int, default=42, help="Seeds the request mix")
+        parser.add_argument("--cold", action="store_true", help="Invalidate the catalog cache before every request")
+        parser.add_argument("--url", help="Base URL of a running server using the same database")
+        parser.add_argument("--output", "-o", help="Results file (default: benchmark-<timestamp>.json, - for stdout)")
+        parser.add_argument("--compare", help="Earlier results file to compare against")
+
+    def handle(self, *args, **options):
+        unknown = set(options["scenarios"]) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        try:
+            runner = BenchmarkRunner(
+                requests=options["requests"], warmup=options["warmup"], concurrency=options["concurrency"],
+                seed=options["seed"], url=options["url"], cold=options["cold"], log=self.stderr.write,
+            )
+            results = runner.run_all(options["scenarios"] or list(SCENARIOS))
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        output = options["output"] or f"benchmark-{timezone.now():%Y%m%d-%H%M%S}.json"
+        if output == "-":
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            with open(output, "w") as file:
+                json.dump(results, file, indent=2)
+            self.stderr.write(f"Wrote {output}")
+
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                previous = json.load(file)
+            for row in compare(previous, results):
+                changes = ", ".join(
+                    f"{key} {value['before']} -> {value['after']} ({value['change_pct']:+}%)"
+                    if value["change_pct"] is not None else f"{key} {value['before']} -> {value['after']}"
+                    for key, value in row.items() if key != "scenario"
+                )
+                self.stderr.write(f"{row['scenario']}: {changes}")
+        if any(stats["errors"] for stats in results["scenarios"].values()):
+            self.stderr.write(self.style.WARNING("Some requests failed; see status_codes in the results."))
@@ -0,0 +1,194 @@
+import heapq
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .authentication import StatelessJWTAuthentication
+from .routers import choose_replica, is_pinned, pin_to_primary, reading_from, use_replica
+
+authentication = StatelessJWTAuthentication()
+
+logger = logging.getLogger("store.sql")
+
+
+class QueryRecorder:
+    """`execute_wrapper` that counts and times every statement."""
+
+    def __init__(self, keep=5):
+        self.keep = keep
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []  # min-heap of (seconds, sql)
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.total += elapsed
+            self.templates[sql] += 1
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, sql))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, sql))
+
+    def repeated(self, threshold):
+        # The same SQL template run many times in one request is usually an N+1
+        return [{"sql": sql[:500], "count": count} for sql, count in self.templates.most_common(3) if count >= threshold]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Opt-in (SQL_INSTRUMENTATION=True) per-request SQL accounting.
+    - Every response gets `Server-Timing: db;dur=..;desc="N queries", app;dur=..`,
+      which browser dev tools show next to the request.
+    - Requests slower than SQL_SLOW_REQUEST_MS, or running more than
+      SQL_SLOW_REQUEST_QUERIES statements, are logged to "store.sql" as
+      one JSON object with the slowest and most repeated statements.
+    Streaming bodies are produced after the headers are sent, so their
+    queries are not counted.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        db_ms, app_ms = recorder.total * 1000, (elapsed - recorder.total) * 1000
+        response["Server-Timing"] = f'db;dur={db_ms:.1f};desc="{recorder.count} queries", app;dur={app_ms:.1f}'
+
+        if elapsed * 1000 >= settings.SQL_SLOW_REQUEST_MS or recorder.count > settings.SQL_SLOW_REQUEST_QUERIES:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 1),
+                "db_ms": round(db_ms, 1),
+                "queries": recorder.count,
+                "slowest": [
+                    {"ms": round(seconds * 1000, 2), "sql": sql[:500]}
+                    for seconds, sql in sorted(recorder.slowest, reverse=True)
+                ],
+                "repeated": recorder.repeated(threshold=5),
+            }))
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can sit in an async middleware chain. Under ASGI, one
+    sync-only middleware makes Django run every request, async views
+    included, through a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+def request_identity(request):
+    """The user id in the request's valid JWT, else None."""
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    try:
+        return authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+    except InvalidToken:
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Read-replica routing, active when DATABASE_REPLICA_URLS is set.
+    - GET/HEAD/OPTIONS requests for views marked `replica_reads = True`
+      read from a healthy replica, picked at random per request. Everything
+      else (writes, checkout, payments, orders) uses the primary.
+    - Read-your-writes: after a user sends any unsafe request, their reads
+      stay on the primary for REPLICA_STICKY_SECONDS. Users are identified
+      by their JWT; anonymous clients cannot write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # process_view may pick a replica; the block resets it afterwards
+        with reading_from(None):
+            response = self.get_response(request)
+        self.after(request)
+        return response
+
+    async def __acall__(self, request):
+        with reading_from(None):
+            response = await self.get_response(request)
+        self.after(request)
+        return response
+
+    def route(self, request, view_func):
+        if request.method in SAFE_METHODS and getattr(getattr(view_func, "cls", view_func), "replica_reads", False):
+            identity = request_identity(request)
+            if identity is None or not is_pinned(identity):
+                alias = choose_replica()
+                if alias is not None:
+                    use_replica(alias)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.route(request, view_func)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Runs in the request's context, unlike a sync hook run through a thread
+        self.route(request, view_func)
+
+    def after(self, request):
+        if request.method not in SAFE_METHODS:
+            identity = request_identity(request)
+            if identity is not None:
+                pin_to_primary(identity)
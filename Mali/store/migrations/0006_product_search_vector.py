@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:19
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# PostgreSQL only: the search vector is kept up to date by a trigger so that
+# bulk_create/update() writes are indexed too. Name is weighted above description.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE OR REPLACE FUNCTION store_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER store_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description ON store_product
+    FOR EACH ROW EXECUTE FUNCTION store_product_search_vector_update()
+    """,
+    "UPDATE store_product SET name = name",
+    "CREATE INDEX store_product_search_vector_gin ON store_product USING gin (search_vector)",
+    "CREATE INDEX store_product_name_trgm ON store_product USING gin (name gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS store_product_name_trgm",
+    "DROP INDEX IF EXISTS store_product_search_vector_gin",
+    "DROP TRIGGER IF EXISTS store_product_search_vector_trigger ON store_product",
+    "DROP FUNCTION IF EXISTS store_product_search_vector_update()",
+]
+
+
+def run_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_postgres(POSTGRES_FORWARD), run_postgres(POSTGRES_BACKWARD)),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:24
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+STAR_FIELDS = [f"stars_{stars}" for stars in range(1, 6)]
+
+
+def backfill(apps, schema_editor):
+    # A copy of store.ratings.rebuild_rating_aggregates as it was when this
+    # migration was written, so later changes there can't alter it
+    Product = apps.get_model("store", "Product")
+    Review = apps.get_model("store", "Review")
+    ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        stats = {
+            row["product"]: row
+            for row in Review.objects.filter(product__in=batch).order_by().values("product").annotate(
+                rating_count=Count("pk"),
+                rating_sum=Sum("rating"),
+                **{field: Count("pk", filter=Q(rating=stars)) for stars, field in enumerate(STAR_FIELDS, 1)},
+            )
+        }
+        rows = []
+        for pk in batch:
+            row = stats.get(pk, {})
+            product = Product(pk=pk, rating_count=row.get("rating_count", 0), rating_sum=row.get("rating_sum") or 0)
+            product.average_rating = (
+                round(Decimal(product.rating_sum) / product.rating_count, 2) if product.rating_count else Decimal("0")
+            )
+            for field in STAR_FIELDS:
+                setattr(product, field, row.get(field, 0))
+            rows.append(product)
+        Product.objects.bulk_update(rows, ["rating_count", "rating_sum", "average_rating", *STAR_FIELDS])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:35
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    Category = apps.get_model("store", "Category")
+    categories = {category.pk: category for category in Category.objects.all()}
+    paths = {}
+
+    def path_of(pk, seen=()):
+        if pk not in paths:
+            parent_id = categories[pk].parent_id
+            # A parent loop in old data is broken by making the category a root
+            if parent_id is None or parent_id in seen or parent_id not in categories:
+                paths[pk] = f"{pk}/"
+            else:
+                paths[pk] = f"{path_of(parent_id, (*seen, pk))}{pk}/"
+        return paths[pk]
+
+    for category in categories.values():
+        category.path = path_of(category.pk)
+        category.depth = category.path.count("/") - 1
+    Category.objects.bulk_update(categories.values(), ["path", "depth"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_mpesa_callback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
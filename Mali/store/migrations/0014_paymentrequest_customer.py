@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill(apps, schema_editor):
+    # Pushes for a payment belong to its order's customer
+    PaymentRequest = apps.get_model("store", "PaymentRequest")
+    Payment = apps.get_model("store", "Payment")
+    customer = Payment.objects.filter(pk=OuterRef("payment_id")).values("order__customer_id")[:1]
+    PaymentRequest.objects.filter(payment__isnull=False).update(customer_id=Subquery(customer))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentrequest',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_requests', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,23 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, Concat, Round, Substr
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+from collections import Counter
 from decimal import Decimal
 
+
+def loaded(instance, name):
+    """
+    The related object `name` if it is already loaded (select_related,
+    prefetch or assignment), else None. Lets __str__ avoid a query per row.
+    """
+    field = instance._meta.get_field(name)
+    return field.get_cached_value(instance) if field.is_cached(instance) else None
+
 # -----------------------------
 # User & Profile
 # -----------------------------
@@ -46,6 +60,10 @@ class Category(models.Model):
     parent = models.ForeignKey(
         "self", null=True, blank=True, related_name="children", on_delete=models.SET_NULL
     )
+    # Materialized path of ancestor ids, e.g. "1/4/9/" for 9 under 4 under 1.
+    # A subtree is a prefix match: path LIKE '1/4/%'.
+    path = models.CharField(max_length=255, blank=True, default="", editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -53,8 +71,80 @@ class Category(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=["name"]),
+            # pattern_ops so PostgreSQL can use it for LIKE 'prefix%'
+            models.Index(fields=["path"], name="category_path_idx", opclasses=["varchar_pattern_ops"]),
             ]
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self.pk and self.parent_id and (update_fields is None or "parent" in update_fields):
+            if Category.objects.filter(pk=self.parent_id, path__startswith=self.stored_path()).exists():
+                raise ValueError("A category cannot be moved under itself or its sub-categories.")
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or "parent" in update_fields:
+                self.update_path(old_path="" if adding else None)
+
+    def stored_path(self):
+        return Category.objects.filter(pk=self.pk).values_list("path", flat=True).get()
+
+    def update_path(self, old_path=None):
+        """
+        Recompute this category's path from its parent and, if it moved,
+        rewrite the paths of its whole subtree with one UPDATE.
+        """
+        parent_path = ""
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+        path = f"{parent_path}{self.pk}/"
+        depth = path.count("/") - 1
+        if old_path is None:
+            old_path = self.stored_path()
+        if path != old_path:
+            old_depth = old_path.count("/") - 1
+            # A new row ("" path) has no subtree yet
+            rows = Category.objects.filter(path__startswith=old_path) if old_path else Category.objects.filter(pk=self.pk)
+            rows.update(
+                path=Concat(models.Value(path), Substr("path", len(old_path) + 1)),
+                depth=models.F("depth") + (depth - old_depth) if old_path else depth,
+                updated_at=timezone.now(),
+            )
+        self.path, self.depth = path, depth
+
+    def detach_children(self):
+        """
+        Turn the subtrees below this category into root trees. Called before
+        a delete, when `on_delete=SET_NULL` is about to orphan the children.
+        """
+        path, depth = Category.objects.filter(pk=self.pk).values_list("path", "depth").get()
+        if path:
+            Category.objects.filter(path__startswith=path).exclude(pk=self.pk).update(
+                path=Substr("path", len(path) + 1), depth=models.F("depth") - (depth + 1), updated_at=timezone.now(),
+            )
+
+    @classmethod
+    def tree(cls):
+        """
+        The whole hierarchy as nested dicts, from one query. `product_count`
+        counts a category's own products, `total_product_count` includes its
+        sub-categories.
+        """
+        rows = cls.objects.annotate(product_count=models.Count("products")).order_by("depth", "name").values(
+            "id", "name", "slug", "parent_id", "depth", "product_count",
+        )
+        nodes, roots = {}, []
+        for row in rows:  # parents come before their children
+            node = {**row, "total_product_count": row["product_count"], "children": []}
+            nodes[row["id"]] = node
+            parent = nodes.get(row["parent_id"])
+            (parent["children"] if parent else roots).append(node)
+        for node in sorted(nodes.values(), key=lambda node: -node["depth"]):
+            parent = nodes.get(node["parent_id"])
+            if parent:
+                parent["total_product_count"] += node["total_product_count"]
+        return roots
+
     def __str__(self):
         return self.name
 
@@ -72,22 +162,57 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True,db_index=True) # Database indexing
     updated_at = models.DateTimeField(auto_now=True)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
+    # Rating aggregates, kept in step with reviews by store/signals.py
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)  # histogram: reviews per star value
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    # Maintained by a PostgreSQL trigger (see migration 0006), unused on SQLite
+    search_vector = SearchVectorField(null=True, editable=False)
 
 # Database indexing
     class Meta:
         indexes = [
             models.Index(fields=["price"]),
             models.Index(fields=["created_at"]),
+            # Keyset pagination: ordering key + id tiebreaker
+            models.Index(fields=["-created_at", "-id"], name="product_created_id_idx"),
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
         ]
 
-    def update_average_rating(self):
-        reviews = self.reviews.all()
-        if reviews.exists():
-            avg = reviews.aggregate(models.Avg("rating"))["rating__avg"]
-            self.average_rating = round(avg, 2)
-        else:
-            self.average_rating = 0.00
-        self.save(update_fields=["average_rating"])
+    @classmethod
+    def apply_rating_change(cls, product_id, added=None, removed=None):
+        """
+        Add and/or remove one rating with a single atomic UPDATE, e.g.
+        an edited review is `added=new, removed=old`. The average is
+        computed in the same statement from the new count and sum.
+        """
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+        count = models.F("rating_count") + count_delta
+        total = models.F("rating_sum") + sum_delta
+        changes = {
+            "rating_count": count,
+            "rating_sum": total,
+            "average_rating": models.Case(
+                models.When(GreaterThan(count, 0), then=Round(Cast(total, models.FloatField()) / count, 2)),
+                default=models.Value(0),
+                output_field=models.DecimalField(max_digits=3, decimal_places=2),
+            ),
+            "updated_at": timezone.now(),
+        }
+        histogram = Counter()
+        if added is not None:
+            histogram[added] += 1
+        if removed is not None:
+            histogram[removed] -= 1
+        for stars, delta in histogram.items():
+            if delta and 1 <= stars <= 5:
+                changes[f"stars_{stars}"] = models.F(f"stars_{stars}") + delta
+        return cls.objects.filter(pk=product_id).update(**changes)
 
 
     def __str__(self):
@@ -103,7 +228,8 @@ class Cart(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Cart of {self.customer}"
+        customer = loaded(self, "customer")
+        return f"Cart of {customer if customer else f'customer {self.customer_id}'}"
 
 
 class CartItem(models.Model):
@@ -112,7 +238,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
 
     def __str__(self):
-        return f"{self.quantity} × {self.product.name}"
+        product = loaded(self, "product")
+        return f"{self.quantity} × {product.name if product else f'product {self.product_id}'}"
 
 
 # -----------------------------
@@ -128,7 +255,10 @@ class Order(models.Model):
         ("cancelled", "Cancelled"),
     ]
 
-    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="orders")
+    customer = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="orders",
+        db_index=False,  # order_customer_created_idx starts with customer
+    )
     products = models.ManyToManyField("Product", through="OrderItem")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
@@ -136,11 +266,19 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     mpesa_receipt = models.CharField(max_length=100, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Order history: one customer's orders, newest first, keyset-paginated
+            models.Index(fields=["customer", "-created_at", "-id"], name="order_customer_created_idx"),
+        ]
+
     def calculate_total(self):
-        total = sum([item.quantity * item.product.price for item in self.items.all()])
-        self.total_amount = total
-        self.save()
-        return total
+        # One aggregate query; deleted products fall back to the price snapshot
+        line_total = models.F("quantity") * Coalesce("product__price", "price")
+        total = self.items.aggregate(total=models.Sum(line_total, output_field=models.DecimalField()))["total"]
+        self.total_amount = total or Decimal("0")
+        self.save(update_fields=["total_amount", "updated_at"])
+        return self.total_amount
 
     def __str__(self):
         return f"Order {self.id} - {self.status}"
@@ -157,7 +295,36 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.quantity} × {self.product.name if self.product else 'Deleted Product'}"
+        if self.product_id is None:
+            return f"{self.quantity} × Deleted Product"
+        product = loaded(self, "product")
+        return f"{self.quantity} × {product.name if product else f'product {self.product_id}'}"
+
+
+# -----------------------------
+# Stock Reservations
+# -----------------------------
+class StockReservation(models.Model):
+    STATUS_CHOICES = [
+        ("active", "Active"),        # stock held until expires_at
+        ("confirmed", "Confirmed"),  # order paid, stock sold
+        ("released", "Released"),    # payment failed/expired, stock returned
+    ]
+
+    order = models.ForeignKey(Order, related_name="reservations", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name="reservations", on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="active")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "expires_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} × product {self.product_id} for Order {self.order_id} ({self.status})"
 
 
 # -----------------------------
@@ -181,10 +348,69 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     transaction_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)  # from Daraja
     paid_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"Payment {self.id} for Order {self.order.id}"
+        return f"Payment {self.id} for Order {self.order_id}"
+
+
+class MpesaCallback(models.Model):
+    """
+    Raw STK push callback from Safaricom, one row per CheckoutRequestID.
+    The unique key turns Safaricom's retried deliveries into no-ops.
+    """
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    result_code = models.IntegerField()
+    result_desc = models.CharField(max_length=255, blank=True)
+    receipt_number = models.CharField(max_length=100, blank=True, null=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    payload = models.JSONField()
+    processed = models.BooleanField(default=False)  # applied to its Payment, or rejected as unconfirmed
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.result_code})"
+
+
+class PaymentRequest(models.Model):
+    """
+    Outbox row for an STK push. Written in the same transaction as the
+    order/payment and sent to Daraja by `manage.py process_payment_outbox`.
+    """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    ]
+
+    payment = models.ForeignKey(Payment, related_name="requests", on_delete=models.CASCADE, null=True, blank=True)
+    # Who may follow the push: the order's customer, or whoever asked for a direct push
+    customer = models.ForeignKey(
+        User, related_name="payment_requests", on_delete=models.SET_NULL, null=True, blank=True,
+    )
+    phone_number = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    account_reference = models.CharField(max_length=50, default="Mali")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease held by a worker
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"STK push {self.id} ({self.status})"
 
 # -----------------------------
 # Shipping
@@ -205,7 +431,7 @@ class Shipping(models.Model):
     delivered_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"Shipping for Order {self.order.id}"
+        return f"Shipping for Order {self.order_id}"
     
 
 class Review(models.Model):
@@ -219,5 +445,26 @@ class Review(models.Model):
         unique_together = ("product", "user")  # each user can review a product once
         ordering = ["-created_at"]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the stored rating so signals can apply edit deltas
+        instance = super().from_db(db, field_names, values)
+        instance._stored_rating = (instance.__dict__.get("product_id"), instance.__dict__.get("rating"))
+        return instance
+
+    def __str__(self):
+        user, product = loaded(self, "user"), loaded(self, "product")
+        by = user.username if user else f"user {self.user_id}"
+        on = product.name if product else f"product {self.product_id}"
+        return f"{self.rating}★ by {by} on {on}"
+
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row that `manage.py monitor_replicas` rewrites on the primary
+    every second. Its age as read on a replica is that replica's lag.
+    """
+    beat_at = models.DateTimeField()
+
     def __str__(self):
-        return f"{self.rating}★ by {self.user.username} on {self.product.name}"
+        return f"Heartbeat at {self.beat_at:%Y-%m-%d %H:%M:%S}"
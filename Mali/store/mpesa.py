@@ -1,25 +1,182 @@
 # store/mpesa.py
+import asyncio
 import base64
-import requests
+import threading
+import time
+import weakref
 from datetime import datetime
+from decimal import ROUND_CEILING, Decimal
+
+import requests
 from django.conf import settings
-from requests.auth import HTTPBasicAuth
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:  # async views call the requests-based client in a thread instead
+    httpx = None
+
+TOKEN_PATH = "/oauth/v1/generate"
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+STK_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
+
+
+class MpesaError(Exception):
+    """Daraja could not be reached or rejected the request."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        # Connection problems, throttling and server errors may succeed later
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class LatencyStats:
+    """Thread-safe per-operation call counters: calls, errors, total and max ms."""
 
-class MpesaClient:
     def __init__(self):
-        self.shortcode = "174379"  # BusinessShortCode
-        self.passkey = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
-        self.consumer_key = settings.MPESA_CONSUMER_KEY
-        self.consumer_secret = settings.MPESA_CONSUMER_SECRET
-        self.base_url = "https://sandbox.safaricom.co.ke"
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, operation, elapsed, failed=False):
+        with self.lock:
+            entry = self.stats.setdefault(operation, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["calls"] += 1
+            entry["errors"] += int(failed)
+            entry["total_ms"] += elapsed * 1000
+            entry["max_ms"] = max(entry["max_ms"], elapsed * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                operation: {**entry, "avg_ms": entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0}
+                for operation, entry in self.stats.items()
+            }
+
 
+class MpesaClient:
+    """
+    Daraja (M-Pesa) gateway client.
+    - One keep-alive `requests.Session` per client, with connect/read
+      timeouts. Token fetches retry with backoff on connection errors and
+      5xx; STK pushes only retry when the connection could not be made, so
+      a push is never sent twice.
+    - The OAuth token is cached in memory and in the shared cache until
+      MPESA_TOKEN_REFRESH_MARGIN seconds before it expires. Refreshing takes
+      a lock, so only one caller per process and one worker across the
+      cluster asks Daraja for a new token.
+    - `stats` records call counts and latency per operation.
+    Use `get_client()` to share one instance (and its connection pool).
+    """
+
+    def __init__(self, base_url=None, consumer_key=None, consumer_secret=None, shortcode=None, passkey=None,
+                 callback_url=None, timeout=None, max_retries=None):
+        self.base_url = (base_url or settings.MPESA_BASE_URL).rstrip("/")
+        self.consumer_key = consumer_key if consumer_key is not None else settings.MPESA_CONSUMER_KEY
+        self.consumer_secret = consumer_secret if consumer_secret is not None else settings.MPESA_CONSUMER_SECRET
+        self.shortcode = shortcode or settings.MPESA_SHORTCODE  # BusinessShortCode
+        self.passkey = passkey or settings.MPESA_PASSKEY
+        self.callback_url = callback_url or settings.MPESA_CALLBACK_URL
+        self.timeout = timeout or (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+        retries = settings.MPESA_MAX_RETRIES if max_retries is None else max_retries
+        self.session = self._session(retries)
+
+        self.stats = LatencyStats()
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+        self._token_cache_key = f"mpesa:token:{self.base_url}:{self.consumer_key}"
+
+    def _session(self, retries):
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(max_retries=self._retry(retries), pool_maxsize=settings.MPESA_POOL_SIZE))
+        session.mount("http://", HTTPAdapter(max_retries=self._retry(retries), pool_maxsize=settings.MPESA_POOL_SIZE))
+        return session
+
+    @staticmethod
+    def _retry(total):
+        return Retry(
+            total=total,
+            connect=total,
+            read=total,
+            status=total,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),  # read/status retries never resend a POST
+            raise_on_status=False,
+        )
+
+    def _request(self, operation, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            self.stats.record(operation, time.perf_counter() - started, failed=True)
+            status_code = getattr(getattr(exc, "response", None), "status_code", None)
+            raise MpesaError(f"M-Pesa {operation} failed: {exc}", status_code=status_code) from exc
+        self.stats.record(operation, time.perf_counter() - started)
+        return data
+
+    # ---------------- access token ----------------
     def get_access_token(self):
-        """Request access token from Safaricom Daraja"""
-        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-        response = requests.get(url, auth=(self.consumer_key, self.consumer_secret))
-        response.raise_for_status()
-        return response.json()["access_token"]
+        """Return a cached access token, refreshing it if it is about to expire."""
+        if self._token and time.monotonic() < self._token_expires:
+            return self._token
+
+        with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires:
+                return self._token
+
+            shared = cache.get(self._token_cache_key)
+            if shared is None:
+                shared = self._refresh_shared_token()
+            token, expires_at = shared
+            self._token = token
+            self._token_expires = time.monotonic() + max(expires_at - time.time(), 0)
+            return token
+
+    def _refresh_shared_token(self):
+        lock_key = f"{self._token_cache_key}:lock"
+        lock_timeout = sum(self.timeout) + 1
+        locked = cache.add(lock_key, 1, lock_timeout)
+        if not locked:
+            # Another worker is refreshing; wait for its token
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                shared = cache.get(self._token_cache_key)
+                if shared is not None:
+                    return shared
+        try:
+            data = self._request(
+                "token", "GET", TOKEN_PATH,
+                params={"grant_type": "client_credentials"},
+                auth=(self.consumer_key, self.consumer_secret),
+            )
+            lifetime = max(int(data.get("expires_in", 3599)) - settings.MPESA_TOKEN_REFRESH_MARGIN, 1)
+            shared = (data["access_token"], time.time() + lifetime)
+            cache.set(self._token_cache_key, shared, lifetime)
+            return shared
+        except KeyError as exc:
+            raise MpesaError("M-Pesa token response had no access_token") from exc
+        finally:
+            if locked:
+                cache.delete(lock_key)
 
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expires = 0.0
+            cache.delete(self._token_cache_key)
+
+    # ---------------- STK push ----------------
     def generate_password(self):
         """Generate base64 encoded password"""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -27,82 +184,177 @@ class MpesaClient:
         encoded = base64.b64encode(data_to_encode.encode()).decode("utf-8")
         return encoded, timestamp
 
-    def stk_push(self, phone_number="254708374149", amount=1, account_reference="Test123", transaction_desc="Payment Test"):
-        """Initiate STK Push"""
-        access_token = self.get_access_token()
-        password, timestamp = self.generate_password()
+    def _authorized_post(self, operation, path, payload):
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {self.get_access_token()}"}
+            try:
+                return self._request(operation, "POST", path, json=payload, headers=headers)
+            except MpesaError as exc:
+                # A token revoked early: refresh once and try again
+                if attempt or exc.status_code != 401:
+                    raise
+                self.invalidate_token()
 
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
+    def stk_push_payload(self, phone_number, amount, account_reference="Mali", transaction_desc="Payment"):
+        password, timestamp = self.generate_password()
+        return {
             "BusinessShortCode": self.shortcode,
             "Password": password,
             "Timestamp": timestamp,
             "TransactionType": "CustomerPayBillOnline",
-            "Amount": amount,
+            "Amount": int(amount),
             "PartyA": phone_number,
             "PartyB": self.shortcode,   # MUST be your shortcode
             "PhoneNumber": phone_number,
-            "CallBackURL": " https://healthful-rosaria-resistible.ngrok-free.dev.app/mpesa/callback/",
+            "CallBackURL": self.callback_url,
             "AccountReference": account_reference,
-            "TransactionDesc": transaction_desc
+            "TransactionDesc": transaction_desc,
         }
 
-        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+    def stk_query_payload(self, checkout_request_id):
+        password, timestamp = self.generate_password()
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+
+    def stk_push(self, phone_number, amount, account_reference="Mali", transaction_desc="Payment"):
+        """Initiate STK Push"""
+        payload = self.stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+        return self._authorized_post("stk_push", STK_PUSH_PATH, payload)
+
+    def stk_query(self, checkout_request_id):
+        """Ask Daraja for the status of an earlier STK Push"""
+        return self._authorized_post("stk_query", STK_QUERY_PATH, self.stk_query_payload(checkout_request_id))
+
+def whole_shillings(amount):
+    """What an STK push for `amount` charges: M-Pesa takes whole shillings, so cents round up."""
+    return Decimal(amount).to_integral_value(rounding=ROUND_CEILING)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
 
+def get_client():
+    """Shared MpesaClient for the current settings (one connection pool per process)."""
+    key = (settings.MPESA_BASE_URL, settings.MPESA_CONSUMER_KEY)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = MpesaClient()
+        return _clients[key]
 
-# -------------------------
-# Helper for Orders
-# -------------------------
 
-def initiate_stk_push(order, phone_number="254708374149"):
+class AsyncMpesaClient(MpesaClient):
     """
-    Initiates an STK Push request to Safaricom's M-Pesa API (Sandbox).
+    MpesaClient for async views: the same payloads, stats and shared token
+    cache, with awaitable calls on an `httpx.AsyncClient`, so a slow gateway
+    holds no worker thread. httpx only retries failed connections, which
+    never resends a push. An httpx client belongs to the event loop that
+    made it; use `get_async_client()`.
     """
 
-    # ✅ Correct timestamp
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-
-    # ✅ Correct password encoding: Shortcode + Passkey + Timestamp
-    password_str = f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}"
-    password = base64.b64encode(password_str.encode()).decode("utf-8")
-
-    # ✅ Prepare payload
-    payload = {
-        "BusinessShortCode": settings.MPESA_SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": int(order.total_amount),   # ensure integer
-        "PartyA": phone_number,              # MSISDN sending money
-        "PartyB": settings.MPESA_SHORTCODE,  # Paybill/till
-        "PhoneNumber": phone_number,
-        "CallBackURL": f"{settings.BASE_URL}/mpesa/callback/",
-        "AccountReference": f"Order{order.id}",
-        "TransactionDesc": "Payment for Order",
-    }
-
-    # ✅ Headers
-    headers = {
-        "Authorization": f"Bearer {settings.MPESA_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-    # ✅ Endpoint
-    api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-
-    # ✅ Send request
-    response = requests.post(api_url, json=payload, headers=headers)
-
-    # Debug: print error details
-    print("STK Push Response:", response.text)
-
-    # Raise if failed
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = asyncio.Lock()
+
+    def _session(self, retries):
+        transport = httpx.AsyncHTTPTransport(
+            retries=retries, limits=httpx.Limits(max_keepalive_connections=settings.MPESA_POOL_SIZE),
+        )
+        connect, read = self.timeout
+        return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(read, connect=connect))
+
+    async def _request(self, operation, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as exc:
+            self.stats.record(operation, time.perf_counter() - started, failed=True)
+            status_code = exc.response.status_code if isinstance(exc, httpx.HTTPStatusError) else None
+            raise MpesaError(f"M-Pesa {operation} failed: {exc}", status_code=status_code) from exc
+        self.stats.record(operation, time.perf_counter() - started)
+        return data
+
+    async def get_access_token(self):
+        if self._token and time.monotonic() < self._token_expires:
+            return self._token
+
+        async with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires:
+                return self._token
+
+            shared = await cache.aget(self._token_cache_key)
+            if shared is None:
+                shared = await self._refresh_shared_token()
+            token, expires_at = shared
+            self._token = token
+            self._token_expires = time.monotonic() + max(expires_at - time.time(), 0)
+            return token
+
+    async def _refresh_shared_token(self):
+        lock_key = f"{self._token_cache_key}:lock"
+        lock_timeout = sum(self.timeout) + 1
+        locked = await cache.aadd(lock_key, 1, lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                shared = await cache.aget(self._token_cache_key)
+                if shared is not None:
+                    return shared
+        try:
+            data = await self._request(
+                "token", "GET", TOKEN_PATH,
+                params={"grant_type": "client_credentials"},
+                auth=(self.consumer_key, self.consumer_secret),
+            )
+            lifetime = max(int(data.get("expires_in", 3599)) - settings.MPESA_TOKEN_REFRESH_MARGIN, 1)
+            shared = (data["access_token"], time.time() + lifetime)
+            await cache.aset(self._token_cache_key, shared, lifetime)
+            return shared
+        except KeyError as exc:
+            raise MpesaError("M-Pesa token response had no access_token") from exc
+        finally:
+            if locked:
+                await cache.adelete(lock_key)
+
+    async def invalidate_token(self):
+        self._token = None
+        self._token_expires = 0.0
+        await cache.adelete(self._token_cache_key)
+
+    async def _authorized_post(self, operation, path, payload):
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {await self.get_access_token()}"}
+            try:
+                return await self._request(operation, "POST", path, json=payload, headers=headers)
+            except MpesaError as exc:
+                if attempt or exc.status_code != 401:
+                    raise
+                await self.invalidate_token()
+
+    async def stk_push(self, phone_number, amount, account_reference="Mali", transaction_desc="Payment"):
+        payload = self.stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+        return await self._authorized_post("stk_push", STK_PUSH_PATH, payload)
+
+    async def stk_query(self, checkout_request_id):
+        return await self._authorized_post("stk_query", STK_QUERY_PATH, self.stk_query_payload(checkout_request_id))
+
+
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {settings key: client}
+
+
+def get_async_client():
+    """Shared AsyncMpesaClient for the running event loop, or None without httpx."""
+    if httpx is None:
+        return None
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (settings.MPESA_BASE_URL, settings.MPESA_CONSUMER_KEY)
+    if key not in clients:
+        clients[key] = AsyncMpesaClient()
+    return clients[key]
@@ -0,0 +1,120 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .callbacks import apply_pending_callback
+from .inventory import release_reservations
+from .models import Payment, PaymentRequest
+from .mpesa import MpesaError, get_client, whole_shillings
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_stk_push(phone_number, amount, payment=None, account_reference="Mali", customer_id=None):
+    """
+    Queue an STK push. Call inside the transaction that creates the payment,
+    so the push is sent if and only if the payment was committed. A push for
+    a payment belongs to the order's customer, a direct one to `customer_id`.
+    The amount is rounded up to whole shillings here, once, and stored on
+    the payment too: callbacks are checked against it.
+    """
+    amount = whole_shillings(amount)
+    if payment is not None:
+        customer_id = payment.order.customer_id
+        if payment.amount != amount:
+            Payment.objects.filter(pk=payment.pk).update(amount=amount)
+            payment.amount = amount
+    return PaymentRequest.objects.create(
+        payment=payment, customer_id=customer_id, phone_number=phone_number, amount=amount,
+        account_reference=account_reference,
+    )
+
+
+def claim_batch(limit):
+    """
+    Lease up to `limit` due rows. Each row is claimed with a conditional
+    UPDATE, so two workers never send the same push; rows whose lease ran
+    out (a worker died mid-send) become claimable again.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.PAYMENT_OUTBOX_LEASE)
+    due = Q(status="pending", next_attempt_at__lte=now) | Q(status="processing", locked_until__lt=now)
+    claimed = []
+    for pk in PaymentRequest.objects.filter(due).order_by("next_attempt_at").values_list("pk", flat=True)[:limit]:
+        if PaymentRequest.objects.filter(due, pk=pk).update(status="processing", locked_until=lease):
+            claimed.append(pk)
+    return list(PaymentRequest.objects.filter(pk__in=claimed).select_related("payment"))
+
+
+def send(request, client=None):
+    """Send one claimed request and record the outcome. Returns the new status."""
+    client = client or get_client()
+    if request.payment_id and request.payment.status != "pending":
+        # Paid, failed or expired while queued
+        PaymentRequest.objects.filter(pk=request.pk).update(status="cancelled", locked_until=None)
+        return "cancelled"
+
+    try:
+        response = client.stk_push(request.phone_number, request.amount, account_reference=request.account_reference)
+    except MpesaError as exc:
+        return record_failure(request, exc)
+
+    checkout_request_id = response.get("CheckoutRequestID")
+    with transaction.atomic():
+        PaymentRequest.objects.filter(pk=request.pk).update(
+            status="sent", attempts=request.attempts + 1, checkout_request_id=checkout_request_id,
+            locked_until=None, last_error="", updated_at=timezone.now(),
+        )
+        if request.payment_id:
+            Payment.objects.filter(pk=request.payment_id).update(checkout_request_id=checkout_request_id)
+    if request.payment_id:
+        # The customer may have paid before we got here
+        apply_pending_callback(checkout_request_id, client)
+    return "sent"
+
+
+def record_failure(request, exc):
+    attempts = request.attempts + 1
+    if exc.retryable and attempts < settings.PAYMENT_OUTBOX_MAX_ATTEMPTS:
+        # Exponential backoff: base, 2x base, 4x base, ...
+        delay = settings.PAYMENT_OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+        PaymentRequest.objects.filter(pk=request.pk).update(
+            status="pending", attempts=attempts, last_error=str(exc), locked_until=None,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay), updated_at=timezone.now(),
+        )
+        return "pending"
+
+    logger.warning("Giving up on STK push %s after %s attempt(s): %s", request.pk, attempts, exc)
+    with transaction.atomic():
+        PaymentRequest.objects.filter(pk=request.pk).update(
+            status="failed", attempts=attempts, last_error=str(exc), locked_until=None, updated_at=timezone.now(),
+        )
+        if request.payment_id and Payment.objects.filter(pk=request.payment_id, status="pending").update(status="failed"):
+            release_reservations(request.payment.order_id)
+    return "failed"
+
+
+def drain(concurrency=None, batch_size=None, client=None):
+    """Send every due request once, `concurrency` at a time. Returns a status -> count dict."""
+    concurrency = concurrency or settings.PAYMENT_OUTBOX_CONCURRENCY
+    batch_size = batch_size or concurrency * 4
+    results = {}
+
+    def send_in_thread(request):
+        try:
+            return send(request, client)
+        finally:
+            connections.close_all()  # pool threads own their connections
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            batch = claim_batch(batch_size)
+            if not batch:
+                return results
+            for outcome in pool.map(send_in_thread, batch):
+                results[outcome] = results.get(outcome, 0) + 1
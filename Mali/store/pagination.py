@@ -1,5 +1,14 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10  # default items per page
@@ -15,3 +24,203 @@ class StandardResultsSetPagination(PageNumberPagination):
             'count': self.page.paginator.count,
             'results': data
         })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination.
+    - Pages are fetched with a `WHERE (created_at, id) < (...)` style filter
+      instead of OFFSET, so page 5,000 costs the same as page 1.
+    - The ordering comes from the view's OrderingFilter, with `id` appended
+      as a tiebreaker so the position is always unique.
+    - No COUNT(*) by default. `?count=estimated` or `?count=cached` return an
+      approximate total instead.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_cache_timeout = 300
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.annotations = queryset.query.annotations
+        self.base_url = remove_query_param(request.build_absolute_uri(), 'page')
+        self.count = self.get_count(request, queryset)
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['r'])
+        ordering = [(name, not desc) for name, desc in self.ordering] if reverse else self.ordering
+
+        queryset = queryset.order_by(*[('-' if desc else '') + name for name, desc in ordering])
+        if cursor:
+            queryset = queryset.filter(self._seek(ordering, cursor['v'], queryset.model))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = queryset.query.order_by or getattr(view, 'ordering', None) or ['-pk']
+
+        keys = []
+        for field in ordering:
+            name = field.lstrip('-')
+            if name in ('pk', 'id'):
+                continue
+            assert '__' not in name, 'Keyset pagination only supports local model fields.'
+            keys.append((name, field.startswith('-')))
+        # Tiebreaker follows the direction of the leading key.
+        keys.append(('pk', keys[0][1] if keys else True))
+        return keys
+
+    def _seek(self, ordering, values, model):
+        # (a, b, pk) after (x, y, z) == a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+        try:
+            values = [self._field(model, name).to_python(value) for (name, _), value in zip(ordering, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        for index, (name, desc) in enumerate(ordering):
+            step = Q(**{f"{name}__{'lt' if desc else 'gt'}": values[index]})
+            for prev_index, (prev_name, _) in enumerate(ordering[:index]):
+                step &= Q(**{prev_name: values[prev_index]})
+            condition |= step
+        return condition
+
+    def _field(self, model, name):
+        # Annotations (e.g. search_rank) can be keys too
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def _position(self, instance):
+        position = []
+        for name, _ in self.ordering:
+            attname = name if name in self.annotations else self._field(type(instance), name).attname
+            value = getattr(instance, attname)
+            position.append(value if isinstance(value, (int, float, str, type(None))) else str(value))
+        return position
+
+    def _signature(self):
+        return ','.join(('-' if desc else '') + name for name, desc in self.ordering)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'o': self._signature(), 'v': position, 'r': int(reverse)}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            # A cursor is only valid for the ordering it was issued under.
+            if payload['o'] != self._signature() or len(payload['v']) != len(self.ordering):
+                raise ValueError
+            return payload
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def get_count(self, request, queryset):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'estimated':
+            return self.estimate_count(queryset)
+        if mode == 'cached':
+            return self.cached_count(queryset)
+        return None
+
+    def cached_count(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        key = 'keyset:count:' + hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+        return cache.get_or_set(key, queryset.count, self.count_cache_timeout)
+
+    def estimate_count(self, queryset):
+        # PostgreSQL planner estimate; other backends fall back to a cached count.
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return self.cached_count(queryset)
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'links': {
+               'next': self.get_next_link(),
+               'previous': self.get_previous_link()
+            },
+            'count': self.count,
+            'results': data
+        })
+
+
+class CatalogPagination(StandardResultsSetPagination):
+    """
+    Page-number pagination by default, keyset pagination when the client asks
+    for it with `?pagination=cursor` (or follows a `cursor` link). When the
+    search filter capped the matches, `search_limit` says at how many: the
+    count and pages cover only those.
+    """
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.keyset = None
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.keyset_class.cursor_query_param in request.query_params):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            response = self.keyset.get_paginated_response(data)
+        else:
+            response = super().get_paginated_response(data)
+        search_limit = getattr(self.request, 'search_limit', None)
+        if search_limit is not None:
+            response.data['search_limit'] = search_limit
+        return response
@@ -1,4 +1,5 @@
 
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
 
@@ -8,7 +9,8 @@ class RolePermission(BasePermission):
     - Everyone can read (safe methods).
     - Write requires authentication *and* the user must be in allowed_roles
       or an admin.
-    - Optionally checks object ownership if `owner_field` is defined on the view.
+    - Optionally checks object ownership if `owner_field` is defined on the view
+      (a field of the object's model, or a path like `order__customer`).
     """
 
     def has_permission(self, request, view):
@@ -44,7 +46,37 @@ class RolePermission(BasePermission):
         if hasattr(view, "allowed_roles") and request.user.role in view.allowed_roles:
             # If the view enforces ownership, check it
             if getattr(view, "owner_field", None):
-                return getattr(obj, view.owner_field) == request.user
+                return owner_id(obj, view.owner_field) == request.user.pk
             return True
 
         return False
+
+
+def owner_id(obj, owner_field):
+    """
+    The id behind `owner_field` on `obj`, following `__` relations
+    ("order__customer"). Compares ids: no query for the owner itself, and
+    works for token principals. A path the model does not have is a
+    configuration error, never a pass.
+    """
+    *relations, field = owner_field.split("__")
+    try:
+        for name in relations:
+            obj._meta.get_field(name)
+            obj = getattr(obj, name)
+        return getattr(obj, obj._meta.get_field(field).attname)
+    except FieldDoesNotExist as exc:
+        raise ImproperlyConfigured(f"owner_field {owner_field!r} does not exist: {exc}") from exc
+
+
+class ExportPermission(BasePermission):
+    """
+    Bulk exports: logged-in admins, or users whose role is in the view's
+    `export_roles`.
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return False
+        return user.role == user.UserRole.ADMIN or user.role in getattr(view, "export_roles", [])
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+STAR_FIELDS = [f"stars_{stars}" for stars in range(1, 6)]
+AGGREGATE_FIELDS = ["rating_count", "rating_sum", "average_rating", *STAR_FIELDS]
+
+
+def rebuild_rating_aggregates(product_model, review_model, batch_size=1000, product_ids=None):
+    """
+    Recompute rating_count, rating_sum, average_rating and the star histogram
+    from the reviews table. Works in batches of products: one GROUP BY query
+    and one bulk_update per batch, which also sets `updated_at` so the
+    catalog's conditional GET validators change. Returns the number of
+    products.
+    """
+    products = product_model.objects.order_by("pk")
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    ids = list(products.values_list("pk", flat=True))
+    now = timezone.now()
+
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        stats = {
+            row["product"]: row
+            for row in review_model.objects.filter(product__in=batch).order_by().values("product").annotate(
+                rating_count=Count("pk"),
+                rating_sum=Sum("rating"),
+                **{field: Count("pk", filter=Q(rating=stars)) for stars, field in enumerate(STAR_FIELDS, 1)},
+            )
+        }
+        rows = []
+        for pk in batch:
+            row = stats.get(pk, {})
+            product = product_model(pk=pk, updated_at=now)
+            product.rating_count = row.get("rating_count", 0)
+            product.rating_sum = row.get("rating_sum") or 0
+            product.average_rating = (
+                round(Decimal(product.rating_sum) / product.rating_count, 2) if product.rating_count else Decimal("0")
+            )
+            for field in STAR_FIELDS:
+                setattr(product, field, row.get(field, 0))
+            rows.append(product)
+        product_model.objects.bulk_update(rows, [*AGGREGATE_FIELDS, "updated_at"])
+    return len(ids)
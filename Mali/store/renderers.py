@@ -0,0 +1,52 @@
+import decimal
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # the stdlib-based DRF classes are used instead
+    orjson = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def default(obj):
+    """Types orjson does not encode natively."""
+    if isinstance(obj, decimal.Decimal):
+        # str, not float, so prices keep their precision
+        return str(obj)
+    # Lazy strings, timedeltas, querysets, ... the way DRF encodes them
+    return _encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on orjson. Output matches DRF's compact UTF-8 JSON:
+    datetimes as ISO 8601 with "Z" for UTC, UUIDs as strings, and raw
+    Decimals as strings. Requests for indented output (`; indent=4` in the
+    Accept header) and installs without orjson use the stdlib renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        return orjson.dumps(data, default=default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser on orjson. Bodies in other charsets go to the stdlib parser."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+STATUS_KEY = "replicas:status"  # {alias: {"lag": seconds or None, "synced_to": epoch, "checked_at": epoch, "error": str}}
+PIN_KEY = "replicas:pin:{}"
+STATUS_REFRESH = 1.0  # seconds a process reuses the monitor's report
+CLOCK_SKEW = 1.0  # seconds; margin between the monitor's clock and the web servers'
+
+# The replica chosen for the current request, None for the primary. A
+# ContextVar follows the request into sync_to_async threads under ASGI.
+_read_alias = ContextVar("read_alias", default=None)
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica ReplicaRoutingMiddleware chose for the request
+    (the primary when it chose none), writes always go to the primary.
+    Migrations run everywhere, so test replicas get the schema.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+def read_replica():
+    return _read_alias.get()
+
+
+@contextmanager
+def reading_from(alias):
+    """Route reads inside the block to `alias` (None: the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def use_replica(alias):
+    """Route the rest of the current context's reads to `alias`; callers restore it with `reading_from`."""
+    _read_alias.set(alias)
+
+
+def replica_reads(view):
+    """Let ReplicaRoutingMiddleware send safe-method requests for a function view to a replica."""
+    view.replica_reads = True
+    return view
+
+
+class ReplicaStatus:
+    """The monitor's last report, read from the cache at most every STATUS_REFRESH seconds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.report, self.loaded = {}, None
+
+    def get(self):
+        now = time.monotonic()
+        if self.loaded is None or now - self.loaded > STATUS_REFRESH:
+            with self.lock:
+                self.report, self.loaded = cache.get(STATUS_KEY) or {}, now
+        return self.report
+
+
+replica_status = ReplicaStatus()
+
+
+def healthy_replicas():
+    """
+    Replicas in rotation: checked by the monitor in the last
+    REPLICA_STATUS_TTL seconds and at most REPLICA_MAX_LAG seconds behind.
+    A replica the monitor could not reach, or has stopped reporting on,
+    is out.
+    """
+    report, now = replica_status.get(), time.time()
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if (entry := report.get(alias)) and entry["lag"] is not None
+        and entry["lag"] <= settings.REPLICA_MAX_LAG and now - entry["checked_at"] <= settings.REPLICA_STATUS_TTL
+    ]
+
+
+def choose_replica():
+    healthy = healthy_replicas()
+    return random.choice(healthy) if healthy else None
+
+
+def pin_to_primary(identity):
+    """Send `identity`'s reads to the primary for the next REPLICA_STICKY_SECONDS."""
+    cache.set(PIN_KEY.format(identity), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(identity):
+    return cache.get(PIN_KEY.format(identity)) is not None
+
+
+def primary_unless_synced(changed_at):
+    """
+    Reads for the block go to the primary unless the request's replica has
+    replayed everything written before `changed_at` (epoch seconds). Wrap
+    cache fills in it: a lagging replica would otherwise store pre-change
+    data under a post-change key for the whole cache timeout.
+    """
+    alias = _read_alias.get()
+    if alias is None or changed_at is None:
+        return nullcontext()
+    entry = replica_status.get().get(alias)
+    if entry and entry["synced_to"] >= changed_at + CLOCK_SKEW:
+        return nullcontext()
+    return reading_from(None)
+
+
+def check_replicas():
+    """
+    Write a heartbeat to the primary and read the latest one each replica
+    has replayed; its age is the replica's lag, to within one check
+    interval. The report is shared through the cache for every process.
+    """
+    from .models import ReplicaHeartbeat
+
+    ReplicaHeartbeat.objects.using("default").update_or_create(pk=1, defaults={"beat_at": timezone.now()})
+    report = {}
+    for alias in settings.DATABASE_REPLICAS:
+        error = None
+        try:
+            beat = ReplicaHeartbeat.objects.using(alias).filter(pk=1).values_list("beat_at", flat=True).first()
+        except DatabaseError as exc:
+            connections[alias].close()  # reconnect on the next check
+            beat, error = None, str(exc)
+        now = time.time()
+        report[alias] = {
+            "lag": None if beat is None else max(0.0, now - beat.timestamp()),
+            "synced_to": 0.0 if beat is None else beat.timestamp(),
+            "checked_at": now,
+            "error": error,
+        }
+    cache.set(STATUS_KEY, report, None)
+    return report
@@ -0,0 +1,194 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, Count, F, FloatField, Max, Q, Value, When
+from django.db.models.functions import Greatest
+from rest_framework import filters
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InvertedIndex:
+    """
+    In-process product search index, used when the database is not PostgreSQL.
+    - Maps each term to the products containing it, with name matches
+      weighted above description matches (like tsvector weights A/B).
+    - Scores with BM25; unknown terms fall back to the closest vocabulary
+      terms by trigram similarity, so typos still match.
+    - Rebuilt whenever the product table's fingerprint (row count, latest
+      `updated_at`) changes, which keeps separate worker processes in sync.
+    """
+    field_weights = {"name": 2.0, "description": 1.0}
+    similarity_threshold = 0.3
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, model):
+        self.model = model
+        self.fingerprint = None
+        self.postings = {}
+        self.lengths = {}
+        self.average_length = 0
+        self.trigram_index = {}
+        self.lock = threading.Lock()
+
+    def current_fingerprint(self):
+        stats = self.model.objects.aggregate(count=Count("pk"), latest=Max("updated_at"))
+        return stats["count"], stats["latest"]
+
+    def refresh(self):
+        fingerprint = self.current_fingerprint()
+        if fingerprint == self.fingerprint:
+            return
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.build()
+                self.fingerprint = fingerprint
+
+    def build(self):
+        postings = defaultdict(dict)
+        lengths = {}
+        rows = self.model.objects.values_list("pk", *self.field_weights).iterator(chunk_size=2000)
+        for pk, *values in rows:
+            weights = Counter()
+            for field, text in zip(self.field_weights, values):
+                for term in tokenize(text):
+                    weights[term] += self.field_weights[field]
+            for term, weight in weights.items():
+                postings[term][pk] = weight
+            lengths[pk] = sum(weights.values())
+
+        trigram_index = defaultdict(set)
+        for term in postings:
+            for gram in trigrams(term):
+                trigram_index[gram].add(term)
+
+        self.postings = dict(postings)
+        self.lengths = lengths
+        self.average_length = (sum(lengths.values()) / len(lengths)) if lengths else 0
+        self.trigram_index = dict(trigram_index)
+
+    def expand(self, term, is_prefix):
+        # Exact term, prefix matches for the word being typed, then fuzzy matches.
+        if term in self.postings:
+            yield term, 1.0
+        if is_prefix:
+            for candidate in self.postings:
+                if candidate != term and candidate.startswith(term):
+                    yield candidate, 0.9
+        if term not in self.postings:
+            grams = trigrams(term)
+            candidates = set().union(*(self.trigram_index.get(gram, ()) for gram in grams))
+            for candidate in candidates:
+                other = trigrams(candidate)
+                similarity = len(grams & other) / len(grams | other)
+                if similarity >= self.similarity_threshold:
+                    yield candidate, similarity
+
+    def search(self, text, limit=None):
+        """Return `[(pk, score), ...]` ordered by descending score."""
+        self.refresh()
+        terms = tokenize(text)
+        total = len(self.lengths)
+        scores = defaultdict(float)
+        for position, term in enumerate(terms):
+            for candidate, boost in self.expand(term, is_prefix=position == len(terms) - 1):
+                docs = self.postings[candidate]
+                idf = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                for pk, weight in docs.items():
+                    norm = 1 - self.b + self.b * self.lengths[pk] / (self.average_length or 1)
+                    scores[pk] += boost * idf * weight * (self.k1 + 1) / (weight + self.k1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+
+_indexes = {}
+
+
+def get_index(model):
+    if model not in _indexes:
+        _indexes[model] = InvertedIndex(model)
+    return _indexes[model]
+
+
+class RankedSearchFilter(filters.SearchFilter):
+    """
+    Relevance-ranked replacement for SearchFilter on the `?search=` parameter.
+    - PostgreSQL: matches the stored `search_vector` with a websearch query,
+      or the name with the trigram `%` operator (above
+      `pg_trgm.similarity_threshold`, 0.3 by default). Both conditions use
+      their GIN index; similarity only ranks.
+    - Other databases: ranks with the in-process InvertedIndex, keeping the
+      best `max_fallback_results` matches. When more match, the request's
+      `search_limit` is set and paginated responses report it.
+    Results are annotated with `search_rank` for `?ordering=relevance`.
+    """
+    search_config = "english"
+    max_fallback_results = 1000
+
+    def filter_queryset(self, request, queryset, view):
+        text = " ".join(self.get_search_terms(request))
+        if not text:
+            return queryset
+        if connections[queryset.db].vendor == "postgresql":
+            return self.postgres_search(queryset, text)
+        return self.index_search(request, queryset, text)
+
+    def postgres_search(self, queryset, text):
+        query = SearchQuery(text, search_type="websearch", config=self.search_config)
+        # Indexed conditions only, so Postgres can BitmapOr the two GIN scans
+        return queryset.filter(
+            Q(search_vector=query) | Q(TrigramSimilar(F("name"), Value(text)))
+        ).annotate(
+            search_rank=Greatest(
+                SearchRank(F("search_vector"), query), TrigramSimilarity("name", text), output_field=FloatField(),
+            ),
+        )
+
+    def index_search(self, request, queryset, text):
+        ranked = get_index(queryset.model).search(text)
+        if len(ranked) > self.max_fallback_results:
+            ranked = ranked[:self.max_fallback_results]
+            request.search_limit = self.max_fallback_results
+        if not ranked:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=Value(score)) for pk, score in ranked],
+                output_field=FloatField(),
+            )
+        )
+
+
+class RelevanceOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that understands `relevance` (best match first) when the
+    queryset was ranked by RankedSearchFilter. Without a search it is ignored.
+    """
+    relevance_field = "relevance"
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view) or ()
+        ranked = "search_rank" in queryset.query.annotations
+        result = []
+        for field in ordering:
+            if field.lstrip("-") != self.relevance_field:
+                result.append(field)
+            elif ranked:
+                result.append("search_rank" if field.startswith("-") else "-search_rank")
+        return result or self.get_default_ordering(view)
@@ -1,21 +1,32 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from .models import Category, Product, CustomerProfile, Order, Review, Payment, OrderItem
+from .models import Category, Product, CustomerProfile, Order, Review, Payment, OrderItem, Shipping
+from .fieldsets import FastListSerializer, SparseFieldsetMixin
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Category
         fields = "__all__"
+        list_serializer_class = FastListSerializer
+
+    def validate_parent(self, parent):
+        if parent and self.instance and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A category cannot be moved under itself or its sub-categories.")
+        return parent
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ("search_vector",)
+        list_serializer_class = FastListSerializer
+        read_only_fields = ("average_rating", "rating_count", "rating_sum", "stars_1", "stars_2", "stars_3", "stars_4", "stars_5")
 
 class UserSerializer(serializers.ModelSerializer):
 
@@ -47,7 +58,16 @@ class RegisterSerializer(serializers.ModelSerializer):
         CustomerProfile.objects.create(user=user)
         return user
 
+class CurrentUserIdDefault(serializers.CurrentUserDefault):
+    """The requesting user's id; needs no User row (see store/authentication.py)."""
+
+    def __call__(self, serializer_field):
+        return super().__call__(serializer_field).pk
+
+
 class ReviewSerializer(serializers.ModelSerializer):
+    # Set from the request; kept in the output and in the one-review-per-product check
+    user = serializers.PrimaryKeyRelatedField(read_only=True, default=CurrentUserIdDefault())
 
     class Meta:
         model = Review
@@ -71,16 +91,117 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ["product", "quantity"]
 
+
+# Order history (read-only). The view prefetches everything these touch, so
+# a page of orders costs the same number of queries at any size.
+class OrderProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ["id", "sku", "name", "slug"]
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    product = OrderProductSerializer(read_only=True, allow_null=True)  # null once the product is deleted
+    line_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ["id", "product", "quantity", "price", "line_total"]
+
+    def get_line_total(self, item):
+        return item.price * item.quantity
+
+
+class OrderPaymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Payment
+        fields = ["id", "payment_method", "amount", "status", "paid_at"]
+
+
+class OrderShippingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Shipping
+        fields = ["address", "shipping_method", "tracking_number", "status", "shipped_at", "delivered_at"]
+
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    items = OrderLineSerializer(many=True, read_only=True)
+    payments = OrderPaymentSerializer(many=True, read_only=True)
+    shipping = OrderShippingSerializer(read_only=True, allow_null=True)
+    item_count = serializers.SerializerMethodField()
+    items_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = [
+            "id", "status", "total_amount", "mpesa_receipt", "created_at", "updated_at",
+            "item_count", "items_total", "items", "payments", "shipping",
+        ]
+
+    # Summed from the prefetched lines rather than annotated, which would
+    # add a GROUP BY over the page's orders
+    def get_item_count(self, order):
+        return sum(item.quantity for item in order.items.all())
+
+    def get_items_total(self, order):
+        return sum((item.price * item.quantity for item in order.items.all()), Decimal("0.00"))
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model =Payment
-        fields = "__all__"
+        exclude = ["checkout_request_id"]  # lets anyone who has it forge the M-Pesa callback
+
+class CheckoutItemSerializer(serializers.Serializer):
+    # Plain ids: products are loaded together in the view, not one query per item
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
 
 class CheckoutSerializer(serializers.Serializer):
-    items = OrderItemSerializer(many=True)
+    items = CheckoutItemSerializer(many=True)
     payment_method = serializers.ChoiceField(choices=Payment.METHOD_CHOICES)
+    phone = serializers.CharField(max_length=20, required=False)
 
     def validate_items(self, value):
         if not value:
             raise serializers.ValidationError("Order must have at least one item.")
         return value
+
+    def validate(self, data):
+        if data["payment_method"] == "mpesa" and not data.get("phone"):
+            raise serializers.ValidationError({"phone": "Phone number is required for M-Pesa"})
+        return data
+
+
+class StkPushSerializer(serializers.Serializer):
+    phone_number = serializers.CharField(max_length=20)
+    amount = serializers.IntegerField(min_value=1)
+
+
+class ProductImportSerializer(serializers.Serializer):
+    # No UniqueValidators: SKU/slug clashes are checked per batch, not per row
+    sku = serializers.CharField(max_length=100)
+    name = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=50, required=False, allow_blank=True)
+    description = serializers.CharField(required=False, allow_blank=True, default="")
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    currency = serializers.CharField(max_length=10, required=False, default="KES")
+    stock_quantity = serializers.IntegerField(min_value=0, required=False, default=0)
+    is_active = serializers.BooleanField(required=False, default=True)
+    category = serializers.SlugField()  # Category.slug
+
+
+class ProductChangeSerializer(serializers.Serializer):
+    # Identify the product by id or sku
+    id = serializers.IntegerField(min_value=1, required=False)
+    sku = serializers.CharField(max_length=100, required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    stock_quantity = serializers.IntegerField(min_value=0, required=False)
+    is_active = serializers.BooleanField(required=False)
+
+    def validate(self, data):
+        if ("id" in data) == ("sku" in data):
+            raise serializers.ValidationError("Give exactly one of id or sku.")
+        if not {"price", "stock_quantity", "is_active"} & set(data):
+            raise serializers.ValidationError("Nothing to change: give price, stock_quantity or is_active.")
+        return data
@@ -1,8 +1,12 @@
 from django.contrib.auth.models import Group
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.db import transaction
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Review
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .models import Review, Product, Category
+from .cache import bump_generation
+from .blacklist import blacklist_filter
 
 User = settings.AUTH_USER_MODEL  # Or import your User directly
 
@@ -18,6 +22,50 @@ def assign_user_group(sender, instance, created, **kwargs):
             # Optionally log or raise warning
             print(f"Group '{group_name}' does not exist. Please run migrations.")
 
-@receiver([post_save, post_delete], sender=Review)
-def update_product_rating(sender, instance, **kwargs):
-    instance.product.update_average_rating()
+@receiver(pre_save, sender=Review)
+@receiver(pre_delete, sender=Review)
+def load_stored_rating(sender, instance, **kwargs):
+    # Reviews loaded with only()/defer(), or saved without being loaded,
+    # don't know the stored product and rating: read them before they change
+    stored = getattr(instance, "_stored_rating", (None, None))
+    if instance.pk is not None and None in stored:
+        row = Review.objects.filter(pk=instance.pk).values_list("product_id", "rating").first()
+        instance._stored_rating = row or (None, None)
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating(sender, instance, created, **kwargs):
+    stored_product, stored_rating = getattr(instance, "_stored_rating", (None, None))
+    if created or stored_product is None:
+        Product.apply_rating_change(instance.product_id, added=instance.rating)
+    elif stored_product != instance.product_id:
+        Product.apply_rating_change(stored_product, removed=stored_rating)
+        Product.apply_rating_change(instance.product_id, added=instance.rating)
+    elif stored_rating != instance.rating:
+        Product.apply_rating_change(instance.product_id, added=instance.rating, removed=stored_rating)
+    else:
+        return
+    instance._stored_rating = (instance.product_id, instance.rating)
+    bump_generation()
+
+
+@receiver(post_delete, sender=Review)
+def remove_product_rating(sender, instance, **kwargs):
+    stored_product, stored_rating = instance._stored_rating  # set by load_stored_rating at the latest
+    Product.apply_rating_change(stored_product, removed=stored_rating)
+    bump_generation()
+
+@receiver(pre_delete, sender=Category)
+def detach_subcategories(sender, instance, **kwargs):
+    instance.detach_children()
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    bump_generation()
+
+@receiver(post_save, sender=BlacklistedToken)
+def announce_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        jti = instance.token.jti
+        transaction.on_commit(lambda: blacklist_filter.added(jti))
@@ -1,3 +1,1822 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import uuid
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, OperationalError
+from django.utils.translation import gettext_lazy
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import add_principal_claims
+from .benchmarks import dataset_counts, start_gateway
+from .cache import bump_generation, fresh_catalog_reads, get_or_compute
+from .blacklist import BlacklistFilter, BloomFilter, blacklist_filter, is_blacklisted
+from .middleware import ReplicaRoutingMiddleware
+from .inventory import (
+    InsufficientStock, reserve_stock, release_reservations, confirm_reservations, release_expired_reservations,
+)
+from .mpesa import STK_QUERY_PATH, MpesaClient, MpesaError
+from .callbacks import apply_unmatched_callbacks
+from .imports import import_products
+from .outbox import drain
+from .permissions import RolePermission
+from .renderers import FastJSONParser, FastJSONRenderer
+from .routers import STATUS_KEY, ReplicaRouter, healthy_replicas, read_replica, reading_from, replica_status
+from .search import RankedSearchFilter, get_index
+from .serializers import PaymentSerializer, ProductSerializer
+from .views import CheckoutView, PaymentViewSet, ProductViewSet
+from .throttling import normalize_phone, take_tokens
+from .models import (
+    Category, Product, User, Order, OrderItem, Payment, PaymentRequest, StockReservation, Review, MpesaCallback, Shipping,
+    ReplicaHeartbeat,
+)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}",
+                price=Decimal("10.50") + i, stock_quantity=100, category=category,
+            )
+            for i in range(30)
+        ]
+
+    def checkout(self, products, quantity=2):
+        return self.client.post("/checkout/", {
+            "items": [{"product": product.id, "quantity": quantity} for product in products],
+            "payment_method": "card",
+        }, format="json")
+
+    def test_checkout_creates_order_items_and_payment(self):
+        response = self.checkout(self.products[:3])
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=response.data["order_id"])
+        expected = sum((product.price * 2 for product in self.products[:3]), Decimal("0"))
+        self.assertEqual(order.total_amount, expected)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(Payment.objects.get(order=order).amount, expected)
+
+    def test_query_count_does_not_grow_with_basket_size(self):
+        with CaptureQueriesContext(connection) as one_item:
+            self.assertEqual(self.checkout(self.products[:1]).status_code, 200)
+        with CaptureQueriesContext(connection) as thirty_items:
+            self.assertEqual(self.checkout(self.products).status_code, 200)
+
+        self.assertEqual(len(one_item), len(thirty_items))
+
+    def test_invalid_product_creates_nothing(self):
+        response = self.client.post("/checkout/", {
+            "items": [{"product": self.products[0].id, "quantity": 1}, {"product": 999999, "quantity": 1}],
+            "payment_method": "card",
+        }, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_checkout_reserves_stock(self):
+        self.checkout(self.products[:1], quantity=5)
+
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 95)
+
+    def test_checkout_without_stock_is_rejected(self):
+        response = self.checkout(self.products[:2], quantity=101)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock_quantity, 100)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Product 1", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+        self.order = Order.objects.create(customer=self.customer)
+
+    def test_release_returns_stock_once(self):
+        reserve_stock(self.order, {self.product.pk: 4})
+
+        self.assertEqual(release_reservations(self.order), 1)
+        self.assertEqual(release_reservations(self.order), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+
+    def test_confirm_keeps_stock_sold(self):
+        reserve_stock(self.order, {self.product.pk: 4})
+        confirm_reservations(self.order)
+
+        self.assertEqual(release_reservations(self.order), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 6)
+
+    def test_only_short_products_are_reported(self):
+        scarce = Product.objects.create(
+            sku="SKU-2", slug="product-2", name="Product 2", price=Decimal("10.00"), stock_quantity=1,
+            category=self.product.category,
+        )
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock(self.order, {self.product.pk: 6, scarce.pk: 2})  # 10 - 6 would look short too
+        self.assertEqual(raised.exception.product_ids, [scarce.pk])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_stock_changes_reach_conditional_gets(self):
+        cache.clear()
+        client, path = APIClient(), f"/products/{self.product.pk}/"
+        etag = client.get(path)["ETag"]
+        reserve_stock(self.order, {self.product.pk: 4})
+        cache.clear()  # the cached validators expired
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data["stock_quantity"]), (200, 6))
+
+        etag = response["ETag"]
+        release_reservations(self.order)
+        cache.clear()
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data["stock_quantity"]), (200, 10))
+
+    def test_expired_reservations_are_released(self):
+        Payment.objects.create(order=self.order, payment_method="mpesa", amount=40)
+        reserve_stock(self.order, {self.product.pk: 4})
+
+        self.assertEqual(release_expired_reservations(timezone.now() + timedelta(days=1)), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+        self.assertEqual(Payment.objects.get(order=self.order).status, "failed")
+        self.assertEqual(StockReservation.objects.get(order=self.order).status, "released")
+
+    def test_payment_retries_need_the_stock_back(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=4, price=Decimal("10.00"))
+        path = f"/orders/{self.order.pk}/confirm_payment/"
+
+        # The first attempt failed and gave the stock back: it is reserved again
+        response = client.post(path, {"phone": "254708374149"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 6)
+        renewed = self.order.reservations.get(status="active").expires_at
+        self.assertEqual(client.post(path, {"phone": "254708374149"}, format="json").status_code, 202)
+        self.assertGreater(self.order.reservations.get(status="active").expires_at, renewed)  # extended, not doubled
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 6)
+
+        # Cancelled once its reservation expired, then the stock sold to someone else
+        release_expired_reservations(timezone.now() + timedelta(days=1))
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+        cache.clear()  # the phone's STK push throttle
+        response = client.post(path, {"phone": "254708374149"}, format="json")
+        self.assertEqual((response.status_code, response.data["error"]), (409, "Order is cancelled."))
+
+        pending = Order.objects.create(customer=self.customer)
+        OrderItem.objects.create(order=pending, product=self.product, quantity=1, price=Decimal("10.00"))
+        response = client.post(f"/orders/{pending.pk}/confirm_payment/", {"phone": "254708374149"}, format="json")
+        self.assertEqual((response.status_code, response.data["products"]), (409, [self.product.pk]))
+        self.assertEqual(PaymentRequest.objects.count(), 2)
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    serialized_rollback = True  # keep the groups seeded by migrations
+    stock = 25
+    threads = 16
+    attempts_per_thread = 10
+
+    def test_concurrent_reservations_never_oversell(self):
+        customer = User.objects.create_user(username="buyer", password="pass12345")
+        category = Category.objects.create(name="Phones", slug="phones")
+        product = Product.objects.create(
+            sku="FLASH", slug="flash", name="Flash sale", price=Decimal("1.00"), stock_quantity=self.stock, category=category,
+        )
+        orders = [Order.objects.create(customer=customer) for _ in range(self.threads * self.attempts_per_thread)]
+        reserved, errors = [], []
+        start = threading.Barrier(self.threads)
+
+        def buyer(my_orders):
+            start.wait()
+            try:
+                for order in my_orders:
+                    while True:
+                        try:
+                            reserve_stock(order, {product.pk: 1})
+                            reserved.append(order.pk)
+                        except InsufficientStock:
+                            pass
+                        except OperationalError:
+                            # SQLite reports lock contention instead of waiting; try again
+                            time.sleep(0.001)
+                            continue
+                        break
+            except Exception as exc:  # surfaced below
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [
+            threading.Thread(target=buyer, args=(orders[i::self.threads],)) for i in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(reserved), self.stock)
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(StockReservation.objects.filter(product=product).count(), self.stock)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Product 1", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+        self.users = [User.objects.create_user(username=f"user{i}", password="pass12345") for i in range(3)]
+
+    def assertAggregates(self, count, total, average, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, count)
+        self.assertEqual(self.product.rating_sum, total)
+        self.assertEqual(self.product.average_rating, Decimal(average))
+        self.assertEqual([getattr(self.product, f"stars_{i}") for i in range(1, 6)], histogram)
+
+    def test_create_edit_and_delete_apply_deltas(self):
+        first = Review.objects.create(product=self.product, user=self.users[0], rating=5)
+        Review.objects.create(product=self.product, user=self.users[1], rating=2)
+        self.assertAggregates(2, 7, "3.50", [0, 1, 0, 0, 1])
+
+        first = Review.objects.get(pk=first.pk)
+        first.rating = 4
+        first.save()
+        self.assertAggregates(2, 6, "3.00", [0, 1, 0, 1, 0])
+
+        first.delete()
+        self.assertAggregates(1, 2, "2.00", [0, 1, 0, 0, 0])
+
+    def test_edits_without_the_stored_rating_apply_deltas(self):
+        review = Review.objects.create(product=self.product, user=self.users[0], rating=5)
+
+        partial = Review.objects.only("pk", "comment").get(pk=review.pk)
+        partial.rating = 3
+        partial.save()
+        self.assertAggregates(1, 3, "3.00", [0, 0, 1, 0, 0])
+
+        unloaded = Review(pk=review.pk, product=self.product, user=self.users[0], rating=1, created_at=review.created_at)
+        unloaded.save()
+        self.assertAggregates(1, 1, "1.00", [1, 0, 0, 0, 0])
+
+        Review.objects.defer("rating").get(pk=review.pk).delete()
+        self.assertAggregates(0, 0, "0", [0, 0, 0, 0, 0])
+
+    def test_rebuild_command_repairs_aggregates(self):
+        Review.objects.create(product=self.product, user=self.users[0], rating=3)
+        Review.objects.create(product=self.product, user=self.users[1], rating=4)
+        Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, stars_3=7)
+
+        call_command("rebuild_rating_aggregates", stdout=StringIO())
+
+        self.assertAggregates(2, 7, "3.50", [0, 0, 1, 1, 0])
+
+    def test_api_reviews_need_a_delivered_order(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        order = Order.objects.create(customer=self.users[0], status="paid")
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=Decimal("10.00"))
+
+        response = client.post("/reviews/", {"product": self.product.pk, "rating": 4}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        Order.objects.filter(pk=order.pk).update(status="delivered")
+        response = client.post("/reviews/", {"product": self.product.pk, "rating": 4}, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["user"], self.users[0].pk)
+        self.assertAggregates(1, 4, "4.00", [0, 0, 0, 1, 0])
+
+        response = client.post("/reviews/", {"product": self.product.pk, "rating": 1}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertAggregates(1, 4, "4.00", [0, 0, 0, 1, 0])
+
+
+class StubDaraja(BaseHTTPRequestHandler):
+    """Minimal local Daraja: issues tokens, accepts STK pushes and answers STK queries."""
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.server.calls.append(("token", self.client_address))
+        self.reply(200, {"access_token": f"token-{len(self.server.calls)}", "expires_in": "3599"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = self.path == STK_QUERY_PATH
+        self.server.calls.append(("stk_query" if query else "stk_push", self.client_address))
+        if self.server.fail_next:
+            self.server.fail_next -= 1
+            return self.reply(self.server.fail_status, {"errorMessage": "rejected"})
+        if query:
+            return self.reply(200, {
+                "CheckoutRequestID": body["CheckoutRequestID"], "ResponseCode": "0", "ResultCode": self.server.result_code,
+            })
+        self.reply(200, {"CheckoutRequestID": f"ws_CO_{len(self.server.calls)}", "ResponseCode": "0"})
+
+    def log_message(self, *args):
+        pass
+
+
+class StubDarajaMixin:
+    def start_stub(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubDaraja)
+        self.server.calls = []
+        self.server.fail_next = 0
+        self.server.fail_status = 401
+        self.server.result_code = "0"  # what STK queries report
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.mpesa = MpesaClient(base_url=base_url, consumer_key="key", consumer_secret="secret")
+        # For code that uses the shared client, like the callback view
+        self.stub_settings = override_settings(MPESA_BASE_URL=base_url, MPESA_CONSUMER_KEY="key")
+        self.stub_settings.enable()
+
+    def stop_stub(self):
+        self.stub_settings.disable()
+        self.mpesa.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MpesaClientTests(StubDarajaMixin, TestCase):
+    def setUp(self):
+        self.start_stub()
+        self.client = self.mpesa
+
+    def tearDown(self):
+        self.stop_stub()
+
+    def test_token_is_fetched_once_and_connection_reused(self):
+        for _ in range(5):
+            self.assertTrue(self.client.stk_push("254708374149", 10)["CheckoutRequestID"].startswith("ws_CO_"))
+
+        operations = [operation for operation, _ in self.server.calls]
+        self.assertEqual(operations.count("token"), 1)
+        self.assertEqual(operations.count("stk_push"), 5)
+        self.assertEqual(len({address for _, address in self.server.calls}), 1)
+        self.assertEqual(self.client.stats.snapshot()["stk_push"]["calls"], 5)
+
+    def test_concurrent_callers_share_one_token_refresh(self):
+        threads = [threading.Thread(target=self.client.get_access_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([operation for operation, _ in self.server.calls], ["token"])
+
+    def test_rejected_token_is_refreshed_once(self):
+        self.client.get_access_token()
+        self.server.fail_next = 1
+
+        self.client.stk_push("254708374149", 10)
+
+        operations = [operation for operation, _ in self.server.calls]
+        self.assertEqual(operations, ["token", "stk_push", "token", "stk_push"])
+
+    def test_gateway_errors_raise_mpesa_error(self):
+        self.server.fail_next = 1
+        self.server.fail_status = 500
+
+        with self.assertRaises(MpesaError):
+            self.client.stk_push("254708374149", 10)
+        self.assertEqual(self.client.stats.snapshot()["stk_push"]["errors"], 1)
+
+
+class PaymentOutboxTests(StubDarajaMixin, TransactionTestCase):
+    serialized_rollback = True
+    def setUp(self):
+        self.start_stub()
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.api = APIClient()
+        self.api.force_authenticate(self.customer)
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Product 1", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+
+    def tearDown(self):
+        self.stop_stub()
+
+    def checkout(self):
+        return self.api.post("/checkout/", {
+            "items": [{"product": self.product.id, "quantity": 2}],
+            "payment_method": "mpesa",
+            "phone": "254708374149",
+        }, format="json")
+
+    def test_checkout_queues_push_without_calling_gateway(self):
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.calls, [])
+        self.assertEqual(PaymentRequest.objects.get().payment_id, response.data["payment_id"])
+
+        self.assertEqual(drain(concurrency=2, client=self.mpesa), {"sent": 1})
+        payment = Payment.objects.get(pk=response.data["payment_id"])
+        self.assertTrue(payment.checkout_request_id.startswith("ws_CO_"))
+        self.assertEqual(PaymentRequest.objects.get().status, "sent")
+
+    def test_server_errors_are_retried_later(self):
+        self.checkout()
+        self.server.fail_next, self.server.fail_status = 1, 503
+
+        self.assertEqual(drain(client=self.mpesa), {"pending": 1})
+        push = PaymentRequest.objects.get()
+        self.assertEqual(push.attempts, 1)
+        self.assertGreater(push.next_attempt_at, timezone.now())
+
+    def test_rejected_push_fails_payment_and_releases_stock(self):
+        response = self.checkout()
+        self.server.fail_next, self.server.fail_status = 1, 400
+
+        self.assertEqual(drain(client=self.mpesa), {"failed": 1})
+        self.assertEqual(Payment.objects.get(pk=response.data["payment_id"]).status, "failed")
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 10)
+
+    def test_totals_with_cents_are_charged_and_matched_in_whole_shillings(self):
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal("10.25"))
+        response = self.checkout()  # 20.50
+        payment = Payment.objects.get(pk=response.data["payment_id"])
+        self.assertEqual((payment.amount, PaymentRequest.objects.get().amount), (Decimal("21"), Decimal("21")))
+
+        drain(client=self.mpesa)
+        payment.refresh_from_db()
+        self.api.post("/mpesa/callback/", stk_callback(payment.checkout_request_id, amount=21), format="json")
+        self.assertEqual(apply_unmatched_callbacks(client=self.mpesa), 1)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, "successful")
+        self.assertEqual(Order.objects.get(pk=response.data["order_id"]).status, "paid")
+
+    def test_callback_before_push_is_recorded_is_applied_later(self):
+        response = self.checkout()
+        # Stub ids count calls: the token fetch is 1, the push 2
+        self.api.post("/mpesa/callback/", stk_callback("ws_CO_2"), format="json")
+        self.assertEqual(Payment.objects.get(pk=response.data["payment_id"]).status, "pending")
+
+        drain(client=self.mpesa)
+        self.assertEqual(Payment.objects.get(pk=response.data["payment_id"]).status, "successful")
+        self.assertTrue(MpesaCallback.objects.get().processed)
+
+
+def stk_callback(checkout_request_id, result_code=0, amount=20.0):
+    callback = {
+        "MerchantRequestID": "mr-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "Done",
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": "RKT123ABC"},
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+
+class MpesaCallbackTests(StubDarajaMixin, TestCase):
+    def setUp(self):
+        self.start_stub()
+        customer = User.objects.create_user(username="buyer", password="pass12345")
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Product 1", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+        self.order = Order.objects.create(customer=customer, total_amount=Decimal("20.00"))
+        reserve_stock(self.order, {self.product.pk: 2})
+        self.payment = Payment.objects.create(
+            order=self.order, payment_method="mpesa", amount=Decimal("20.00"), checkout_request_id="ws_CO_1",
+        )
+        self.client = APIClient()  # Safaricom does not authenticate
+
+    def tearDown(self):
+        self.stop_stub()
+
+    def post(self, body):
+        return self.client.post("/mpesa/callback/", body, format="json")
+
+    def assertPaymentStatus(self, status):
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, status)
+
+    def sweep(self):
+        return apply_unmatched_callbacks(concurrency=1)  # inline: pool threads cannot see the test's rows
+
+    def test_duplicate_deliveries_are_applied_once(self):
+        for _ in range(3):
+            self.assertEqual(self.post(stk_callback("ws_CO_1")).data["ResultCode"], 0)
+        self.assertEqual(self.server.calls, [])  # the callback request never waits on Daraja
+        self.assertPaymentStatus("pending")
+
+        self.assertEqual(self.sweep(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "paid")
+        self.assertEqual(self.order.mpesa_receipt, "RKT123ABC")
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+        self.assertEqual(self.order.reservations.get().status, "confirmed")
+        self.assertEqual(self.sweep(), 0)
+
+    def test_failed_payment_releases_stock(self):
+        self.post(stk_callback("ws_CO_1", result_code=1032))
+
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, "failed")
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 10)
+
+    def test_malformed_callback_is_rejected(self):
+        self.assertEqual(self.post({"Body": {}}).status_code, 400)
+
+    def test_success_is_confirmed_with_daraja(self):
+        self.server.result_code = "1032"  # Daraja says the customer cancelled
+        self.post(stk_callback("ws_CO_1"))
+        self.assertEqual(self.sweep(), 0)
+
+        self.assertPaymentStatus("pending")
+        self.assertIn("stk_query", [operation for operation, _ in self.server.calls])
+        self.assertTrue(MpesaCallback.objects.get().processed)
+
+    def test_success_for_the_wrong_amount_is_ignored(self):
+        self.post(stk_callback("ws_CO_1", amount=1.0))
+        self.assertEqual(self.sweep(), 0)
+
+        self.assertPaymentStatus("pending")
+        self.assertEqual(self.server.calls, [])
+
+    def test_unconfirmed_callbacks_are_retried_by_the_sweep(self):
+        self.server.fail_next, self.server.fail_status = 1, 400
+        self.post(stk_callback("ws_CO_1"))
+        self.assertEqual(self.sweep(), 0)
+        self.assertPaymentStatus("pending")
+        self.assertFalse(MpesaCallback.objects.get().processed)
+
+        self.assertEqual(self.sweep(), 1)
+        self.assertPaymentStatus("successful")
+
+    def test_callback_that_raced_the_outbox_is_applied_by_the_sweep(self):
+        # Stored just before the outbox recorded the id and looked for it
+        self.post(stk_callback("ws_CO_2"))
+        Payment.objects.filter(pk=self.payment.pk).update(checkout_request_id="ws_CO_2")
+        self.assertPaymentStatus("pending")
+
+        self.assertEqual(self.sweep(), 1)
+        self.assertPaymentStatus("successful")
+        self.assertEqual(self.order.reservations.get().status, "confirmed")
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.electronics = Category.objects.create(name="Electronics", slug="electronics")
+        self.phones = Category.objects.create(name="Phones", slug="phones", parent=self.electronics)
+        self.android = Category.objects.create(name="Android", slug="android", parent=self.phones)
+        self.books = Category.objects.create(name="Books", slug="books")
+        for i, category in enumerate([self.electronics, self.phones, self.android, self.android, self.books]):
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}", price=Decimal("5.00"),
+                stock_quantity=1, category=category,
+            )
+        self.client = APIClient()
+
+    def paths(self):
+        return dict(Category.objects.values_list("slug", "path"))
+
+    def test_paths_follow_moves_and_deletes(self):
+        e, p, a, b = self.electronics.pk, self.phones.pk, self.android.pk, self.books.pk
+        self.assertEqual(self.paths()["android"], f"{e}/{p}/{a}/")
+
+        self.phones.parent = self.books
+        self.phones.save()
+        self.assertEqual(self.paths()["android"], f"{b}/{p}/{a}/")
+        self.assertEqual(Category.objects.get(pk=a).depth, 2)
+
+        with self.assertRaises(ValueError):
+            self.books.parent = self.android
+            self.books.save()
+
+        Category.objects.get(pk=b).delete()
+        self.assertEqual(self.paths(), {"electronics": f"{e}/", "phones": f"{p}/", "android": f"{p}/{a}/"})
+        self.assertIsNone(Category.objects.get(pk=p).parent_id)
+
+    def test_category_tree_filter_includes_subcategories(self):
+        response = self.client.get("/products/", {"category_tree": self.phones.pk})
+        self.assertEqual(response.data["count"], 3)
+        response = self.client.get("/products/", {"category_tree": self.electronics.pk})
+        self.assertEqual(response.data["count"], 4)
+
+    def test_tree_endpoint_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/categories/tree/")
+
+        books, electronics = response.data
+        self.assertEqual((books["name"], books["total_product_count"]), ("Books", 1))
+        self.assertEqual(electronics["product_count"], 1)
+        self.assertEqual(electronics["total_product_count"], 4)
+        self.assertEqual(electronics["children"][0]["children"][0]["product_count"], 2)
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        phones = Category.objects.create(name="Phones", slug="phones")
+        books = Category.objects.create(name="Books", slug="books")
+        for i, (category, price, stock, rating) in enumerate([
+            (phones, "12000.00", 5, "4.50"),
+            (phones, "800.00", 0, "3.20"),
+            (phones, "450.00", 2, "0"),
+            (books, "700.00", 1, "4.00"),
+        ]):
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}", price=Decimal(price),
+                stock_quantity=stock, category=category, average_rating=Decimal(rating),
+            )
+        self.client = APIClient()
+
+    def test_facets_are_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            facets = self.client.get("/products/facets/").data
+        with self.assertNumQueries(0):
+            self.client.get("/products/facets/", {"page": 2, "ordering": "price"})
+
+        self.assertEqual(facets["count"], 4)
+        self.assertEqual([(c["name"], c["count"]) for c in facets["categories"]], [("Phones", 3), ("Books", 1)])
+        self.assertEqual([bucket["count"] for bucket in facets["price"]], [1, 2, 0, 0, 1, 0])
+        self.assertEqual([band["count"] for band in facets["rating"]], [2, 3, 3, 3])
+        self.assertEqual(facets["availability"], {"in_stock": 3, "out_of_stock": 1})
+
+    def test_facets_follow_list_filters(self):
+        facets = self.client.get("/products/facets/", {"price": "800.00"}).data
+        self.assertEqual(facets["count"], 1)
+        self.assertEqual(facets["availability"], {"in_stock": 0, "out_of_stock": 1})
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        for i in range(3):
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}", description="Long text",
+                price=Decimal("10.50") + i, stock_quantity=i, category=category,
+            )
+        self.client = APIClient()
+
+    def test_fast_list_matches_model_serializer(self):
+        products = Product.objects.order_by("pk")
+        fast = ProductSerializer(products, many=True).data
+        plain = [ProductSerializer(product).data for product in products]
+        self.assertEqual(json.loads(json.dumps(fast)), json.loads(json.dumps(plain)))
+
+    def test_fields_and_omit_are_pushed_into_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/products/", {"fields": "id,name,price,slug"})
+        self.assertEqual(set(response.data["results"][0]), {"id", "name", "price", "slug"})
+        select = next(query["sql"] for query in queries if '"store_product"."name"' in query["sql"])
+        self.assertNotIn("description", select)
+
+        response = self.client.get("/categories/", {"omit": "description,path"})
+        self.assertNotIn("description", response.data["results"][0])
+        self.assertIn("slug", response.data["results"][0])
+
+    def test_unknown_field_is_rejected(self):
+        self.assertEqual(self.client.get("/products/", {"fields": "id,secret"}).status_code, 400)
+
+
+class FastJSONTests(TestCase):
+    def test_renderer_matches_drf_encoding(self):
+        data = {
+            "created_at": timezone.make_aware(datetime(2026, 1, 2, 3, 4, 5, 678000)),
+            "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "label": gettext_lazy("Phones"),
+            "nested": [{"price": "10.50", "stock": 3, "note": None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        # Decimals keep their precision instead of going through float
+        self.assertEqual(FastJSONRenderer().render({"price": Decimal("24999.99")}), b'{"price":"24999.99"}')
+
+    def test_parser_reads_json_and_rejects_garbage(self):
+        self.assertEqual(FastJSONParser().parse(BytesIO(b'{"amount": 1.5, "phone": "2547"}')), {"amount": 1.5, "phone": "2547"})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b"{not json"))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product, {i}", price=Decimal("10.50") + i,
+                stock_quantity=5, category=self.category,
+            )
+            for i in range(5)
+        ]
+        customer = User.objects.create_user(username="buyer", password="pass12345")
+        order = Order.objects.create(customer=customer, total_amount=Decimal("21.00"), status="paid")
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=2, price=Decimal("10.50"))
+        self.client = APIClient()
+        self.seller = User.objects.create_user(username="seller", password="pass12345", role=User.UserRole.SELLER)
+        self.admin = User.objects.create_user(username="finance", password="pass12345", role=User.UserRole.ADMIN)
+
+    def download(self, url, params=None, **headers):
+        response = self.client.get(url, params or {}, **headers)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_product_csv_streams_with_joined_category(self):
+        self.client.force_authenticate(self.seller)
+        with self.assertNumQueries(1):
+            response, body = self.download("/products/export/", HTTP_ACCEPT="text/csv")
+
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith("id,sku,name,slug,category_id,category,price"))
+        self.assertIn('"Product, 0"', lines[1])
+        self.assertIn(",Phones,10.50,", lines[1])
+
+    def test_order_ndjson_is_admin_only(self):
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get("/orders/export/").status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response, body = self.download("/orders/export/", {"as": "ndjson", "status": "paid"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        (line,) = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(line["customer"], "buyer")
+        self.assertEqual((line["sku"], line["quantity"], line["price"]), ("SKU-0", 2, "10.50"))
+
+    def test_export_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.ndjson")
+            call_command("export_data", "products", "--format", "ndjson", "--output", path, stderr=StringIO())
+            with open(path) as export:
+                self.assertEqual(len(export.readlines()), 5)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name="Phones", slug="phones")
+        self.existing = Product.objects.create(
+            sku="SKU-1", slug="sku-1", name="Old name", price=Decimal("1.00"), stock_quantity=1, category=self.phones,
+        )
+        Product.objects.create(sku="OTHER", slug="taken", name="Other", price=Decimal("1.00"), stock_quantity=1, category=self.phones)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="seller", password="pass12345", role=User.UserRole.SELLER))
+
+    def test_upsert_reports_bad_rows_and_keeps_the_rest(self):
+        rows = [
+            {"sku": "SKU-1", "name": "New name", "price": "12.50", "category": "phones", "stock_quantity": 7},
+            {"sku": "SKU-2", "name": "Fresh", "price": "3.00", "category": "phones"},
+            {"sku": "SKU-3", "name": "No price", "category": "phones"},
+            {"sku": "SKU-4", "name": "Lost", "price": "3.00", "category": "nope"},
+            {"sku": "SKU-5", "name": "Clash", "price": "3.00", "category": "phones", "slug": "taken"},
+        ]
+        report = self.client.post("/products/import/", rows, format="json").data
+
+        self.assertEqual((report["rows"], report["created"], report["updated"], report["failed"]), (5, 1, 1, 3))
+        self.assertEqual([(error["row"], list(error["errors"])) for error in report["errors"]], [
+            (3, ["price"]), (4, ["category"]), (5, ["slug"]),
+        ])
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.price, self.existing.stock_quantity), ("New name", Decimal("12.50"), 7))
+        self.assertEqual(Product.objects.get(sku="SKU-2").slug, "sku-2")
+
+    def test_batches_use_a_fixed_number_of_queries(self):
+        rows = [{"sku": f"BULK-{i}", "name": f"Bulk {i}", "price": "1.00", "category": "phones"} for i in range(250)]
+        with CaptureQueriesContext(connection) as queries:
+            report = import_products(rows, batch_size=100)
+        self.assertEqual(report["created"], 250)
+        # A handful per batch (SKU check, upsert, savepoints; SQLite splits big INSERTs), none per row
+        self.assertLess(len(queries), 25)
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile("products.csv", b"sku,name,price,category\nCSV-1,From CSV,9.99,phones\n")
+        report = self.client.post("/products/import/", {"file": upload}, format="multipart").data
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(Product.objects.get(sku="CSV-1").price, Decimal("9.99"))
+
+    def test_columns_missing_from_the_file_are_kept(self):
+        Product.objects.filter(pk=self.existing.pk).update(slug="custom", description="Keep me", stock_quantity=4)
+        upload = SimpleUploadedFile("products.csv", b"sku,name,price,category\nSKU-1,Renamed,2.00,phones\nCSV-2,New,1.00,phones\n")
+        report = self.client.post("/products/import/", {"file": upload}, format="multipart").data
+        self.assertEqual((report["created"], report["updated"], report["failed"]), (1, 1, 0))
+
+        self.existing.refresh_from_db()
+        self.assertEqual(
+            (self.existing.name, self.existing.slug, self.existing.description, self.existing.stock_quantity),
+            ("Renamed", "custom", "Keep me", 4),
+        )
+        self.assertEqual(Product.objects.get(sku="CSV-2").slug, "csv-2")
+
+        # A row that has the column changes it, in the same batch as one that doesn't
+        report = import_products([
+            {"sku": "SKU-1", "name": "Renamed", "price": "2.00", "category": "phones", "stock_quantity": 9, "slug": ""},
+            {"sku": "CSV-2", "name": "New", "price": "1.00", "category": "phones"},
+        ])
+        self.assertEqual(report["updated"], 2)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.slug, self.existing.stock_quantity), ("custom", 9))
+
+
+class BatchUpdateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}", price=Decimal("10.00"),
+                stock_quantity=5, category=category,
+            )
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="seller", password="pass12345", role=User.UserRole.SELLER))
+
+    def test_changes_are_applied_in_one_update(self):
+        first, second, third, untouched = self.products
+        self.client.get(f"/products/{first.pk}/")  # warm the catalog cache
+        changes = [
+            {"id": first.pk, "price": "12.50"},
+            {"sku": second.sku, "stock_quantity": 0, "is_active": False},
+            {"sku": third.sku, "price": "8.00", "stock_quantity": 40},
+        ]
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.patch("/products/batch/", {"changes": changes}, format="json")
+        self.assertEqual(response.data, {"updated": 3})
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in queries), 1)
+
+        rows = {p.sku: (p.price, p.stock_quantity, p.is_active) for p in Product.objects.all()}
+        self.assertEqual(rows, {
+            "SKU-0": (Decimal("12.50"), 5, True),
+            "SKU-1": (Decimal("10.00"), 0, False),
+            "SKU-2": (Decimal("8.00"), 40, True),
+            "SKU-3": (Decimal("10.00"), 5, True),
+        })
+        self.assertEqual(self.client.get(f"/products/{first.pk}/").data["price"], "12.50")
+
+    def test_invalid_batch_changes_nothing(self):
+        response = self.client.patch("/products/batch/", [
+            {"id": self.products[0].pk, "price": "1.00"},
+            {"sku": "missing", "price": "1.00"},
+        ], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).price, Decimal("10.00"))
+
+    def test_customers_cannot_batch_update(self):
+        self.client.force_authenticate(User.objects.create_user(username="buyer", password="pass12345"))
+        response = self.client.patch("/products/batch/", [{"id": self.products[0].pk, "price": "1.00"}], format="json")
+        self.assertEqual(response.status_code, 403)
+
+
+class EndpointQueryCountTests(TestCase):
+    """
+    Pins the number of queries each endpoint in store/api_urls.py runs, with a
+    cold cache. A change here is a performance regression (or an improvement:
+    lower the number).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="admin", password="pass12345", role=User.UserRole.ADMIN)
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        parent = Category.objects.create(name="Electronics", slug="electronics")
+        self.category = Category.objects.create(name="Phones", slug="phones", parent=parent)
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Phone {i}", description="A phone",
+                price=Decimal("10.00"), stock_quantity=10, category=self.category,
+            )
+            for i in range(3)
+        ]
+        self.order = Order.objects.create(customer=self.customer, total_amount=Decimal("20.00"), status="paid")
+        for product in self.products[:2]:
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price=Decimal("10.00"))
+        self.pending = Order.objects.create(customer=self.customer, total_amount=Decimal("10.00"))
+        OrderItem.objects.create(order=self.pending, product=self.products[2], quantity=1, price=Decimal("10.00"))
+        reserve_stock(self.pending, {self.products[2].pk: 1})
+        self.review = Review.objects.create(product=self.products[0], user=self.customer, rating=5)
+        self.push = PaymentRequest.objects.create(phone_number="254708374149", amount=Decimal("10.00"))
+        self.client = APIClient()
+
+    def assertQueryCount(self, expected, method, url, data=None, user=None):
+        cache.clear()
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(expected):
+            response = getattr(self.client, method)(url, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400, getattr(response, "data", None))
+        return response
+
+    def test_catalog_reads(self):
+        product, category = self.products[0], self.category
+        for expected, url in [
+            (3, "/categories/"),
+            (2, f"/categories/{category.pk}/"),
+            (1, "/categories/tree/"),
+            (3, "/products/"),
+            (2, "/products/?pagination=cursor"),
+            (6, "/products/?search=phone&ordering=relevance"),
+            (3, f"/products/?category_tree={category.parent_id}"),
+            (3, "/products/?fields=id,name,price,slug"),
+            (2, f"/products/{product.pk}/"),
+            (1, "/products/facets/"),
+            (2, "/reviews/"),
+            (1, f"/reviews/{self.review.pk}/"),
+        ]:
+            with self.subTest(url=url):
+                self.assertQueryCount(expected, "get", url)
+
+    def test_catalog_writes(self):
+        product = self.products[0]
+        for expected, method, url, data in [
+            (8, "post", "/categories/", {"name": "Tablets", "slug": "tablets", "parent": self.category.parent_id}),
+            (4, "post", "/products/", {
+                "sku": "SKU-NEW", "slug": "sku-new", "name": "New", "price": "5.00", "stock_quantity": 1,
+                "category": self.category.pk,
+            }),
+            (2, "patch", f"/products/{product.pk}/", {"price": "11.00"}),
+            (4, "patch", "/products/batch/", [{"id": p.pk, "stock_quantity": 3} for p in self.products]),
+            (5, "post", "/products/import/", [
+                {"sku": f"IMP-{i}", "name": f"Imported {i}", "price": "1.00", "category": "phones"} for i in range(20)
+            ]),
+        ]:
+            with self.subTest(url=url):
+                self.assertQueryCount(expected, method, url, data, user=self.admin)
+
+    def test_orders_and_payments(self):
+        for expected, method, url, data in [
+            (3, "get", "/orders/", None),
+            (3, "get", f"/orders/{self.order.pk}/", None),
+            (1, "get", "/orders/export/", None),
+            (1, "get", "/products/export/", None),
+            (2, "post", f"/orders/{self.order.pk}/mark_delivered/", None),
+            (8, "post", f"/orders/{self.pending.pk}/confirm_payment/", {"phone": "254708374149"}),
+            (1, "get", f"/payments/mpesa/stkpush/{self.push.pk}/", None),
+            (11, "post", "/checkout/", {"items": [{"product": p.pk, "quantity": 1} for p in self.products], "payment_method": "mpesa", "phone": "254708374149"}),
+        ]:
+            with self.subTest(url=url):
+                self.assertQueryCount(expected, method, url, data, user=self.customer if "checkout" in url else self.admin)
+
+    def test_review_creation(self):
+        Order.objects.filter(pk=self.order.pk).update(status="delivered")
+        self.assertQueryCount(5, "post", "/reviews/", {"product": self.products[1].pk, "rating": 4}, user=self.customer)
+
+
+class SqlInstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Phone", price=Decimal("10.00"), stock_quantity=1, category=category,
+        )
+
+    @override_settings(SQL_INSTRUMENTATION=True, SQL_SLOW_REQUEST_MS=0)
+    def test_server_timing_header_and_slow_request_log(self):
+        with self.assertLogs("store.sql", "WARNING") as logs:
+            response = APIClient().get("/products/")
+
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="3 queries", app;dur=[\d.]+$')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry["event"], entry["path"], entry["queries"]), ("slow_request", "/products/", 3))
+        self.assertEqual(len(entry["slowest"]), 3)
+
+    def test_off_by_default(self):
+        self.assertFalse(APIClient().get("/products/").has_header("Server-Timing"))
+
+    def test_str_and_totals_do_not_query_per_row(self):
+        customer = User.objects.create_user(username="buyer", password="pass12345")
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=3, price=Decimal("9.00"))
+        review = Review.objects.create(product=self.product, user=customer, rating=4)
+
+        items = list(OrderItem.objects.all())
+        reviews = list(Review.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(str(items[0]), f"3 × product {self.product.pk}")
+            self.assertEqual(str(reviews[0]), f"4★ by user {customer.pk} on product {self.product.pk}")
+        self.assertEqual(str(Review.objects.select_related("user", "product").get(pk=review.pk)), "4★ by buyer on Phone")
+
+        with self.assertNumQueries(2):  # aggregate + update
+            self.assertEqual(order.calculate_total(), Decimal("30.00"))
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command(
+            "generate_benchmark_data", products=40, categories=12, users=10, reviews=70, orders=20, stdout=StringIO(),
+        )
+
+    def test_generated_dataset(self):
+        self.assertEqual(dataset_counts(), {
+            "categories": 12, "products": 40, "users": 10, "reviews": 70, "orders": 20, "payments": 20,
+        })
+        for category in Category.objects.exclude(parent=None).select_related("parent"):
+            self.assertEqual(category.path, f"{category.parent.path}{category.pk}/")
+        # Aggregates were written with the products, not rebuilt
+        products = Product.objects.filter(sku__startswith="BENCH-").order_by("pk")
+        before = list(products.values_list("rating_count", "rating_sum", "average_rating", "stars_5"))
+        call_command("rebuild_rating_aggregates", stdout=StringIO())
+        self.assertEqual(list(products.values_list("rating_count", "rating_sum", "average_rating", "stars_5")), before)
+        for order in Order.objects.filter(customer__username__startswith="bench-").prefetch_related("items"):
+            self.assertEqual(order.total_amount, sum(item.price * item.quantity for item in order.items.all()))
+
+        call_command("generate_benchmark_data", delete=True, stdout=StringIO())
+        self.assertEqual(set(dataset_counts().values()), {0})
+
+    def test_run_writes_results_and_cleans_up(self):
+        reviews = Review.objects.count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command("run_benchmarks", requests=3, warmup=1, output=path, stderr=StringIO())
+            with open(path) as file:
+                results = json.load(file)
+            err = StringIO()
+            call_command("run_benchmarks", "product_list", requests=2, warmup=0, output="-", compare=path, stdout=StringIO(), stderr=err)
+
+        self.assertEqual(results["meta"]["database"]["vendor"], "sqlite")
+        self.assertEqual(results["meta"]["dataset"]["products"], 40)
+        self.assertEqual(set(results["scenarios"]), {
+            "product_list", "product_search", "product_filter", "category_list", "order_history", "checkout",
+            "review_create", "mpesa_callback",
+        })
+        for name, stats in results["scenarios"].items():
+            with self.subTest(scenario=name):
+                self.assertEqual((stats["requests"], stats["errors"]), (3, 0), stats["status_codes"])
+                latency = stats["latency_ms"]
+                self.assertLessEqual(latency["min"], latency["p50"])
+                self.assertLessEqual(latency["p50"], latency["p99"])
+                self.assertLessEqual(latency["p99"], latency["max"])
+        self.assertIn("product_list: p50_ms", err.getvalue())
+
+        # Write scenarios removed their orders, reviews and callbacks and gave the stock back
+        self.assertEqual(Review.objects.count(), reviews)
+        self.assertFalse(User.objects.filter(username__regex=r"^bench-\d").exists())
+        self.assertFalse(MpesaCallback.objects.exists())
+        self.assertEqual(set(Product.objects.values_list("stock_quantity", flat=True)), {1_000_000})
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Phone {i}", price=Decimal("10.00"), stock_quantity=10, category=category,
+            )
+            for i in range(3)
+        ]
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.other = User.objects.create_user(username="other", password="pass12345")
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(customer=self.customer, total_amount=Decimal("35.00"), status="paid")
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=self.products[0], quantity=2, price=Decimal("10.00")),
+                OrderItem(order=order, product=self.products[1], quantity=1, price=Decimal("15.00")),
+            ])
+            Payment.objects.create(order=order, payment_method="mpesa", amount=Decimal("35.00"), status="successful")
+            self.orders.append(order)
+        Shipping.objects.create(order=self.orders[-1], address="Moi Avenue, Nairobi", tracking_number="TRK1")
+        self.foreign = Order.objects.create(customer=self.other, total_amount=Decimal("10.00"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_customers_only_see_their_own_orders(self):
+        response = self.client.get("/orders/")
+        self.assertEqual([order["id"] for order in response.data["results"]], [order.pk for order in reversed(self.orders)])
+        self.assertEqual(self.client.get(f"/orders/{self.foreign.pk}/").status_code, 404)
+        self.assertEqual(APIClient().get("/orders/").status_code, 401)
+
+        admin = User.objects.create_user(username="admin", password="pass12345", role=User.UserRole.ADMIN)
+        self.client.force_authenticate(admin)
+        self.assertEqual(len(self.client.get("/orders/").data["results"]), 6)
+
+    def test_nested_history(self):
+        Product.objects.filter(pk=self.products[1].pk).delete()
+        order = self.client.get("/orders/").data["results"][0]
+
+        self.assertEqual((order["item_count"], str(order["items_total"])), (3, "35.00"))
+        self.assertEqual(order["items"][0]["product"], {
+            "id": self.products[0].pk, "sku": "SKU-0", "name": "Phone 0", "slug": "product-0",
+        })
+        self.assertEqual(str(order["items"][0]["line_total"]), "20.00")
+        self.assertIsNone(order["items"][1]["product"])
+        self.assertEqual(order["payments"][0]["status"], "successful")
+        self.assertEqual(order["shipping"]["tracking_number"], "TRK1")
+        self.assertIsNone(self.client.get(f"/orders/{self.orders[0].pk}/").data["shipping"])
+
+    def test_keyset_pages_in_fixed_queries(self):
+        seen = []
+        url = "/orders/?page_size=2"
+        while url:
+            with self.assertNumQueries(3):  # orders + shipping, lines + products, payments
+                response = self.client.get(url)
+            seen += [order["id"] for order in response.data["results"]]
+            url = response.data["links"]["next"]
+        self.assertEqual(seen, [order.pk for order in reversed(self.orders)])
+        self.assertIsNone(response.data["count"])
+
+        response = self.client.get("/orders/", {"status": "pending"})
+        self.assertEqual(response.data["results"], [])
+
+
+class StatelessJWTTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Phone", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.order = Order.objects.create(customer=self.customer, total_amount=Decimal("10.00"), status="delivered")
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1, price=Decimal("10.00"))
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post("/auth/token/", {"username": "buyer", "password": "pass12345"}, format="json")
+        return response.data
+
+    def test_tokens_carry_role_and_groups(self):
+        access = AccessToken(self.login()["access"])
+        self.assertEqual((access["role"], access["username"], access["groups"]), ("customer", "buyer", ["Customer"]))
+
+    def test_requests_skip_the_user_query(self):
+        access = self.login()["access"]
+        legacy = str(AccessToken.for_user(self.customer))  # issued before the claims existed
+
+        for token, queries in [(access, 3), (legacy, 4)]:
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            with self.assertNumQueries(queries):
+                response = self.client.get("/orders/")
+            self.assertEqual([order["id"] for order in response.data["results"]], [self.order.pk])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        response = self.client.post("/reviews/", {"product": self.product.pk, "rating": 5}, format="json")
+        self.assertEqual((response.status_code, response.data["user"]), (201, self.customer.pk))
+        self.assertEqual(self.client.post("/reviews/", {"product": self.product.pk, "rating": 4}, format="json").status_code, 400)
+        response = self.client.post("/checkout/", {"items": [{"product": self.product.pk}], "payment_method": "card"}, format="json")
+        self.assertEqual(Order.objects.get(pk=response.data["order_id"]).customer, self.customer)
+        self.assertEqual(self.client.get("/auth/me/").data["username"], "buyer")  # loads the full user
+        self.assertEqual(self.client.post(f"/orders/{self.order.pk}/mark_delivered/").status_code, 400)  # owner may act
+
+        other = User.objects.create_user(username="other", password="pass12345")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {add_principal_claims(AccessToken.for_user(other), other)}")
+        self.assertEqual(self.client.get(f"/orders/{self.order.pk}/").status_code, 404)
+
+    def test_refresh_picks_up_role_changes(self):
+        refresh = self.login()["refresh"]
+        User.objects.filter(pk=self.customer.pk).update(role=User.UserRole.SELLER)
+
+        response = self.client.post("/auth/token/refresh/", {"refresh": refresh}, format="json")
+        self.assertEqual(AccessToken(response.data["access"])["role"], "seller")
+
+    def test_sellers_can_change_products(self):
+        seller = User.objects.create_user(username="seller", password="pass12345", role=User.UserRole.SELLER)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {add_principal_claims(AccessToken.for_user(seller), seller)}")
+
+        response = self.client.patch(f"/products/{self.product.pk}/", {"price": "12.00"}, format="json")
+        self.assertEqual((response.status_code, response.data["price"]), (200, "12.00"))
+        self.assertEqual(self.client.delete(f"/products/{self.product.pk}/").status_code, 204)
+
+    def test_ownership_follows_relations_and_fails_closed(self):
+        payment = Payment.objects.create(order=self.order, payment_method="mpesa", amount=10)
+        other = User.objects.create_user(username="other", password="pass12345")
+        request = RequestFactory().patch("/")
+        for user, allowed in [(self.customer, True), (other, False)]:
+            request.user = user
+            self.assertEqual(RolePermission().has_object_permission(request, PaymentViewSet(), payment), allowed)
+
+        # An owner_field the model lacks is a configuration error, never a pass
+        view = type("View", (), {"allowed_roles": [User.UserRole.CUSTOMER], "owner_field": "customer"})()
+        with self.assertRaises(ImproperlyConfigured):
+            RolePermission().has_object_permission(request, view, payment)
+
+
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.reset()
+        self.user = User.objects.create_user(username="buyer", password="pass12345")
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post("/auth/token/", {"username": "buyer", "password": "pass12345"}, format="json").data
+
+    def outstanding(self, jti, expires_in, blacklisted=False):
+        now = timezone.now()
+        token = OutstandingToken.objects.create(
+            user=self.user, jti=jti, token=jti, created_at=now, expires_at=now + timedelta(seconds=expires_in),
+        )
+        if blacklisted:
+            BlacklistedToken.objects.create(token=token)
+        return token
+
+    def test_logout_blacklists_the_refresh_token(self):
+        tokens = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/auth/token/blacklist/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post("/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post("/auth/token/verify/", {"token": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unlisted_tokens_skip_the_database(self):
+        self.outstanding("revoked", 3600, blacklisted=True)
+        tokens = self.login()
+        self.assertFalse(is_blacklisted("warm-up"))
+
+        with self.assertNumQueries(0):
+            response = self.client.post("/auth/token/verify/", {"token": tokens["access"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):  # the filter says "maybe"; the database confirms
+            self.assertTrue(is_blacklisted("revoked"))
+
+    def test_other_processes_catch_up_after_commit(self):
+        other = BlacklistFilter()  # another worker's copy, loaded from the shared snapshot
+        self.assertNotIn("late", other)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outstanding("late", 3600, blacklisted=True)
+        self.assertIn("late", other)
+        self.assertTrue(is_blacklisted("late"))
+
+    def test_bloom_filter_error_rate(self):
+        bloom = BloomFilter(5000)
+        for i in range(5000):
+            bloom.add(f"in-{i}")
+        self.assertTrue(all(f"in-{i}" in bloom for i in range(5000)))
+        false_positives = sum(f"out-{i}" in bloom for i in range(5000))
+        self.assertLess(false_positives, 100)
+
+    def test_prune_deletes_expired_tokens_in_batches(self):
+        for i in range(5):
+            self.outstanding(f"old-{i}", -60, blacklisted=i % 2 == 0)
+        self.outstanding("live", 3600, blacklisted=True)
+        self.outstanding("fresh", 3600)
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("prune_tokens", batch_size=2, stdout=out)
+        self.assertIn("Deleted 5 expired outstanding token(s) and 3 blacklist entry(ies).", out.getvalue())
+        self.assertEqual(sorted(OutstandingToken.objects.values_list("jti", flat=True)), ["fresh", "live"])
+        self.assertEqual(list(BlacklistedToken.objects.values_list("token__jti", flat=True)), ["live"])
+        deletes = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 6)  # 3 batches x (blacklist, outstanding)
+
+
+TEST_THROTTLE_RATES = {"login": "20/min", "login_account": "2/min", "checkout": "10/min", "stk_push": "10/min", "mpesa_phone": "2/min"}
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": TEST_THROTTLE_RATES})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="product-1", name="Phone", price=Decimal("10.00"), stock_quantity=10, category=category,
+        )
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.client = APIClient()
+
+    def test_login_attempts_are_limited_per_account(self):
+        for _ in range(2):
+            response = self.client.post("/auth/token/", {"username": "Buyer", "password": "wrong"}, format="json")
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post("/auth/token/", {"username": "buyer", "password": "pass12345"}, format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response["Retry-After"]) <= 30)
+
+        response = self.client.post("/auth/token/", {"username": "other", "password": "wrong"}, format="json")
+        self.assertEqual(response.status_code, 401)  # the IP still has tokens
+
+    def test_phone_bucket_is_shared_by_checkout_and_stk_push(self):
+        self.client.force_authenticate(self.customer)
+        checkout = {"items": [{"product": self.product.pk}], "payment_method": "mpesa", "phone": "0712345678"}
+        self.assertEqual(self.client.post("/checkout/", checkout, format="json").status_code, 200)
+        self.assertEqual(self.client.post("/payments/mpesa/stkpush/?phone_number=254712345678&amount=10").status_code, 202)
+        self.assertEqual(self.client.post("/payments/mpesa/stkpush/?phone_number=%2B254712345678&amount=10").status_code, 429)
+        self.assertEqual(self.client.post("/payments/mpesa/stkpush/?phone_number=254700000000&amount=10").status_code, 202)
+
+    def test_buckets_are_charged_together(self):
+        small, large = ("throttle:test:small", 1, 1.0), ("throttle:test:large", 2, 1.0)
+        self.assertEqual(take_tokens([small, large], now=100.0), 0)
+        self.assertAlmostEqual(take_tokens([small, large], now=100.25), 0.75)
+        self.assertEqual(take_tokens([large], now=100.25), 0)  # the refused request took nothing
+        self.assertEqual(take_tokens([small], now=101.0), 0)  # refilled
+
+    def test_normalize_phone(self):
+        for phone in ["0712345678", "+254712345678", "254 712 345 678"]:
+            self.assertEqual(normalize_phone(phone), "254712345678")
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        for i in range(3):
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Phone {i}", price=Decimal("10.00"), stock_quantity=5,
+                category=self.category,
+            )
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.token = str(add_principal_claims(AccessToken.for_user(self.customer), self.customer))
+        self.client = APIClient()
+
+    def start_gateway(self, latency):
+        gateway = start_gateway(latency)
+        self.addCleanup(gateway.server_close)
+        self.addCleanup(gateway.shutdown)
+        settings_override = override_settings(
+            MPESA_BASE_URL=f"http://127.0.0.1:{gateway.server_port}", MPESA_CONSUMER_KEY="key", MPESA_CONSUMER_SECRET="secret",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        payment = Payment.objects.create(order=Order.objects.create(customer=self.customer), payment_method="mpesa", amount=10)
+        return PaymentRequest.objects.create(
+            payment=payment, customer=self.customer, phone_number="254700000000", amount=10, status="sent",
+            checkout_request_id="ws_CO_1",
+        )
+
+    def test_catalog_matches_the_drf_views(self):
+        for path in ["/products/?page_size=2", "/products/?page_size=2&page=2", "/categories/"]:
+            expected = self.client.get(path).content
+            self.assertEqual(self.client.get("/async" + path).content.replace(b"/async/", b"/"), expected)
+        product = Product.objects.first()
+        self.assertEqual(self.client.get(f"/async/products/{product.pk}/").json(), self.client.get(f"/products/{product.pk}/").json())
+        self.assertEqual(self.client.get("/async/products/999/").status_code, 404)
+        self.assertEqual(self.client.get("/async/products/?page=9").status_code, 404)
+        for path in ["/products/?page=x", "/products/?page=0", "/products/?page=9"]:
+            response = self.client.get("/async" + path)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), self.client.get(path).json())
+        for path in ["/products/?page_size=x", "/products/?page_size=2&page=last"]:
+            expected = self.client.get(path).content
+            self.assertEqual(self.client.get("/async" + path).content.replace(b"/async/", b"/"), expected)
+
+    def test_stk_push_requires_a_customer(self):
+        path = "/async/payments/mpesa/stkpush/?phone_number=254700000000&amount=10"
+        self.assertEqual(self.client.post(path).status_code, 401)
+        seller = User.objects.create_user(username="seller", password="pass12345", role=User.UserRole.SELLER)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {add_principal_claims(AccessToken.for_user(seller), seller)}")
+        self.assertEqual(self.client.post(path).status_code, 403)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        response = self.client.post(path)
+        self.assertEqual(response.status_code, 202)
+        push = PaymentRequest.objects.get(pk=response.json()["request_id"])
+        self.assertEqual((push.status, push.customer_id), ("pending", self.customer.pk))
+
+        for prefix in ["/async", ""]:
+            response = self.client.post(f"{prefix}/payments/mpesa/stkpush/?phone_number=254700000000&amount=ten")
+            self.assertEqual((response.status_code, list(response.json())), (400, ["amount"]))
+
+    def test_live_status_asks_the_gateway(self):
+        push = self.start_gateway(0)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        for path in [f"/payments/mpesa/stkpush/{push.pk}/", f"/async/payments/mpesa/stkpush/{push.pk}/"]:
+            self.assertNotIn("gateway", self.client.get(path).json())
+            data = self.client.get(path + "?live=1").json()
+            self.assertEqual((data["status"], data["gateway"]["ResultCode"]), ("sent", "1032"))
+            self.assertNotIn("ws_CO_1", json.dumps(data))
+
+    def test_status_is_only_shown_to_the_payer_and_admins(self):
+        push = self.start_gateway(0)
+        other = User.objects.create_user(username="other", password="pass12345")
+        admin = User.objects.create_user(username="admin", password="pass12345", role=User.UserRole.ADMIN)
+        # No order behind a direct push: it belongs to whoever asked for it
+        token = add_principal_claims(AccessToken.for_user(other), other)
+        response = self.client.post(
+            "/payments/mpesa/stkpush/?phone_number=254700000000&amount=10", HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+        direct = PaymentRequest.objects.get(pk=response.data["request_id"])
+        for path in ["/payments/mpesa/stkpush/{}/", "/async/payments/mpesa/stkpush/{}/"]:
+            for user, pk, status in [
+                (self.customer, push.pk, 200), (other, push.pk, 404), (self.customer, direct.pk, 404),
+                (other, direct.pk, 200), (admin, push.pk, 200), (admin, direct.pk, 200),
+            ]:
+                token = add_principal_claims(AccessToken.for_user(user), user)
+                with self.subTest(path=path, user=user.username, push=pk):
+                    response = self.client.get(path.format(pk), HTTP_AUTHORIZATION=f"Bearer {token}")
+                    self.assertEqual(response.status_code, status)
+
+        self.assertNotIn("checkout_request_id", PaymentSerializer(push.payment).data)
+
+    async def test_gateway_waits_overlap(self):
+        push = await sync_to_async(self.start_gateway)(0.3)
+        client, headers = AsyncClient(), {"Authorization": f"Bearer {self.token}"}
+        path = f"/async/payments/mpesa/stkpush/{push.pk}/?live=1"
+        await client.get(path, headers=headers)  # fetches the OAuth token
+
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[client.get(path, headers=headers) for _ in range(5)])
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertLess(time.perf_counter() - started, 1.0)  # one after another would take 1.5s
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    The routing tests that need a second database run when one is configured:
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.sqlite3 python manage.py test store.tests.ReplicaRoutingTests
+    Its test database is separate from the primary's, so "replication" is
+    done by hand.
+    """
+    databases = {"default", *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        cache.clear()
+        replica_status.reset()
+        self.addCleanup(replica_status.reset)
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.token = str(add_principal_claims(AccessToken.for_user(self.customer), self.customer))
+
+    def report(self, **lags):
+        now = time.time()
+        cache.set(STATUS_KEY, {
+            alias: {"lag": lag, "synced_to": 0.0 if lag is None else now - lag, "checked_at": now}
+            for alias, lag in lags.items()
+        })
+        replica_status.reset()
+
+    def route(self, method, view, token=None):
+        """The database the router picks for reads inside `view`."""
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen.append(ReplicaRouter().db_for_read(Product))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        middleware(getattr(RequestFactory(), method)("/", **headers))
+        self.assertIsNone(read_replica())  # reset after the request
+        return seen[0]
+
+    @override_settings(DATABASE_REPLICAS=["replica1", "replica2", "replica3", "replica4"], REPLICA_MAX_LAG=5)
+    def test_only_fresh_reports_of_small_lag_keep_a_replica_in_rotation(self):
+        self.report(replica1=0.5, replica2=30, replica3=None)
+        self.assertEqual(healthy_replicas(), ["replica1"])
+        status = cache.get(STATUS_KEY)
+        status["replica1"]["checked_at"] -= settings.REPLICA_STATUS_TTL + 1  # the monitor stopped
+        cache.set(STATUS_KEY, status)
+        replica_status.reset()
+        self.assertEqual(healthy_replicas(), [])
+
+    @override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_safe_catalog_requests_read_from_a_replica_until_the_user_writes(self):
+        self.report(replica1=0)
+        products = ProductViewSet.as_view({"get": "list", "post": "create"})
+        self.assertEqual(self.route("get", products), "replica1")
+        self.assertEqual(self.route("get", products, self.token), "replica1")
+        self.assertIsNone(self.route("post", products))
+        self.assertIsNone(self.route("get", CheckoutView.as_view(), self.token))
+
+        self.route("post", CheckoutView.as_view(), self.token)
+        self.assertIsNone(self.route("get", products, self.token))  # pinned to the primary
+        self.assertEqual(self.route("get", products), "replica1")
+        cache.delete(f"replicas:pin:{self.customer.pk}")  # the sticky window ends
+        self.assertEqual(self.route("get", products, self.token), "replica1")
+
+    @override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_lagging_replicas_are_not_used(self):
+        self.report(replica1=60)
+        self.assertIsNone(self.route("get", ProductViewSet.as_view({"get": "list"})))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_middleware_is_unused_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+    @override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_cache_fills_use_the_primary_until_the_replica_has_the_change(self):
+        self.report(replica1=0)
+        with reading_from("replica1"):
+            with fresh_catalog_reads():
+                self.assertEqual(read_replica(), "replica1")
+            bump_generation()
+            with fresh_catalog_reads():
+                self.assertIsNone(read_replica())
+            status = cache.get(STATUS_KEY)
+            status["replica1"]["synced_to"] = time.time() + 2
+            cache.set(STATUS_KEY, status)
+            replica_status.reset()
+            with fresh_catalog_reads():
+                self.assertEqual(read_replica(), "replica1")
+
+    def replicate(self, beat_at=None):
+        """Copy the catalog to the replica and run one monitor check."""
+        replica = settings.DATABASE_REPLICAS[0]
+        self.category.save(using=replica)
+        Product.objects.using(replica).create(
+            pk=self.product.pk, sku=self.product.sku, slug=self.product.slug, name="Replica phone",
+            price=self.product.price, stock_quantity=5, category_id=self.category.pk,
+        )
+        ReplicaHeartbeat.objects.using(replica).create(pk=1, beat_at=beat_at or timezone.now())
+        cache.clear()  # no catalog change the replica could be missing
+        out = StringIO()
+        call_command("monitor_replicas", "--once", stdout=out)
+        replica_status.reset()
+        return out.getvalue()
+
+    def create_catalog(self):
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="phone", name="Primary phone", price=Decimal("10.00"), stock_quantity=5, category=self.category,
+        )
+        Review.objects.create(product=self.product, user=self.customer, rating=5)
+
+    @skipUnless(settings.DATABASE_REPLICAS, "set DATABASE_REPLICA_URLS to run against a replica")
+    def test_reads_and_writes_against_a_replica(self):
+        self.create_catalog()
+        self.assertIn("s behind", self.replicate())
+        client = APIClient()
+        self.assertEqual(client.get(f"/products/{self.product.pk}/").data["name"], "Replica phone")
+        self.assertEqual(self.client.get(f"/async/products/{self.product.pk}/").json()["name"], "Replica phone")
+        asgi = async_to_sync(AsyncClient().get)("/async/products/")
+        self.assertEqual(asgi.json()["results"][0]["name"], "Replica phone")
+        self.assertEqual(client.get("/reviews/").data["count"], 0)  # not replicated
+
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.assertEqual(client.get("/reviews/").data["count"], 0)
+        client.post("/reviews/", {}, format="json")  # any write pins the user
+        self.assertEqual(client.get("/reviews/").data["count"], 1)
+        self.assertEqual(APIClient().get("/reviews/").data["count"], 0)
+
+        bump_generation()  # a change the replica has not replayed
+        self.assertEqual(APIClient().get(f"/products/{self.product.pk}/").data["name"], "Primary phone")
+
+    @skipUnless(settings.DATABASE_REPLICAS, "set DATABASE_REPLICA_URLS to run against a replica")
+    def test_a_lagging_replica_leaves_the_rotation(self):
+        self.create_catalog()
+        self.assertIn("(out of rotation)", self.replicate(beat_at=timezone.now() - timedelta(minutes=1)))
+        self.assertEqual(APIClient().get("/reviews/").data["count"], 1)
+        self.assertEqual(APIClient().get(f"/products/{self.product.pk}/").data["name"], "Primary phone")
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=f"Product {i}", price=Decimal(price),
+                stock_quantity=1, category=category,
+            )
+            for i, price in enumerate(["5.00", "5.00", "5.00", "10.00", "10.00", "20.00", "30.00"])
+        ]
+        self.client = APIClient()
+
+    def walk(self, url, params=None, direction="next"):
+        pages = []
+        data = self.client.get(url, params).data
+        while True:
+            pages.append([product["id"] for product in data["results"]])
+            if not data["links"][direction]:
+                return pages, data
+            data = self.client.get(data["links"][direction]).data
+
+    def test_pages_follow_the_ordering_with_ties_broken_by_id(self):
+        pages, last = self.walk("/products/", {"pagination": "cursor", "ordering": "price", "page_size": 2})
+        self.assertEqual(pages, [[p.pk for p in self.products[i:i + 2]] for i in range(0, 7, 2)])
+        self.assertIsNone(last["count"])
+
+        descending, _ = self.walk("/products/", {"pagination": "cursor", "ordering": "-price", "page_size": 3})
+        expected = sorted(self.products, key=lambda p: (p.price, p.pk), reverse=True)
+        self.assertEqual(sum(descending, []), [p.pk for p in expected])
+
+    def test_previous_links_walk_back_over_the_same_pages(self):
+        forward, last = self.walk("/products/", {"pagination": "cursor", "ordering": "price", "page_size": 2})
+        backward, first = self.walk(last["links"]["previous"], direction="previous")
+        self.assertEqual(backward, forward[-2::-1])
+        self.assertIsNotNone(first["links"]["next"])
+
+    def test_tampered_and_garbage_cursors_are_rejected(self):
+        data = self.client.get("/products/", {"pagination": "cursor", "ordering": "price", "page_size": 2}).data
+        token = data["links"]["next"].split("cursor=")[1].split("&")[0]
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+
+        forged = dict(payload, o="-created_at,-pk")  # issued for another ordering
+        bad_value = dict(payload, v=["not a price", payload["v"][1]])
+        for cursor in [
+            "garbage!",
+            base64.urlsafe_b64encode(json.dumps(forged).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps(bad_value).encode()).decode(),
+            base64.urlsafe_b64encode(b"[1, 2]").decode(),
+        ]:
+            response = self.client.get("/products/", {"cursor": cursor, "ordering": "price", "page_size": 2})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_estimated_and_cached_counts(self):
+        params = {"pagination": "cursor", "page_size": 2}
+        self.assertEqual(self.client.get("/products/", {**params, "count": "cached"}).data["count"], 7)
+        self.products[-1].delete()  # bumps the catalog generation, not the cached count
+        self.assertEqual(self.client.get("/products/", {**params, "count": "cached"}).data["count"], 7)
+        # SQLite has no planner estimate: the cached count stands in
+        self.assertEqual(self.client.get("/products/", {**params, "count": "estimated"}).data["count"], 7)
+        cache.clear()
+        self.assertEqual(self.client.get("/products/", {**params, "count": "cached"}).data["count"], 6)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_index(Product).fingerprint = None  # the index outlives each test's rollback
+        self.category = Category.objects.create(name="Phones", slug="phones")
+        self.products = {
+            name: Product.objects.create(
+                sku=f"SKU-{i}", slug=f"product-{i}", name=name, description=description,
+                price=Decimal("10.00"), stock_quantity=1, category=self.category,
+            )
+            for i, (name, description) in enumerate([
+                ("Samsung Galaxy phone", "Android phone"),
+                ("Phone case", "Fits Samsung phones"),
+                ("Leather wallet", "Brown"),
+                ("Phone charger", "USB-C phone charger, fast phone charging"),
+            ])
+        }
+        self.client = APIClient()
+
+    def names(self, **params):
+        return [product["name"] for product in self.client.get("/products/", params).data["results"]]
+
+    def test_fallback_ranks_name_matches_first_and_tolerates_typos(self):
+        self.assertEqual(self.names(search="samsung", ordering="relevance"), ["Samsung Galaxy phone", "Phone case"])
+        self.assertEqual(self.names(search="samsng", ordering="relevance"), ["Samsung Galaxy phone", "Phone case"])
+        self.assertEqual(self.names(search="gal"), ["Samsung Galaxy phone"])  # prefix of the last word
+        self.assertEqual(self.names(search="zebra"), [])
+
+    def test_index_is_rebuilt_when_products_change(self):
+        index = get_index(Product)
+        self.assertEqual(index.search("wallet")[0][0], self.products["Leather wallet"].pk)
+        wallet = self.products["Leather wallet"]
+        wallet.name = "Canvas purse"
+        wallet.save()
+        self.assertEqual(index.search("wallet"), [])
+        self.assertEqual([pk for pk, _ in index.search("purse")], [wallet.pk])
+
+        nokia = Product.objects.create(
+            sku="SKU-9", slug="product-9", name="Nokia phone", price=Decimal("10.00"), stock_quantity=1, category=self.category,
+        )
+        self.assertEqual([pk for pk, _ in index.search("nokia")], [nokia.pk])
+
+    def test_relevance_ordering_pages_with_a_cursor(self):
+        ranked = self.names(search="phone", ordering="relevance")
+        self.assertEqual(len(ranked), 3)
+        names, data = [], self.client.get(
+            "/products/", {"search": "phone", "ordering": "relevance", "pagination": "cursor", "page_size": 1},
+        ).data
+        while True:
+            names += [product["name"] for product in data["results"]]
+            if not data["links"]["next"]:
+                break
+            data = self.client.get(data["links"]["next"]).data
+        self.assertEqual(names, ranked)
+
+    def test_capped_fallback_results_are_reported(self):
+        self.assertNotIn("search_limit", self.client.get("/products/", {"search": "phone"}).data)
+        with mock.patch.object(RankedSearchFilter, "max_fallback_results", 2):
+            data = self.client.get("/products/", {"search": "phone", "ordering": "relevance"}).data
+            self.assertEqual((data["count"], data["search_limit"]), (2, 2))
+            data = self.client.get("/products/", {"search": "phone", "pagination": "cursor"}).data
+            self.assertEqual(data["search_limit"], 2)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="phone", name="Phone", price=Decimal("10.00"), stock_quantity=1, category=category,
+        )
+        self.client = APIClient()
+
+    def test_hits_skip_the_database_until_the_catalog_changes(self):
+        path = f"/products/{self.product.pk}/"
+        self.assertEqual(self.client.get(path).data["name"], "Phone")
+        self.client.get("/products/", {"page_size": 5})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(path).data["name"], "Phone")
+            self.client.get("/products/", {"page_size": 5})
+
+        generation = cache.get("catalog:generation")
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertGreater(cache.get("catalog:generation"), generation)
+        self.assertEqual(self.client.get(path).data["name"], "Renamed")
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_compute("test:key", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ["value"] * 5))
+
+    def test_waits_for_the_lock_holder_in_another_process(self):
+        cache.add("test:key:lock", 1)  # held by another worker
+        threading.Timer(0.2, lambda: cache.set("test:key", "theirs")).start()
+        self.assertEqual(get_or_compute("test:key", lambda: "ours"), "theirs")
+
+        cache.delete("test:key")
+        cache.add("test:key:lock", 1)
+        threading.Timer(0.2, lambda: cache.delete("test:key:lock")).start()  # gave up without a value
+        started = time.monotonic()
+        self.assertEqual(get_or_compute("test:key", lambda: "ours"), "ours")
+        self.assertLess(time.monotonic() - started, settings.CATALOG_CACHE_LOCK_TIMEOUT)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones", slug="phones")
+        self.product = Product.objects.create(
+            sku="SKU-1", slug="phone", name="Phone", price=Decimal("10.00"), stock_quantity=5, category=category,
+        )
+        self.customer = User.objects.create_user(username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.path = f"/products/{self.product.pk}/"
+
+    def test_matching_validators_get_304(self):
+        for path in [self.path, "/products/", "/categories/"]:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            not_modified = self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual((not_modified.status_code, not_modified.content), (304, b""))
+            since = self.client.get(path, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+            self.assertEqual(since.status_code, 304)
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_malformed_ids_are_not_found(self):
+        for path in ["/products/abc/", "/categories/abc/", "/products/99999/"]:
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_saves_change_the_validators(self):
+        etag = self.client.get(self.path)["ETag"]
+        self.product.price = Decimal("12.00")
+        self.product.save()
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data["price"]), (200, "12.00"))
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_writes_around_save_change_the_validators(self):
+        review = Review.objects.create(product=self.product, user=self.customer, rating=5)
+        etag = self.client.get(self.path)["ETag"]
+        Review.objects.filter(pk=review.pk).update(rating=1)  # no signals
+        call_command("rebuild_rating_aggregates", stdout=StringIO())
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data["average_rating"]), (200, "1.00"))
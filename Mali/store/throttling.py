@@ -0,0 +1,163 @@
+import math
+import re
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Every bucket of a request is checked and charged in one EVALSHA: either all
+# of them have a token and each loses one, or none is charged. A bucket is a
+# hash of (tokens, last refill time); idle buckets expire once full again.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local states, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local capacity, rate = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local state = redis.call("HMGET", key, "tokens", "at")
+    local tokens = tonumber(state[1]) or capacity
+    tokens = math.min(capacity, tokens + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    states[i] = tokens
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        local capacity, rate = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+        local tokens = states[i] - 1
+        redis.call("HSET", key, "tokens", tostring(tokens), "at", ARGV[1])
+        redis.call("PEXPIRE", key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+    end
+end
+return tostring(wait)
+"""
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_local_lock = threading.Lock()
+_script = None
+
+
+def parse_rate(rate):
+    """'10/min' -> (capacity 10, refill rate in tokens per second)."""
+    count, period = rate.split("/")
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def normalize_phone(phone):
+    """Kenyan MSISDNs in any of 07.., +2547.., 2547.. form -> 2547..."""
+    digits = re.sub(r"\D", "", str(phone))
+    if digits.startswith("0"):
+        digits = "254" + digits[1:]
+    return digits or None
+
+
+def user_ident(throttle, request, view):
+    return request.user.pk if request.user and request.user.is_authenticated else None
+
+
+def ip_ident(throttle, request, view):
+    return throttle.get_ident(request)
+
+
+def phone_ident(throttle, request, view):
+    phone = request.data.get("phone") if hasattr(request.data, "get") else None
+    phone = phone or request.query_params.get("phone_number")
+    return normalize_phone(phone) if phone else None
+
+
+def username_ident(throttle, request, view):
+    username = request.data.get("username") if hasattr(request.data, "get") else None
+    if not username:
+        return None
+    return str(username).strip().lower() or None
+
+
+IDENTS = {"user": user_ident, "ip": ip_ident, "phone": phone_ident, "username": username_ident}
+
+
+def throttle_delay(buckets):
+    """
+    Charge [(scope, ident, value)] buckets at their configured rates. Scopes
+    without a rate and missing values are skipped. Returns 0 or the seconds
+    to wait.
+    """
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    keyed = [
+        (f"throttle:{scope}:{ident}:{value}", *parse_rate(rates[scope]))
+        for scope, ident, value in buckets if value is not None and rates.get(scope)
+    ]
+    return take_tokens(keyed) if keyed else 0
+
+
+def take_tokens(buckets, now=None):
+    """
+    Take one token from each of `buckets` [(key, capacity, rate)], or from
+    none of them. Returns 0 when allowed, else the seconds until every bucket
+    has a token again.
+    """
+    now = time.time() if now is None else now
+    if isinstance(cache, RedisCache):
+        return _take_redis(buckets, now)
+    return _take_local(buckets, now)
+
+
+def _take_redis(buckets, now):
+    global _script
+    client = cache._cache.get_client(write=True)  # a new client on a shared pool
+    if _script is None:
+        _script = client.register_script(TOKEN_BUCKET_SCRIPT)
+    keys = [cache.make_and_validate_key(key) for key, _, _ in buckets]
+    args = [repr(now)]
+    for _, capacity, rate in buckets:
+        args += [capacity, repr(rate)]
+    return float(_script(keys=keys, args=args, client=client))
+
+
+def _take_local(buckets, now):
+    # Other backends have no atomic read-modify-write: the lock makes buckets
+    # exact within a process (all of them, for LocMemCache), and limits are
+    # approximate across processes sharing a memcached or database cache.
+    with _local_lock:
+        states = cache.get_many([key for key, _, _ in buckets])
+        refilled, wait = {}, 0
+        for key, capacity, rate in buckets:
+            tokens, at = states.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - at) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            refilled[key] = (tokens, capacity, rate)
+        if wait:
+            return wait
+        for key, (tokens, capacity, rate) in refilled.items():
+            cache.set(key, (tokens - 1, now), math.ceil((capacity - tokens + 1) / rate) + 1)
+        return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token buckets from the view's `throttle_buckets`, a list of
+    (scope, ident) pairs:
+    - `scope` names a rate in REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"], e.g.
+      "10/min": bursts of up to 10 requests, refilled at 10 per minute.
+      Scopes shared between views share their buckets.
+    - `ident` is a key in IDENTS: "user", "ip", "phone" or "username".
+      Buckets whose ident is missing from the request (anonymous users,
+      no phone) are skipped.
+    All of a request's buckets cost one cache round trip on Redis.
+    """
+
+    def allow_request(self, request, view):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        self.delay = throttle_delay([
+            (scope, ident, IDENTS[ident](self, request, view))
+            for scope, ident in getattr(view, "throttle_buckets", []) if rates.get(scope)
+        ])
+        return not self.delay
+
+    def wait(self):
+        return self.delay
@@ -1,54 +1,57 @@
-from django.utils import timezone
-from rest_framework import viewsets, filters, generics, permissions, status
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import viewsets, generics, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from rest_framework.pagination import PageNumberPagination
 import uuid
 
-from .models import Category, Product, User, Order, Review, OrderItem, Payment
+from .models import Category, Product, User, Order, Review, OrderItem, Payment, PaymentRequest
 from .serializers import (
     CategorySerializer, ProductSerializer, RegisterSerializer, UserSerializer,
-    OrderSerializer, ReviewSerializer, CheckoutSerializer, PaymentSerializer
+    OrderSerializer, OrderHistorySerializer, ReviewSerializer, CheckoutSerializer, PaymentSerializer, ProductChangeSerializer,
+    StkPushSerializer,
 )
-from .permissions import RolePermission
-from .pagination import StandardResultsSetPagination
-from .mpesa import initiate_stk_push, MpesaClient
-
-client = MpesaClient()
-response = client.stk_push(phone_number="254708374149", amount=10)
+from .authentication import full_user
+from .permissions import RolePermission, ExportPermission
+from .pagination import CatalogPagination, KeysetPagination
+from .filters import ProductFilter
+from .search import RankedSearchFilter, RelevanceOrderingFilter
+from .cache import CachedCatalogMixin, catalog_key, get_or_compute
+from .facets import compute_facets, facet_params
+from .conditional import ConditionalGetMixin
+from .fieldsets import SparseFieldsetViewMixin
+from .outbox import enqueue_stk_push
+from .mpesa import MpesaError, get_client
+from .inventory import InsufficientStock, renew_reservations, reserve_stock
+from .callbacks import ingest_callback, InvalidCallback
+from .exports import FORMATS, ExportContentNegotiation, export_response
+from .imports import READERS, import_products
+from .batch_updates import apply_product_changes
+from .throttling import TokenBucketThrottle
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 import logging
-from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 
 logger = logging.getLogger(__name__)
 
-
-@api_view(["POST"])
-@permission_classes([AllowAny])  # Safaricom does not authenticate
-def mpesa_callback(request):
-    """
-    Receive STK push callback from Safaricom.
-    """
-    data = request.data
-    logger.info("M-Pesa Callback: %s", data)
-
-    # Example: Save to database or log
-    # You can parse request.data["Body"]["stkCallback"] for status and metadata
-
-    return Response({"ResultCode": 0, "ResultDesc": "Callback received successfully"}, status=status.HTTP_200_OK)
+export_format_param = openapi.Parameter('as', openapi.IN_QUERY, description="Export format: csv (default) or ndjson", type=openapi.TYPE_STRING)
 
 
 # ------------------- CATEGORY -------------------
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedCatalogMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [RolePermission]
-    pagination_class = StandardResultsSetPagination
+    replica_reads = True  # GETs may read from a replica (store/routers.py)
+    pagination_class = CatalogPagination
+    ordering_fields = ["name", "created_at"]
+    ordering = ["name"]
 
     list_query_params = [
         openapi.Parameter('parent', openapi.IN_QUERY, description="Filter by parent ID", type=openapi.TYPE_INTEGER),
@@ -56,6 +59,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
         openapi.Parameter('ordering', openapi.IN_QUERY, description="Sort by name or created_at", type=openapi.TYPE_STRING),
         openapi.Parameter('page', openapi.IN_QUERY, description="Page number", type=openapi.TYPE_INTEGER),
         openapi.Parameter('page_size', openapi.IN_QUERY, description="Results per page", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('pagination', openapi.IN_QUERY, description="Set to 'cursor' for keyset pagination", type=openapi.TYPE_STRING),
+        openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor from the next/previous links", type=openapi.TYPE_STRING),
+        openapi.Parameter('count', openapi.IN_QUERY, description="Cursor mode only: 'estimated' or 'cached' total count", type=openapi.TYPE_STRING),
+        openapi.Parameter('fields', openapi.IN_QUERY, description="Comma-separated fields to return, e.g. id,name,price,slug", type=openapi.TYPE_STRING),
+        openapi.Parameter('omit', openapi.IN_QUERY, description="Comma-separated fields to leave out", type=openapi.TYPE_STRING),
     ]
 
     @swagger_auto_schema(
@@ -66,34 +74,41 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
-
-# ------------------- PRODUCT -------------------
-class ProductPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = "page_size"
-    max_page_size = 100
+    @swagger_auto_schema(
+        operation_description="The whole category hierarchy with product counts, built from a single query.",
+    )
+    @action(detail=False, methods=["get"])
+    def tree(self, request):
+        return self.cached_response(request, lambda: Response(Category.tree()))
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+# ------------------- PRODUCT -------------------
+class ProductViewSet(ConditionalGetMixin, CachedCatalogMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all().order_by("-id")
     serializer_class = ProductSerializer
     permission_classes = [RolePermission]
+    replica_reads = True  # GETs may read from a replica (store/routers.py)
     allowed_roles = [User.UserRole.SELLER, User.UserRole.ADMIN]
-    owner_field = "seller"
-    pagination_class = StandardResultsSetPagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ["category", "price"]
+    pagination_class = CatalogPagination
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter, RelevanceOrderingFilter]
+    filterset_class = ProductFilter
     search_fields = ["name", "description"]
-    ordering_fields = ["price", "created_at"]
+    ordering_fields = ["price", "created_at", "relevance"]
     ordering = ["-created_at"]
 
     list_query_params = [
         openapi.Parameter('category', openapi.IN_QUERY, description="Filter by category ID", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('category_tree', openapi.IN_QUERY, description="Filter by category ID, including its sub-categories", type=openapi.TYPE_INTEGER),
         openapi.Parameter('price', openapi.IN_QUERY, description="Filter by price", type=openapi.TYPE_NUMBER),
-        openapi.Parameter('search', openapi.IN_QUERY, description="Search products", type=openapi.TYPE_STRING),
-        openapi.Parameter('ordering', openapi.IN_QUERY, description="Sort by price, created_at", type=openapi.TYPE_STRING),
+        openapi.Parameter('search', openapi.IN_QUERY, description="Search products (ranked full-text)", type=openapi.TYPE_STRING),
+        openapi.Parameter('ordering', openapi.IN_QUERY, description="Sort by price, created_at or relevance (with search)", type=openapi.TYPE_STRING),
         openapi.Parameter('page', openapi.IN_QUERY, description="Page number", type=openapi.TYPE_INTEGER),
         openapi.Parameter('page_size', openapi.IN_QUERY, description="Results per page", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('pagination', openapi.IN_QUERY, description="Set to 'cursor' for keyset pagination", type=openapi.TYPE_STRING),
+        openapi.Parameter('cursor', openapi.IN_QUERY, description="Opaque cursor from the next/previous links", type=openapi.TYPE_STRING),
+        openapi.Parameter('count', openapi.IN_QUERY, description="Cursor mode only: 'estimated' or 'cached' total count", type=openapi.TYPE_STRING),
+        openapi.Parameter('fields', openapi.IN_QUERY, description="Comma-separated fields to return, e.g. id,name,price,slug", type=openapi.TYPE_STRING),
+        openapi.Parameter('omit', openapi.IN_QUERY, description="Comma-separated fields to leave out", type=openapi.TYPE_STRING),
     ]
 
     @swagger_auto_schema(
@@ -104,12 +119,76 @@ class ProductViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    export_roles = [User.UserRole.SELLER]
+
+    @swagger_auto_schema(
+        operation_description="Stream the whole (filtered) catalog as CSV or NDJSON. Sellers and admins only.",
+        manual_parameters=[export_format_param, *list_query_params[:4]],
+    )
+    @action(detail=False, methods=["get"], permission_classes=[ExportPermission],
+            content_negotiation_class=ExportContentNegotiation)
+    def export(self, request):
+        file_format = request.query_params.get("as", "csv")
+        if file_format not in FORMATS:
+            return Response({"error": f"Unknown export format: {file_format}"}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response("products", self.filter_queryset(self.get_queryset()), file_format)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Create or update products in bulk, matched by SKU. Send a JSON array, or upload a CSV/NDJSON "
+            "`file` (needed for large imports). Rows that fail validation are reported and skipped."
+        ),
+    )
+    @action(detail=False, methods=["post"], url_path="import")
+    def import_products(self, request):
+        upload = request.FILES.get("file")
+        if upload is not None:
+            file_format = request.data.get("format") or upload.name.rsplit(".", 1)[-1].lower()
+            if file_format not in READERS:
+                return Response({"error": "Upload a .csv or .ndjson file."}, status=status.HTTP_400_BAD_REQUEST)
+            rows = READERS[file_format](upload)
+        elif isinstance(request.data, list):
+            rows = request.data
+        else:
+            return Response(
+                {"error": "Send a JSON array of products or upload a CSV/NDJSON file."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(import_products(rows))
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Change price, stock_quantity and/or is_active of many products (by id or sku) in one "
+            "transaction. The whole batch is rejected if any change is invalid."
+        ),
+        request_body=ProductChangeSerializer(many=True),
+    )
+    @action(detail=False, methods=["patch"], url_path="batch")
+    def batch_update(self, request):
+        # Permissions were checked once for the request; there are no per-object owners on products
+        changes = request.data.get("changes") if isinstance(request.data, dict) else request.data
+        serializer = ProductChangeSerializer(data=changes, many=True)
+        serializer.is_valid(raise_exception=True)
+        return Response({"updated": apply_product_changes(serializer.validated_data)})
+
+    @swagger_auto_schema(
+        operation_description="Category, price, rating and availability counts for the same filters as the list.",
+        manual_parameters=list_query_params[:4],
+    )
+    @action(detail=False, methods=["get"])
+    def facets(self, request):
+        key = catalog_key("products", "facets", params=facet_params(request.query_params))
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(get_or_compute(key, lambda: compute_facets(queryset)))
+
 
 # ------------------- AUTH -------------------
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_buckets = [("register", "ip")]
 
     @swagger_auto_schema(
         operation_description="Register a new user account.",
@@ -119,6 +198,12 @@ class RegisterView(generics.CreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
+class TokenObtainView(TokenObtainPairView):
+    # Every attempt hashes a password: limit per client and per account
+    throttle_classes = [TokenBucketThrottle]
+    throttle_buckets = [("login", "ip"), ("login_account", "username")]
+
+
 class MeView(generics.RetrieveAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -132,38 +217,107 @@ class MeView(generics.RetrieveAPIView):
         return Response(serializer.data)
 
     def get_object(self):
-        return self.request.user
+        return full_user(self.request.user)
 
 
 # ------------------- ORDER -------------------
 class OrderViewSet(viewsets.ModelViewSet):
+    """
+    Order history. Customers only ever see their own orders (admins see
+    all), newest first, with keyset pagination on the
+    (customer, -created_at, -id) index. A page with its lines, products,
+    payments and shipping is three queries.
+    """
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
-    permission_classes = [RolePermission]
+    permission_classes = [permissions.IsAuthenticated, RolePermission]
     allowed_roles = [User.UserRole.CUSTOMER]
     owner_field = "customer"
+    throttle_classes = [TokenBucketThrottle]
+    throttle_buckets = []  # set per action
+    pagination_class = KeysetPagination
+    filterset_fields = ["status"]
+    ordering_fields = ["created_at", "total_amount"]
+    ordering = ["-created_at"]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if getattr(self, "swagger_fake_view", False):  # schema generation, no user
+            return queryset.none()
+        if self.request.user.role != User.UserRole.ADMIN:
+            queryset = queryset.filter(customer_id=self.request.user.pk)
+        if self.action in ("list", "retrieve"):
+            queryset = queryset.select_related("shipping").prefetch_related(
+                Prefetch("items", queryset=OrderItem.objects.select_related("product").only(
+                    "id", "order_id", "quantity", "price", "product__id", "product__sku", "product__name", "product__slug",
+                ).order_by("pk")),
+                Prefetch("payments", queryset=Payment.objects.order_by("pk")),
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in ("list", "retrieve"):
+            return OrderHistorySerializer
+        return super().get_serializer_class()
 
     @swagger_auto_schema(
         operation_description="Place a new order. Calculates total automatically.",
         responses={201: OrderSerializer()},
     )
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], throttle_buckets=[("stk_push", "user"), ("mpesa_phone", "phone")])
     def confirm_payment(self, request, pk=None):
         order = self.get_object()
-        if order.is_paid:
+        if order.status == "paid":
             return Response({"message": "Order already paid."}, status=status.HTTP_400_BAD_REQUEST)
+        phone = request.data.get("phone")
+        if not phone:
+            return Response({"error": "Phone number is required for M-Pesa"}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Locked so the expired-reservation sweep cannot cancel it under us
+            order = Order.objects.select_for_update().filter(pk=order.pk).first()
+            if order.status != "pending":
+                return Response({"error": f"Order is {order.status}."}, status=status.HTTP_409_CONFLICT)
+            try:
+                renew_reservations(order)
+            except InsufficientStock as exc:
+                return Response(
+                    {"error": "Insufficient stock.", "products": exc.product_ids}, status=status.HTTP_409_CONFLICT,
+                )
+            payment = order.payments.filter(payment_method="mpesa", status="pending").first()
+            if payment is None:
+                payment = Payment.objects.create(
+                    order=order, payment_method="mpesa", amount=order.total_amount, transaction_id=str(uuid.uuid4()),
+                )
+            enqueue_stk_push(phone, order.total_amount, payment=payment, account_reference=f"Order{order.id}")
+        return Response({"message": "Payment initiated", "payment_id": payment.id}, status=status.HTTP_202_ACCEPTED)
 
-        response = initiate_stk_push(order)
-        return Response({"message": "Payment initiated", "mpesa_response": response})
+    @swagger_auto_schema(
+        operation_description="Stream every order line as CSV or NDJSON. Admins only.",
+        manual_parameters=[
+            export_format_param,
+            openapi.Parameter('status', openapi.IN_QUERY, description="Only orders with this status", type=openapi.TYPE_STRING),
+        ],
+    )
+    @action(detail=False, methods=["get"], permission_classes=[ExportPermission],
+            content_negotiation_class=ExportContentNegotiation)
+    def export(self, request):
+        file_format = request.query_params.get("as", "csv")
+        if file_format not in FORMATS:
+            return Response({"error": f"Unknown export format: {file_format}"}, status=status.HTTP_400_BAD_REQUEST)
+        lines = OrderItem.objects.all()
+        if request.query_params.get("status"):
+            lines = lines.filter(order__status=request.query_params["status"])
+        return export_response("orders", lines, file_format)
 
     @action(detail=True, methods=['post'])
     def mark_delivered(self, request, pk=None):
         order = self.get_object()
-        if not order.is_paid:
+        if order.status not in ("paid", "shipped"):
             return Response({"error": "Order must be paid before delivery."}, status=status.HTTP_400_BAD_REQUEST)
 
-        order.is_delivered = True
-        order.save()
+        order.status = "delivered"
+        order.save(update_fields=["status", "updated_at"])
         return Response({"message": "Order marked as delivered."}, status=status.HTTP_200_OK)
 
 
@@ -173,7 +327,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     permission_classes = [RolePermission]
     allowed_roles = [User.UserRole.CUSTOMER]
-    owner_field = "customer"
+    owner_field = "order__customer"
 
 
 # ------------------- REVIEW -------------------
@@ -181,116 +335,163 @@ class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [RolePermission]
+    replica_reads = True  # GETs may read from a replica (store/routers.py)
     allowed_roles = [User.UserRole.CUSTOMER]
-    owner_field = "customer"
+    owner_field = "user"
 
     def perform_create(self, serializer):
-        order = serializer.validated_data['order']
-        if not order.is_paid or not order.is_delivered:
-            raise ValueError("You can only review products from paid and delivered orders.")
-        serializer.save(user=self.request.user)
+        product = serializer.validated_data["product"]
+        delivered = OrderItem.objects.filter(order__customer_id=self.request.user.pk, order__status="delivered", product=product)
+        if not delivered.exists():
+            raise ValidationError("You can only review products from paid and delivered orders.")
+        serializer.save(user_id=self.request.user.pk)
 
 
 # ------------------- CHECKOUT -------------------
 class CheckoutView(generics.GenericAPIView):
+    """
+    Create an order, its items, its stock reservations and a pending payment
+    in one transaction. The number of queries does not depend on the number
+    of items: products are fetched together, stock is reserved with one
+    conditional UPDATE and rows are inserted with bulk_create.
+    """
     serializer_class = CheckoutSerializer
     permission_classes = [RolePermission]
-    allowed_roles = ["CUSTOMER"]
+    allowed_roles = [User.UserRole.CUSTOMER]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_buckets = [("checkout", "user"), ("checkout_ip", "ip"), ("mpesa_phone", "phone")]
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        items_data = serializer.validated_data["items"]
         payment_method = serializer.validated_data["payment_method"]
 
-        order = Order.objects.create(customer=request.user)
+        # Merge repeated lines for the same product
+        quantities = {}
+        for item in serializer.validated_data["items"]:
+            quantities[item["product"]] = quantities.get(item["product"], 0) + item["quantity"]
 
-        total_amount = 0
-        for item in items_data:
-            product = Product.objects.get(pk=item["product"].id)
-            quantity = item["quantity"]
-            OrderItem.objects.create(
-                order=order, product=product, quantity=quantity, price=product.price
+        products = Product.objects.filter(is_active=True).in_bulk(list(quantities))
+        missing = sorted(set(quantities) - set(products))
+        if missing:
+            return Response({"items": [f"Invalid product id {pk}." for pk in missing]}, status=status.HTTP_400_BAD_REQUEST)
+
+        total_amount = sum(products[pk].price * quantity for pk, quantity in quantities.items())
+
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(customer_id=request.user.pk, total_amount=total_amount)
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=products[pk], quantity=quantity, price=products[pk].price)
+                    for pk, quantity in quantities.items()
+                ])
+                reserve_stock(order, quantities)
+                payment = Payment.objects.create(
+                    order=order,
+                    payment_method=payment_method,
+                    amount=total_amount,
+                    status="pending",
+                    transaction_id=str(uuid.uuid4()),
+                )
+                if payment_method == "mpesa":
+                    # Sent by the outbox worker after commit; checkout never waits on Daraja
+                    enqueue_stk_push(
+                        serializer.validated_data["phone"], total_amount, payment=payment,
+                        account_reference=f"Order{order.id}",
+                    )
+        except InsufficientStock as exc:
+            return Response(
+                {"error": "Insufficient stock.", "products": exc.product_ids}, status=status.HTTP_409_CONFLICT
             )
-            total_amount += product.price * quantity
-
-        order.total_amount = total_amount
-        order.save()
-
-        payment = Payment.objects.create(
-            order=order,
-            payment_method=payment_method,
-            amount=total_amount,
-            status="pending",
-            transaction_id=str(uuid.uuid4()),
-        )
-
-        if payment_method == "mpesa":
-            phone = request.data.get("phone")
-            if not phone:
-                return Response({"error": "Phone number is required for M-Pesa"}, status=400)
-            mpesa_response = stk_push(phone, total_amount, payment.transaction_id)
-            return Response({
-                "order_id": order.id,
-                "total_amount": total_amount,
-                "payment_id": payment.id,
-                "payment_method": "mpesa",
-                "mpesa_response": mpesa_response
-            })
-
-        return Response({
+
+        data = {
             "order_id": order.id,
             "total_amount": total_amount,
             "payment_id": payment.id,
             "payment_method": payment_method,
-        })
+            "payment_status": payment.status,
+        }
+        return Response(data)
     
 # ------------------- M-PESA CALLBACKS -------------------
 class MpesaCallbackView(APIView):
-    def post(self, request, *args, **kwargs):
-        data = request.data
-        transaction_id = data.get("Body", {}).get("stkCallback", {}).get("CheckoutRequestID")
-        result_code = data.get("Body", {}).get("stkCallback", {}).get("ResultCode")
-        amount = data.get("Body", {}).get("stkCallback", {}).get("CallbackMetadata", {}).get("Item", [{}])[0].get("Value")
+    """
+    Receive STK push callbacks from Safaricom.
+    The raw callback is stored under a unique CheckoutRequestID and applied
+    with conditional UPDATEs in one transaction; retried deliveries are
+    acknowledged without doing the work again.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]  # Safaricom does not authenticate
 
+    def post(self, request, *args, **kwargs):
         try:
-            payment = Payment.objects.get(transaction_id=transaction_id)
-            if result_code == 0:
-                payment.status = "successful"
-                payment.paid_at = timezone.now()
-                payment.save()
-
-                order = payment.order
-                order.status = "paid"
-                order.save()
-            else:
-                payment.status = "failed"
-                payment.save()
-        except Payment.DoesNotExist:
-            pass
-
-        return Response({"status": "received"})
+            ingest_callback(request.data)
+        except InvalidCallback:
+            logger.warning("Rejected M-Pesa callback: %s", request.data)
+            return Response({"ResultCode": 1, "ResultDesc": "Invalid callback"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"ResultCode": 0, "ResultDesc": "Accepted"})
 
 
 class MpesaSTKPushView(APIView):
     permission_classes = [RolePermission]
     allowed_roles = [User.UserRole.CUSTOMER]
-    owner_field = "customer"
+    throttle_classes = [TokenBucketThrottle]
+    throttle_buckets = [("stk_push", "user"), ("stk_push_ip", "ip"), ("mpesa_phone", "phone")]
 
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter("phone_number", openapi.IN_QUERY, description="Customer phone number (2547...)", type=openapi.TYPE_STRING),
             openapi.Parameter("amount", openapi.IN_QUERY, description="Payment amount", type=openapi.TYPE_INTEGER),
         ],
-        responses={200: "STK Push initiated successfully"}
+        responses={202: "STK Push queued"}
     )
     def post(self, request):
-        phone = request.query_params.get("phone_number")
-        amount = request.query_params.get("amount")
-        if not phone or not amount:
-            return Response({"error": "phone_number and amount are required"}, status=400)
-
-        client = MpesaClient()
-        response = client.stk_push(phone, int(amount))
-        return Response(response)
+        serializer = StkPushSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        push = enqueue_stk_push(**serializer.validated_data, customer_id=request.user.pk)
+        return Response({"request_id": push.id, "status": push.status}, status=status.HTTP_202_ACCEPTED)
+
+
+def payment_requests_for(user):
+    """STK pushes `user` may look up: their own (see PaymentRequest.customer), or any for admins."""
+    pushes = PaymentRequest.objects.all()
+    if user.role != User.UserRole.ADMIN:
+        pushes = pushes.filter(customer_id=user.pk)
+    return pushes
+
+
+def payment_request_status(push):
+    # No CheckoutRequestID: with it, anyone could forge this push's callback
+    return {
+        "request_id": push.id,
+        "status": push.status,
+        "attempts": push.attempts,
+        "payment_id": push.payment_id,
+    }
+
+
+def gateway_status(result):
+    """Daraja's STK query answer, without the ids that identify the push."""
+    return {key: value for key, value in result.items() if key not in ("CheckoutRequestID", "MerchantRequestID")}
+
+
+class MpesaSTKPushStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter("live", openapi.IN_QUERY, description="Also ask Daraja for the push's current state", type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={200: "Outbox status of a queued STK Push"},
+    )
+    def get(self, request, pk):
+        push = generics.get_object_or_404(payment_requests_for(request.user), pk=pk)
+        data = payment_request_status(push)
+        if request.query_params.get("live") and push.checkout_request_id:
+            try:
+                data["gateway"] = gateway_status(get_client().stk_query(push.checkout_request_id))
+            except MpesaError as exc:
+                return Response({"error": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(data)